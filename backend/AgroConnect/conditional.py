@@ -0,0 +1,101 @@
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+'''
+conditional.py: Conditional GET (ETag / If-None-Match) for DRF list and detail endpoints
+ConditionalGetMixin: Answers list() and retrieve() with 304 Not Modified, without serializing,
+when the client's ETag is still current
+etag_matches(): Weak comparison of an ETag with the request's If-None-Match header
+mark_revalidate(): Cache-Control telling browsers to keep responses but revalidate them
+
+The ETag is a digest of cheap aggregates over the rows a response is built from, rather
+than of the response body: the row count plus, for each of `conditional_fields`, its
+maximum and the number of non-null values. Edits move a maximum (auto_now fields), and
+inserts and deletes move a count, so any change to those rows changes the tag.
+Representations that also depend on other data add it through get_conditional_extra().
+
+Only ETags are emitted. A Last-Modified date taken from updated_at could not reflect
+deletions, so clients relying on If-Modified-Since would get stale lists.
+'''
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # GET revalidation uses weak comparison (RFC 9110 13.1.2)
+    etags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    return '*' in etags or etag.removeprefix('W/') in etags
+
+
+def mark_revalidate(response):
+    # Authenticated API: browsers may keep the response but must revalidate it each time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(etag):
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response['ETag'] = etag
+    return mark_revalidate(response)
+
+
+class ConditionalGetMixin:
+    """
+    Mixin for generic views and viewsets adding ETags to list() and retrieve().
+
+    conditional_fields are aggregated over the list queryset (after filter_queryset) or over
+    the retrieved object's row, and may follow relations (e.g. 'response__updated_at').
+    """
+    conditional_fields = ('updated_at',)
+
+    def get_conditional_extra(self, queryset):
+        """
+        Extra values the representation depends on besides the rows in `queryset`.
+        """
+        return ()
+
+    def get_etag(self, queryset):
+        aggregates = {'rows': Count('pk')}
+        for index, field in enumerate(self.conditional_fields):
+            aggregates[f'max_{index}'] = Max(field)
+            aggregates[f'count_{index}'] = Count(field)
+        values = queryset.order_by().aggregate(**aggregates)
+
+        request = self.request
+        # The same URL gives different users different rows and unread counts
+        user_id = request.user.pk if request.user.is_authenticated else None
+        raw = repr((
+            request.build_absolute_uri(),
+            user_id,
+            sorted(values.items()),
+            tuple(self.get_conditional_extra(queryset)),
+        ))
+        return 'W/"' + hashlib.md5(raw.encode()).hexdigest() + '"'
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_etag(self.filter_queryset(self.get_queryset()))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            mark_revalidate(response)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        # get_object() also runs the object permission checks
+        instance = self.get_object()
+        etag = self.get_etag(type(instance)._default_manager.filter(pk=instance.pk))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        serializer = self.get_serializer(instance)
+        response = Response(serializer.data)
+        response['ETag'] = etag
+        return mark_revalidate(response)
@@ -257,6 +257,9 @@ DJOSER = {
         # Custom serializer for user details - handles how user data is serialized when retrieving user information
         'user': 'users.serializers.UserDetailSerializer',
         
+        # Signed-in user's own profile (/auth/users/me/), including the farm location
+        'current_user': 'users.serializers.CurrentUserSerializer',
+        
         # Default Djoser serializer for user deletion - handles user account deletion
         'user_delete': 'djoser.serializers.UserDeleteSerializer',
     },
@@ -301,4 +304,135 @@ CHANNEL_LAYERS = {
         #     "hosts": [('127.0.0.1', 6379)],
         # },
     },
-}
\ No newline at end of file
+}
+
+# Chat typing indicator throttling
+# Minimum number of seconds between two typing broadcasts from the same connection
+CHAT_TYPING_MIN_INTERVAL = 1.0
+# Seconds without a typing frame after which the user is marked as stopped typing
+CHAT_TYPING_TIMEOUT = 5.0
+
+# Maximum number of missed messages replayed when a chat WebSocket reconnects
+CHAT_CATCH_UP_LIMIT = 200
+
+# Batched read receipts: seconds between database flushes, and the number of
+# pending rooms that forces an immediate flush
+CHAT_READ_RECEIPT_FLUSH_INTERVAL = 2.0
+CHAT_READ_RECEIPT_MAX_PENDING = 500
+
+# Encoder for WebSocket frames (dotted path to a callable returning str).
+# Use 'chat.encoding.orjson_dumps' when orjson is installed.
+CHAT_JSON_ENCODER = 'chat.encoding.json_dumps'
+
+# Maximum number of frames queued per chat WebSocket before a slow client is disconnected
+CHAT_SEND_QUEUE_SIZE = 100
+
+# Chat archival (python manage.py archive_chat_messages)
+# Read messages in rooms with a finished order and no activity for this many days
+# are moved to the ArchivedChatMessage table
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_ROOM_STATUSES = ['delivered', 'completed']
+
+# Seconds an Idempotency-Key sent to chat room creation is remembered
+CHAT_IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Post-checkout chat messages reference the product image by URL. Set
+# CHAT_COPY_PRODUCT_IMAGES to also keep a local copy, downloaded in the background
+# from the listed hosts only, with (connect, read) timeouts and a size cap
+CHAT_COPY_PRODUCT_IMAGES = False
+CHAT_PRODUCT_IMAGE_HOSTS = ['res.cloudinary.com']
+CHAT_PRODUCT_IMAGE_TIMEOUT = (3, 10)
+CHAT_PRODUCT_IMAGE_MAX_BYTES = 5 * 1024 * 1024
+
+# Chat attachments are stored once per distinct file (chat/storage.py); blobs no
+# message uses any more are deleted by gc_chat_media after this many hours
+CHAT_MEDIA_GC_GRACE_HOURS = 24
+
+# Chat presence: each server process refreshes its WebSocket connections every
+# heartbeat interval; connections not refreshed within the TTL (crashed processes)
+# are expired and their users reported offline
+CHAT_PRESENCE_HEARTBEAT_INTERVAL = 30
+CHAT_PRESENCE_TTL = 90
+
+# Chat transcript exports are streamed in chunks of about this many bytes
+CHAT_EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Product search (products/search.py): query words that are not the start of any known
+# word are widened with vocabulary words at least this similar (0-1); the vocabulary is
+# cached for this many seconds
+PRODUCT_SEARCH_TYPO_CUTOFF = 0.75
+PRODUCT_SEARCH_VOCABULARY_TTL = 300
+
+# Marketplace response cache (products/cache.py): catalogue pages and product details
+# are cached for MARKETPLACE_CACHE_TTL seconds and invalidated on product and farmer
+# changes. Local memory by default; set MARKETPLACE_CACHE_URL (redis://...) to share
+# the cache, and its invalidation, between server processes
+MARKETPLACE_CACHE_ALIAS = 'marketplace'
+MARKETPLACE_CACHE_TTL = 300
+MARKETPLACE_CACHE_URL = getenv('MARKETPLACE_CACHE_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    MARKETPLACE_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': MARKETPLACE_CACHE_URL,
+        'TIMEOUT': MARKETPLACE_CACHE_TTL,
+    } if MARKETPLACE_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'marketplace',
+        'TIMEOUT': MARKETPLACE_CACHE_TTL,
+    },
+}
+
+# Nearby products (products/nearby.py): default and largest search radius in km
+NEARBY_DEFAULT_RADIUS_KM = 30
+NEARBY_MAX_RADIUS_KM = 300
+
+# Bulk product imports (products/bulk.py): JSON requests may hold at most
+# PRODUCT_BULK_MAX_ROWS products; CSV uploads larger than PRODUCT_IMPORT_SYNC_MAX_BYTES
+# are imported by PRODUCT_IMPORT_WORKERS background threads. Rows are written
+# PRODUCT_IMPORT_BATCH_SIZE at a time and at most PRODUCT_IMPORT_MAX_ERRORS row errors
+# are reported
+PRODUCT_BULK_MAX_ROWS = 500
+PRODUCT_IMPORT_SYNC_MAX_BYTES = 256 * 1024
+PRODUCT_IMPORT_WORKERS = 1
+PRODUCT_IMPORT_BATCH_SIZE = 500
+PRODUCT_IMPORT_MAX_ERRORS = 100
+
+# Stock reservations (orders/stock.py): stock ordered through create-payment-intent is
+# held this long for the payment to be authorized; run release_stock_holds periodically
+# to release expired holds
+STOCK_HOLD_MINUTES = 30
+
+# Top rated products (ProductViewSet.top_rated): products need at least this many
+# approved ratings to be listed, unless ?min_reviews= says otherwise
+TOP_RATED_MIN_REVIEWS = 3
+
+# Related products (products/recommendations.py): list length, and how often each
+# server process reloads the lists computed by the refresh_recommendations command
+RECOMMENDATION_NEIGHBOURS = 12
+RECOMMENDATION_RELOAD_SECONDS = 300
+
+# Resized product images (products/images.py): images on PRODUCT_IMAGE_HOSTS are also
+# served no larger than each of PRODUCT_IMAGE_SIZES (longest side in pixels), as WebP.
+# Sources are downloaded once, with (connect, read) timeouts and size caps, and the
+# copies kept in PRODUCT_IMAGE_CACHE_DIR, least recently used deleted beyond
+# PRODUCT_IMAGE_CACHE_MAX_BYTES. Sources that fail are retried after
+# PRODUCT_IMAGE_RETRY_SECONDS; clients may cache copies for PRODUCT_IMAGE_MAX_AGE seconds
+PRODUCT_IMAGE_SIZES = {'thumb': 200, 'small': 400, 'medium': 800}
+PRODUCT_IMAGE_HOSTS = ['res.cloudinary.com']
+PRODUCT_IMAGE_TIMEOUT = (3, 10)
+PRODUCT_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+PRODUCT_IMAGE_MAX_PIXELS = 40_000_000
+PRODUCT_IMAGE_QUALITY = 80
+PRODUCT_IMAGE_CACHE_DIR = os.path.join(BASE_DIR, 'image_cache')
+PRODUCT_IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+PRODUCT_IMAGE_RETRY_SECONDS = 300
+PRODUCT_IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Bulk product imports (products/bulk.py): background imports still unfinished this
+# long after their upload were interrupted by a restart; the recover_product_imports
+# command runs them again. Keep it above the longest import, queue wait included
+PRODUCT_IMPORT_STALE_MINUTES = 60
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import ChatRoom, ChatMessage
+from django.db.models import Q
+from .models import ChatRoom, ChatMessage, ArchivedChatMessage
+from .search import search_messages
 
 # Register your models here.
 
@@ -14,11 +16,34 @@ class ChatRoomAdmin(admin.ModelAdmin):
 class ChatMessageAdmin(admin.ModelAdmin):
     list_display = ('sender', 'room', 'short_message', 'is_read', 'timestamp')
     list_filter = ('is_read', 'timestamp')
-    search_fields = ('message', 'sender__name', 'room__room_id')
+    # Searches go through the full-text index and the room_id unique index instead of
+    # ILIKE scans (see get_search_results)
+    search_fields = ('message', 'room__room_id')
     date_hierarchy = 'timestamp'
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # Message text by full-text search, or every message of a room by its exact room_id
+        matches = search_messages(queryset, search_term)
+        return queryset.filter(Q(pk__in=matches.values('pk')) | Q(room__room_id=search_term)), False
+
     def short_message(self, obj):
         return obj.message[:50] + '...' if len(obj.message) > 50 else obj.message
     short_message.short_description = 'Message'
 
+@admin.register(ArchivedChatMessage)
+class ArchivedChatMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'sender', 'room', 'timestamp', 'archived_at')
+    list_filter = ('archived_at',)
+    date_hierarchy = 'timestamp'
+
+    # Archived history is read-only; rows are only written by archive_chat_messages
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # ChatNotification admin has been removed
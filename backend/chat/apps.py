@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_index(sender, using, **kwargs):
+    # SQLite table rebuilds during migrations drop the full-text triggers; recreate them
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    from .search import ensure_sqlite_fts
+
+    if connections[using].vendor != 'sqlite':
+        return
+    applied = MigrationRecorder(connections[using]).applied_migrations()
+    if ('chat', '0010_chatmessage_search_index') in applied:
+        ensure_sqlite_fts(using)
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        import chat.signals
+        post_migrate.connect(ensure_search_index, sender=self)
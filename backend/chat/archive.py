@@ -0,0 +1,169 @@
+import heapq
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from orders.models import OrderStatus
+from .models import ChatMessage, ArchivedChatMessage
+from .storage import add_references
+
+logger = logging.getLogger(__name__)
+
+'''
+archive.py: Moves old chat messages out of the hot ChatMessage table
+archivable_messages(): Messages that may be archived (finished, inactive rooms)
+archive_batch(): Moves one bounded batch into ArchivedChatMessage
+room_history(): Archived and live messages of a room, oldest first
+iter_room_history(): The same, streamed from database cursors for exports of any length
+
+A room is eligible once its order is finished (CHAT_ARCHIVE_ROOM_STATUSES) and it has
+had no new message for CHAT_ARCHIVE_AFTER_DAYS. Only read messages are moved, so unread
+counts and read receipts keep working on ChatMessage alone. Archived rows keep their
+original id; image files stay in place and only their storage names are copied.
+'''
+
+
+def get_cutoff(days=None):
+    """
+    Messages older than this are candidates for archiving.
+    """
+    if days is None:
+        days = getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 90)
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable_messages(cutoff):
+    """
+    Queryset of read messages in finished rooms with no activity since `cutoff`.
+    """
+    statuses = getattr(
+        settings, 'CHAT_ARCHIVE_ROOM_STATUSES', [OrderStatus.DELIVERED, OrderStatus.COMPLETED]
+    )
+    recent_activity = ChatMessage.objects.filter(room=OuterRef('room'), timestamp__gte=cutoff)
+
+    return ChatMessage.objects.filter(
+        room__order_status__in=statuses,
+        room__updated_at__lt=cutoff,
+        timestamp__lt=cutoff,
+        is_read=True,
+    ).exclude(
+        Exists(recent_activity)
+    )
+
+
+def build_archived_message(message):
+    """
+    Copy a ChatMessage (with prefetched images) into an unsaved ArchivedChatMessage.
+    """
+    return ArchivedChatMessage(
+        id=message.id,
+        room_id=message.room_id,
+        sender_id=message.sender_id,
+        message=message.message,
+        image=message.image.name if message.image else None,
+        image_url=message.image_url,
+        images=[
+            {'image': img.image.name, 'uploaded_at': img.uploaded_at.isoformat()}
+            for img in message.images.all()
+        ],
+        is_read=message.is_read,
+        timestamp=message.timestamp,
+    )
+
+
+def archived_image_names(archived):
+    """
+    Storage names of all images used by unsaved or saved ArchivedChatMessage rows.
+    """
+    names = []
+    for message in archived:
+        if message.image:
+            names.append(message.image.name)
+        names.extend(img['image'] for img in message.images)
+    return names
+
+
+def archive_batch(cutoff, batch_size=500):
+    """
+    Move up to `batch_size` archivable messages, oldest first, in one transaction.
+
+    Returns the number of messages moved (0 when there is nothing left to do).
+    """
+    with transaction.atomic():
+        candidates = archivable_messages(cutoff).order_by('id')
+        # Let a second archiver (or a concurrent edit) skip rows this one is moving
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True, of=('self',))
+
+        messages = list(candidates.prefetch_related('images')[:batch_size])
+        if not messages:
+            return 0
+
+        archived = [build_archived_message(message) for message in messages]
+        # ignore_conflicts skips rows already archived (their live row was left behind);
+        # those hold their blob references already, so they must not be counted again
+        already_archived = set(
+            ArchivedChatMessage.objects.filter(id__in=[message.id for message in archived]).values_list('id', flat=True)
+        )
+        ArchivedChatMessage.objects.bulk_create(archived, ignore_conflicts=True)
+        # bulk_create sends no signals, so count the inserted rows' blob references here;
+        # the delete below releases the live rows' references through post_delete
+        add_references(archived_image_names(
+            message for message in archived if message.id not in already_archived
+        ))
+        # Deleting cascades to ChatMessageImage rows; the files themselves are kept
+        ChatMessage.objects.filter(id__in=[message.id for message in messages]).delete()
+
+    logger.info(f"Archived {len(messages)} chat messages (up to id {messages[-1].id})")
+    return len(messages)
+
+
+def has_archived_messages(room):
+    """
+    Whether any of the room's history lives in the archive table.
+    """
+    return ArchivedChatMessage.objects.filter(room=room).exists()
+
+
+def room_history(room):
+    """
+    All messages of `room` from both tables, merged by timestamp (then id).
+
+    Live rows are ChatMessage instances and archived rows ArchivedChatMessage instances
+    (see serialize_history in serializers.py).
+    """
+    live = ChatMessage.objects.filter(room=room).select_related('sender').prefetch_related('images').order_by('timestamp', 'id')
+    if not has_archived_messages(room):
+        return list(live)
+
+    archived = ArchivedChatMessage.objects.filter(room=room).select_related('sender').order_by('timestamp', 'id')
+    return list(heapq.merge(archived, live, key=lambda message: (message.timestamp, message.id)))
+
+
+def iter_room_history(room, chunk_size=2000):
+    """
+    Generator version of room_history that holds at most one chunk per table in memory.
+
+    Both tables are read through .iterator() (server-side cursors on PostgreSQL) and
+    merged lazily; images of live messages are prefetched per chunk.
+    """
+    live = ChatMessage.objects.filter(room=room).select_related('sender').prefetch_related('images').order_by('timestamp', 'id')
+    if not has_archived_messages(room):
+        yield from live.iterator(chunk_size=chunk_size)
+        return
+
+    archived = ArchivedChatMessage.objects.filter(room=room).select_related('sender').order_by('timestamp', 'id')
+    yield from heapq.merge(
+        archived.iterator(chunk_size=chunk_size),
+        live.iterator(chunk_size=chunk_size),
+        key=lambda message: (message.timestamp, message.id)
+    )
+
+
+def latest_archived_message(room):
+    """
+    The newest archived message of `room`, or None.
+    """
+    return ArchivedChatMessage.objects.filter(room=room).order_by('-timestamp').first()
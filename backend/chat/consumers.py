@@ -1,10 +1,17 @@
 import json
+import asyncio
+import time
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import TokenError
 from .models import ChatRoom, ChatMessage, ChatMessageImage #OrderStatus
+from .typing_throttle import TypingThrottle, SEND, DEFER
+from .encoding import encode, absolute_media_url
+from .send_queue import OutboundQueue
+from . import metrics, read_receipts, presence, order_board
 import base64
 import uuid
 from django.core.files.base import ContentFile
@@ -20,15 +27,62 @@ connect(): Authenticates and authorizes WebSocket connections
 receive(): Processes incoming messages
 disconnect(): Cleans up connections
 Handles typing indicators and order status updates
+Typing frames are throttled: only state changes are broadcast, at most once per
+CHAT_TYPING_MIN_INTERVAL, and typing stops automatically after CHAT_TYPING_TIMEOUT
+Reconnecting clients pass last_seen_message_id to receive only the messages they missed
+Read receipts ({"read_up_to": id}) are batched by read_receipts.py and broadcast as read_receipt events
+Group events carry a pre-encoded 'text' frame built once by the sender; handlers forward it unchanged
+Handlers queue frames in a bounded OutboundQueue drained by a writer task, so a slow client
+cannot stall delivery; clients that overflow it are closed with code 4008
+Presence (presence.py): each connection is registered on connect, and "presence" frames tell
+a client when the other participant comes online, enters or leaves the room, or goes offline
+OrderBoardConsumer: Pushes new and changed orders to the farmer's order board
 '''
 
 
+def build_message_event(message, sender_name, image_urls):
+    """
+    Build the group event for a chat message, with absolute image URLs and the frame already encoded
+    """
+    return {
+        'type': 'message',
+        'message_id': message.id,
+        'text': encode({
+            'type': 'message',
+            'message_id': message.id,
+            'message': message.message,
+            'sender_id': message.sender_id,
+            'sender_name': sender_name,
+            'timestamp': message.timestamp.isoformat(),
+            'image': absolute_media_url(message.image.url) if message.image else None,
+            'all_image_urls': [absolute_media_url(url) for url in image_urls]
+        })
+    }
+
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Handles initial connection with JWT auth and room access checks
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
         
+        # Typing indicator state for this connection
+        self.typing_throttle = TypingThrottle(
+            min_interval=getattr(settings, 'CHAT_TYPING_MIN_INTERVAL', 1.0)
+        )
+        self.typing_timeout = getattr(settings, 'CHAT_TYPING_TIMEOUT', 5.0)
+        self.typing_deadline = None
+        self.typing_timeout_task = None
+        self.typing_flush_task = None
+        
+        # Highest message id already replayed to this connection on reconnect
+        self.catch_up_last_id = 0
+        
+        # Outbound frames from group events, written by writer_task
+        self.outbound = OutboundQueue(max_size=getattr(settings, 'CHAT_SEND_QUEUE_SIZE', 100))
+        self.writer_task = None
+        
         # Get token from query params
         query_string = self.scope.get('query_string', b'').decode('utf-8')
         query_params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
@@ -67,9 +121,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             # User-specific notification group has been removed
             await self.accept()
+            self.writer_task = asyncio.create_task(self.write_outbound())
+            
+            # Replay messages the client missed while it was offline
+            last_seen_message_id = query_params.get('last_seen_message_id')
+            if last_seen_message_id is not None:
+                await self.send_missed_messages(last_seen_message_id)
             
             # Mark messages as read when user connects to room
-            await self.mark_messages_as_read()
+            await self.mark_read_up_to()
+            
+            # Announce the user to watching peers and show them the other participant's state
+            await self.join_presence()
             
             logger.info(f"User {self.user.id} connected to room {self.room_id}")
             
@@ -83,6 +146,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         # Cleans up group memberships on disconnect
         try:
+            # Stop typing timers and tell the room this user is no longer typing
+            await self.stop_typing_tasks()
+            
+            # Stop writing queued frames
+            if hasattr(self, 'outbound'):
+                self.outbound.close()
+            if getattr(self, 'writer_task', None) is not None:
+                self.writer_task.cancel()
+            
             # Leave room group
             if hasattr(self, 'room_group_name'):
                 await self.channel_layer.group_discard(
@@ -90,7 +162,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     self.channel_name
                 )
             
-            # Remove user from active users set
+            # Remove the connection from presence and tell watching peers
+            if getattr(self, 'presence_joined', False):
+                presence.stop_heartbeat(self.channel_name)
+                events = await database_sync_to_async(presence.disconnect)(self.channel_name)
+                await presence.send_events(self.channel_layer, events)
+            
             if hasattr(self, 'user') and hasattr(self, 'room_id'):
                 logger.info(f"User {self.user.id} disconnected from room {self.room_id}")
             
@@ -104,15 +181,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             # Handle typing status
             if 'is_typing' in data:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'typing_status',
-                        'user_id': self.user.id,
-                        'is_typing': data['is_typing']
-                    }
-                )
-                return # The return exits the method immediately after broadcasting the typing status
+                await self.handle_typing(data['is_typing'])
+                return # The return exits the method immediately after handling the typing status
+            
+            # Handle read receipt
+            if 'read_up_to' in data:
+                await self.mark_read_up_to(data['read_up_to'])
+                return
             
             # Handle order status update
             if 'order_status' in data:
@@ -124,10 +199,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     self.room_group_name,
                     {
                         'type': 'order_status_update',
-                        'room_id': self.room_id,
-                        'status': new_status,
-                        'updated_by': self.user.id,
-                        'updated_by_name': self.user.full_name
+                        'text': encode({
+                            'type': 'order_status_update',
+                            'room_id': self.room_id,
+                            'status': new_status,
+                            'updated_by': self.user.id,
+                            'updated_by_name': self.user.full_name
+                        })
                     }
                 )
                 return
@@ -158,19 +236,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # Get all image URLs for the message
             all_image_urls = await self.get_message_image_urls(message)
             
-            # Send message to room group
+            # Send message to room group, encoded once for every recipient
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'message',
-                    'message_id': message.id,
-                    'message': message.message,
-                    'sender_id': self.user.id,
-                    'sender_name': self.user.full_name,
-                    'timestamp': message.timestamp.isoformat(),
-                    'image': message.image.url if message.image else None,
-                    'all_image_urls': all_image_urls
-                }
+                build_message_event(message, self.user.full_name, all_image_urls)
             )
         except json.JSONDecodeError:
             logger.error("Invalid JSON received")
@@ -179,71 +248,235 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
 
     
+    async def handle_typing(self, is_typing):
+        """
+        Throttle an incoming typing frame before it is broadcast to the room
+        """
+        is_typing = bool(is_typing)
+        metrics.increment('chat.typing.frames_received')
+        
+        # Every "typing" frame pushes back the automatic stop
+        if is_typing:
+            self.typing_deadline = time.monotonic() + self.typing_timeout
+            if self.typing_timeout_task is None:
+                self.typing_timeout_task = asyncio.create_task(self.typing_timeout_watcher())
+        else:
+            self.typing_deadline = None
+        
+        decision = self.typing_throttle.submit(is_typing)
+        
+        if decision == SEND:
+            await self.broadcast_typing(is_typing)
+            return
+        
+        metrics.increment('chat.typing.frames_suppressed')
+        
+        # A state change arrived inside the minimum interval; send it once the interval has passed
+        if decision == DEFER and self.typing_flush_task is None:
+            self.typing_flush_task = asyncio.create_task(
+                self.flush_typing(self.typing_throttle.retry_in())
+            )
+    
+    async def broadcast_typing(self, is_typing):
+        """
+        Send the typing state to the room group and record it as sent
+        """
+        self.typing_throttle.mark_sent(is_typing)
+        metrics.increment('chat.typing.events_sent')
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_status',
+                'user_id': self.user.id,
+                'text': encode({
+                    'type': 'typing_status',
+                    'user_id': self.user.id,
+                    'is_typing': is_typing
+                })
+            }
+        )
+    
+    async def flush_typing(self, delay):
+        """
+        Broadcast a deferred typing state change after `delay` seconds
+        """
+        try:
+            await asyncio.sleep(delay)
+            pending = self.typing_throttle.pending()
+            if pending is not None:
+                await self.broadcast_typing(pending)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.typing_flush_task = None
+    
+    async def typing_timeout_watcher(self):
+        """
+        Mark the user as stopped typing once no typing frame arrived for CHAT_TYPING_TIMEOUT seconds
+        """
+        try:
+            while self.typing_deadline is not None:
+                remaining = self.typing_deadline - time.monotonic()
+                if remaining <= 0:
+                    self.typing_deadline = None
+                    decision = self.typing_throttle.submit(False)
+                    if decision == SEND:
+                        await self.broadcast_typing(False)
+                    elif decision == DEFER and self.typing_flush_task is None:
+                        self.typing_flush_task = asyncio.create_task(
+                            self.flush_typing(self.typing_throttle.retry_in())
+                        )
+                    break
+                await asyncio.sleep(remaining)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.typing_timeout_task = None
+    
+    async def stop_typing_tasks(self):
+        """
+        Cancel typing timers and broadcast "stopped typing" if the user was typing
+        """
+        if not hasattr(self, 'typing_throttle'):
+            return
+        
+        self.typing_deadline = None
+        for task in (self.typing_timeout_task, self.typing_flush_task):
+            if task is not None:
+                task.cancel()
+        
+        if self.typing_throttle.sent_state and hasattr(self, 'user'):
+            await self.broadcast_typing(False)
+    
+    async def queue_frame(self, text, coalesce_key=None):
+        """
+        Queue a frame for the writer task; close the connection if the client cannot keep up
+        """
+        if self.outbound.put(text, coalesce_key):
+            return
+        
+        logger.warning(f"Send queue overflow for user {self.user.id} in room {self.room_id}, disconnecting")
+        metrics.increment('chat.send_queue.disconnects')
+        self.outbound.close()
+        await self.close(code=4008)
+    
+    async def write_outbound(self):
+        """
+        Write queued frames to the WebSocket one at a time
+        """
+        try:
+            while True:
+                text = await self.outbound.get()
+                await self.send(text_data=text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error writing to WebSocket: {str(e)}")
+    
     async def typing_status(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing_status',
-            'user_id': event['user_id'],
-            'is_typing': event['is_typing']
+        # Only the latest typing state per user matters
+        await self.queue_frame(event['text'], coalesce_key=('typing', event['user_id']))
+    
+    async def send_missed_messages(self, last_seen_message_id):
+        """
+        Send every message newer than `last_seen_message_id`, followed by a catch_up_complete frame.
+        
+        The room group is joined before the lookup, so nothing is lost in between; live events
+        for messages already replayed here are skipped by message().
+        """
+        try:
+            last_seen_message_id = int(last_seen_message_id)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid last_seen_message_id: {last_seen_message_id}")
+            return
+        
+        limit = getattr(settings, 'CHAT_CATCH_UP_LIMIT', 200)
+        events, has_more = await self.get_missed_message_events(last_seen_message_id, limit)
+        
+        # Written directly: group events are not dispatched until connect() returns,
+        # so the outbound queue is still empty and ordering is preserved
+        for event in events:
+            await self.send(text_data=event['text'])
+        
+        if events:
+            self.catch_up_last_id = events[-1]['message_id']
+        
+        # has_more tells the client to reconnect with the new last_message_id to continue
+        await self.send(text_data=encode({
+            'type': 'catch_up_complete',
+            'count': len(events),
+            'has_more': has_more,
+            'last_message_id': self.catch_up_last_id or last_seen_message_id
         }))
     
     async def message(self, event):
         """
         Send message to WebSocket
         """
-        try:
-            # Get the base URL for media files
-            from django.conf import settings
-            media_url = settings.MEDIA_URL
-            base_url = getattr(settings, 'BASE_URL', 'http://localhost:8000')
-            
-            # Process image URLs to ensure they are absolute
-            image_url = event.get('image')
-            if image_url and not image_url.startswith(('http://', 'https://')):
-                # If it's a relative URL, make it absolute
-                if image_url.startswith('/'):
-                    image_url = f"{base_url}{image_url}"
-                else:
-                    image_url = f"{base_url}/{image_url}"
-            
-            # Process all image URLs to ensure they are absolute
-            all_image_urls = event.get('all_image_urls', [])
-            processed_urls = []
-            
-            for url in all_image_urls:
-                if url and not url.startswith(('http://', 'https://')):
-                    # If it's a relative URL, make it absolute
-                    if url.startswith('/'):
-                        processed_urls.append(f"{base_url}{url}")
-                    else:
-                        processed_urls.append(f"{base_url}/{url}")
-                else:
-                    processed_urls.append(url)
-            
-            # Send message to WebSocket
-            await self.send(text_data=json.dumps({
-                'type': 'message',
-                'message_id': event['message_id'],
-                'message': event['message'],
-                'sender_id': event['sender_id'],
-                'sender_name': event['sender_name'],
-                'timestamp': event['timestamp'],
-                'image': image_url,
-                'all_image_urls': processed_urls
-            }))
-        except Exception as e:
-            logger.error(f"Error in message handler: {str(e)}")
+        # Already delivered by the reconnect catch-up
+        if event['message_id'] <= self.catch_up_last_id:
+            return
+        
+        await self.queue_frame(event['text'])
+    
+    async def mark_read_up_to(self, up_to_message_id=None):
+        """
+        Move the current user's read watermark forward and tell the other participant
+        """
+        if up_to_message_id is not None:
+            try:
+                up_to_message_id = int(up_to_message_id)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid read_up_to value: {up_to_message_id}")
+                return
+        
+        watermark = await self.mark_messages_as_read(up_to_message_id)
+        if watermark is None:
+            return
+        
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            read_receipts.build_read_receipt_event(self.user.id, watermark)
+        )
+    
+    async def read_receipt(self, event):
+        """
+        Send a read receipt to the other participant's WebSocket
+        """
+        # The reader already knows what they have read
+        if event['user_id'] == self.user.id:
+            return
+        
+        # Only the highest watermark per user matters
+        await self.queue_frame(event['text'], coalesce_key=('read', event['user_id']))
+    
+    async def join_presence(self):
+        """
+        Register this connection for presence and send the other participant's current state
+        """
+        events = await database_sync_to_async(presence.connect)(self.channel_name, self.user.id, self.room_pk)
+        self.presence_joined = True
+        presence.start_heartbeat(self.channel_layer, self.channel_name)
+        await presence.send_events(self.channel_layer, events)
+        
+        frame = await database_sync_to_async(presence.peer_presence_frame)(self.peer_id, self.room_pk)
+        await self.queue_frame(frame, coalesce_key=('presence', self.peer_id))
+    
+    async def presence(self, event):
+        """
+        Send the other participant's presence change to WebSocket
+        """
+        if event['user_id'] == self.user.id:
+            return
+        
+        # Only the latest state per user matters
+        await self.queue_frame(event['text'], coalesce_key=('presence', event['user_id']))
     
     async def order_status_update(self, event):
         """
         Send order status update to WebSocket
         """
-        await self.send(text_data=json.dumps({
-            'type': 'order_status_update',
-            'room_id': event['room_id'],
-            'status': event['status'],
-            'updated_by': event['updated_by'],
-            'updated_by_name': event['updated_by_name']
-        }))
+        await self.queue_frame(event['text'])
     
 
     
@@ -259,6 +492,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             # Use room_id field instead of id for lookup
             room = ChatRoom.objects.get(room_id=room_id)
+            # Keep the primary key for later per-room lookups
+            self.room_pk = room.pk
+            self.peer_id = room.farmer_id if user_id == room.customer_id else room.customer_id
             return room.customer_id == user_id or room.farmer_id == user_id
         except ChatRoom.DoesNotExist:
             logger.error(f"Chat room with room_id {room_id} does not exist")
@@ -335,6 +571,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """
         Get all image URLs for a message including the main image and additional images
         """
+        return self.collect_image_urls(message)
+    
+    @database_sync_to_async
+    def get_missed_message_events(self, last_seen_message_id, limit):
+        """
+        Build message events for up to `limit` messages newer than `last_seen_message_id`.
+        
+        Returns the events (oldest first) and whether more messages are waiting.
+        """
+        messages = list(
+            ChatMessage.objects.filter(
+                room__room_id=self.room_id,
+                id__gt=last_seen_message_id
+            ).select_related('sender').prefetch_related('images').order_by('id')[:limit + 1]
+        )
+        has_more = len(messages) > limit
+        
+        events = [
+            build_message_event(message, message.sender.full_name, self.collect_image_urls(message))
+            for message in messages[:limit]
+        ]
+        return events, has_more
+    
+    def collect_image_urls(self, message):
+        """
+        Collect the main image URL and all additional image URLs of a message
+        """
         image_urls = []
         
         # Add main image if it exists
@@ -345,6 +608,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             except Exception as e:
                 logger.error(f"Error getting main image URL: {str(e)}")
         
+        # Add image referenced by URL (e.g. product image in post-checkout messages)
+        if message.image_url:
+            image_urls.append(message.image_url)
+        
         # Add additional images
         for img in message.images.all():
             try:
@@ -416,31 +683,83 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return None
 
     @database_sync_to_async
-    def mark_messages_as_read(self):
+    def mark_messages_as_read(self, up_to_message_id=None):
         """
-        Mark all messages in the room as read for the current user
+        Record that the current user has read the room up to `up_to_message_id` (default: latest message).
+        
+        The database write is batched by read_receipts; returns the new watermark or None if unchanged.
         """
         try:
-            room = ChatRoom.objects.get(room_id=self.room_id)
-            
-            # Get the other user
-            other_user = room.farmer if self.user.id == room.customer.id else room.customer
-            
-            # Mark messages from the other user as read
-            updated = ChatMessage.objects.filter(
-                room=room,
-                sender=other_user,
-                is_read=False
-            ).update(is_read=True)
-            
-            # Update room's unread status
-            if self.user.id == room.customer.id:
-                room.has_unread_customer = False
-            else:
-                room.has_unread_farmer = False
-            room.save()
-            
-            return updated
+            return read_receipts.mark_read(self.room_pk, self.user.id, up_to_message_id)
         except Exception as e:
             logger.error(f"Error marking messages as read: {str(e)}")
-            return 0
\ No newline at end of file
+            return None
+
+
+class OrderBoardConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes order board changes (order_board.py) to a farmer's dashboard
+    
+    Frames are {"type": "order_board", "action": "upsert" | "remove", "room": {...}};
+    clients insert or replace the room by id and place it using its priority,
+    is_new_order and updated_at.
+    """
+    async def connect(self):
+        self.outbound = OutboundQueue(max_size=getattr(settings, 'CHAT_SEND_QUEUE_SIZE', 100))
+        self.writer_task = None
+        
+        query_string = self.scope.get('query_string', b'').decode('utf-8')
+        query_params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
+        token = query_params.get('token', None)
+        
+        if not token:
+            logger.error("No token provided in order board connection")
+            await self.close(code=4001)
+            return
+        
+        try:
+            access_token = AccessToken(token)
+            self.user = await database_sync_to_async(User.objects.filter(id=access_token['user_id']).first)()
+            if not self.user or self.user.user_type != User.UserType.FARMER:
+                logger.error(f"User {access_token['user_id']} cannot open an order board")
+                await self.close(code=4003)
+                return
+            
+            self.group_name = order_board.board_group_name(self.user.id)
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.accept()
+            self.writer_task = asyncio.create_task(self.write_outbound())
+            
+        except TokenError as e:
+            logger.error(f"Invalid token: {str(e)}")
+            await self.close(code=4001)
+        except Exception as e:
+            logger.error(f"Error in order board connect: {str(e)}")
+            await self.close(code=4000)
+    
+    async def disconnect(self, close_code):
+        self.outbound.close()
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+    
+    async def order_board(self, event):
+        """
+        Send a board change to WebSocket
+        """
+        # Not coalesced: dropped board frames would leave the client with a stale board.
+        # Clients closed on overflow reload the board from farmer_orders.
+        if not self.outbound.put(event['text']):
+            logger.warning(f"Send queue overflow on order board of user {self.user.id}, disconnecting")
+            self.outbound.close()
+            await self.close(code=4008)
+    
+    async def write_outbound(self):
+        try:
+            while True:
+                await self.send(text_data=await self.outbound.get())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error writing to WebSocket: {str(e)}")
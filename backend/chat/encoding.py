@@ -0,0 +1,60 @@
+import json
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+'''
+encoding.py: Serialization of WebSocket frames
+encode(): Turns a payload dict into the JSON text sent to clients
+absolute_media_url(): Makes a media URL absolute using BASE_URL
+
+Broadcast payloads are encoded once by the sender and forwarded unchanged by every
+recipient. The encoder is pluggable through CHAT_JSON_ENCODER (dotted path to a
+callable taking a dict and returning str), e.g. 'chat.encoding.orjson_dumps'.
+'''
+
+_encoder = None
+
+
+def json_dumps(payload):
+    """
+    Default encoder: compact stdlib JSON.
+    """
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def orjson_dumps(payload):
+    """
+    Faster encoder for deployments that install orjson.
+    """
+    import orjson
+    return orjson.dumps(payload).decode('utf-8')
+
+
+def get_encoder():
+    """
+    Return the configured encoder, importing it on first use.
+    """
+    global _encoder
+    if _encoder is None:
+        _encoder = import_string(getattr(settings, 'CHAT_JSON_ENCODER', 'chat.encoding.json_dumps'))
+    return _encoder
+
+
+def encode(payload):
+    """
+    Encode a WebSocket payload to text.
+    """
+    return get_encoder()(payload)
+
+
+def absolute_media_url(url):
+    """
+    Return `url` unchanged if it is absolute, otherwise prefix it with BASE_URL.
+    """
+    if not url or url.startswith(('http://', 'https://')):
+        return url
+
+    base_url = getattr(settings, 'BASE_URL', None) or 'http://localhost:8000'
+    if url.startswith('/'):
+        return f"{base_url}{url}"
+    return f"{base_url}/{url}"
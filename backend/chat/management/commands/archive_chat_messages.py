@@ -0,0 +1,58 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from chat.archive import get_cutoff, archivable_messages, archive_batch
+
+
+'''
+archive_chat_messages: Moves old messages from finished, inactive rooms to the archive table
+Runs in bounded batches (one transaction each) so it can be scheduled (e.g. nightly cron)
+and interrupted at any point; the next run continues where this one stopped.
+
+Example:
+    python manage.py archive_chat_messages --batch-size 500 --max-batches 100
+'''
+
+
+class Command(BaseCommand):
+    help = 'Move old chat messages from finished, inactive rooms into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive messages older than this many days (default: CHAT_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches to limit database load')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the messages that would be archived')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days cannot be negative')
+
+        cutoff = get_cutoff(options['days'])
+
+        if options['dry_run']:
+            count = archivable_messages(cutoff).count()
+            self.stdout.write(f'{count} messages older than {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        total = 0
+        batches = 0
+        started = time.monotonic()
+        while options['max_batches'] is None or batches < options['max_batches']:
+            moved = archive_batch(cutoff, options['batch_size'])
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Batch {batches}: {moved} messages')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} messages in {batches} batches ({elapsed:.1f}s)'
+        ))
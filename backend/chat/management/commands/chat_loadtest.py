@@ -0,0 +1,309 @@
+import asyncio
+import random
+import time
+import uuid
+from urllib.parse import urlparse
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+from users.models import CustomUser
+from chat.models import ChatRoom
+from orders.models import OrderStatus
+
+
+'''
+chat_loadtest: WebSocket load test for ChatConsumer
+Creates loadtest users and rooms in the configured database, mints JWTs locally,
+opens N sockets across M rooms against a running server (Daphne/uvicorn) and drives
+a mix of messages, typing and order status events.
+
+Reports connect time, message fan-out latency percentiles, error rates and, when
+--server-pid is given, server memory per connection.
+
+Example:
+    python manage.py chat_loadtest --url ws://127.0.0.1:8000 --connections 200 --rooms 50 --duration 30
+'''
+
+LOADTEST_DOMAIN = 'loadtest.agroconnect.local'
+MESSAGE_MARKER = '[loadtest]'
+
+
+def percentile(values, pct):
+    """
+    Return the pct-th percentile of `values` (nearest-rank), or None if empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def read_rss_kb(pid):
+    """
+    Resident memory of a process in KB, read from /proc (Linux only).
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Open many authenticated chat WebSockets against a running server and measure throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='ws://127.0.0.1:8000', help='Base WebSocket URL of the running server')
+        parser.add_argument('--connections', type=int, default=50, help='Number of sockets to open')
+        parser.add_argument('--rooms', type=int, default=10, help='Number of rooms to spread the sockets over')
+        parser.add_argument('--duration', type=float, default=20.0, help='Seconds to drive traffic after connecting')
+        parser.add_argument('--rate', type=float, default=1.0, help='Events per second sent by each socket')
+        parser.add_argument(
+            '--mix', default='message=0.6,typing=0.3,status=0.1',
+            help='Relative weights of message, typing and status events'
+        )
+        parser.add_argument('--ramp', type=float, default=50.0, help='New connections opened per second')
+        parser.add_argument('--server-pid', type=int, help='PID of the server process, to report memory per connection')
+        parser.add_argument('--cleanup', action='store_true', help='Delete loadtest users, rooms and messages afterwards')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a repeatable event mix')
+
+    def handle(self, *args, **options):
+        try:
+            from websockets.asyncio.client import connect
+        except ImportError:
+            raise CommandError('The websockets package (>= 13) is required to run the load test')
+
+        if options['connections'] < 1 or options['rooms'] < 1:
+            raise CommandError('--connections and --rooms must be at least 1')
+
+        self.connect_ws = connect
+        self.mix = self.parse_mix(options['mix'])
+        random.seed(options['seed'])
+
+        rooms = self.create_fixtures(options['rooms'])
+        self.stdout.write(f"Prepared {len(rooms)} rooms, opening {options['connections']} sockets to {options['url']}")
+
+        try:
+            stats = asyncio.run(self.run_load(rooms, options))
+            self.report(stats, options)
+        finally:
+            if options['cleanup']:
+                deleted, _ = CustomUser.objects.filter(email__endswith=f'@{LOADTEST_DOMAIN}').delete()
+                self.stdout.write(f"Cleaned up {deleted} loadtest rows")
+
+    def parse_mix(self, mix):
+        """
+        Parse "message=0.6,typing=0.3,status=0.1" into ([kinds], [weights]).
+        """
+        kinds, weights = [], []
+        for part in mix.split(','):
+            try:
+                kind, weight = part.split('=')
+                weight = float(weight)
+            except ValueError:
+                raise CommandError(f'Invalid --mix entry: {part}')
+            if kind not in ('message', 'typing', 'status'):
+                raise CommandError(f'Unknown event kind in --mix: {kind}')
+            kinds.append(kind)
+            weights.append(weight)
+        if sum(weights) <= 0:
+            raise CommandError('--mix weights must add up to more than 0')
+        return kinds, weights
+
+    def create_fixtures(self, room_count):
+        """
+        Create (or reuse) one customer, one farmer and one room per loadtest room.
+
+        Users are bulk-created so no activation emails are sent.
+        Returns a list of (room_id, customer_token, farmer_token).
+        """
+        users = []
+        for index in range(room_count):
+            for user_type in (CustomUser.UserType.CUSTOMER, CustomUser.UserType.FARMER):
+                email = f'{user_type.lower()}{index}@{LOADTEST_DOMAIN}'
+                users.append(CustomUser(
+                    email=email,
+                    full_name=f'Loadtest {user_type.title()} {index}',
+                    # Unique 13-digit number per user: 9 + type digit + index
+                    phone_number=f"9{1 if user_type == CustomUser.UserType.CUSTOMER else 2}{index:011d}",
+                    user_type=user_type,
+                    province='Punjab',
+                    city='Lahore',
+                    is_active=True,
+                ))
+        CustomUser.objects.bulk_create(users, ignore_conflicts=True)
+        users_by_email = {
+            user.email: user
+            for user in CustomUser.objects.filter(email__endswith=f'@{LOADTEST_DOMAIN}')
+        }
+
+        rooms = []
+        for index in range(room_count):
+            customer = users_by_email[f'customer{index}@{LOADTEST_DOMAIN}']
+            farmer = users_by_email[f'farmer{index}@{LOADTEST_DOMAIN}']
+            room = ChatRoom.objects.filter(customer=customer, farmer=farmer).first()
+            if room is None:
+                room = ChatRoom.objects.create(
+                    room_id=f'loadtest_{uuid.uuid4().hex[:12]}',
+                    customer=customer,
+                    farmer=farmer,
+                )
+            rooms.append((
+                room.room_id,
+                str(AccessToken.for_user(customer)),
+                str(AccessToken.for_user(farmer)),
+            ))
+        return rooms
+
+    async def run_load(self, rooms, options):
+        """
+        Open all sockets, drive traffic for --duration seconds and collect statistics.
+        """
+        parsed = urlparse(options['url'])
+        origin = f"{'https' if parsed.scheme == 'wss' else 'http'}://{parsed.netloc}"
+        stats = {
+            'connect_times': [],
+            'latencies': [],
+            'sent': {'message': 0, 'typing': 0, 'status': 0},
+            'received': 0,
+            'connect_errors': 0,
+            'send_errors': 0,
+            'closed_by_server': {},
+            'rss_before': read_rss_kb(options['server_pid']) if options['server_pid'] else None,
+            'rss_connected': None,
+        }
+        stop = asyncio.Event()
+        connected = []
+
+        async def open_socket(index):
+            room_id, customer_token, farmer_token = rooms[index % len(rooms)]
+            # Alternate customer and farmer so both sides of each room are exercised
+            token = customer_token if (index // len(rooms)) % 2 == 0 else farmer_token
+            started = time.perf_counter()
+            try:
+                websocket = await self.connect_ws(
+                    f"{options['url'].rstrip('/')}/ws/chat/{room_id}/?token={token}",
+                    origin=origin,
+                )
+            except Exception:
+                stats['connect_errors'] += 1
+                return None
+            stats['connect_times'].append(time.perf_counter() - started)
+            connected.append(websocket)
+            return websocket
+
+        async def read_socket(websocket):
+            try:
+                async for frame in websocket:
+                    stats['received'] += 1
+                    text = frame if isinstance(frame, str) else frame.decode('utf-8')
+                    # Message frames carry the sender's monotonic send time after the marker
+                    marker = text.find(MESSAGE_MARKER)
+                    if marker != -1:
+                        try:
+                            sent_at = float(text[marker + len(MESSAGE_MARKER):].split()[0].rstrip('"'))
+                            stats['latencies'].append(time.monotonic() - sent_at)
+                        except (ValueError, IndexError):
+                            pass
+            except Exception as e:
+                code = getattr(getattr(e, 'rcvd', None), 'code', None)
+                stats['closed_by_server'][code] = stats['closed_by_server'].get(code, 0) + 1
+
+        async def drive_socket(websocket):
+            kinds, weights = self.mix
+            interval = 1.0 / options['rate'] if options['rate'] > 0 else None
+            typing = False
+            while interval and not stop.is_set():
+                await asyncio.sleep(random.expovariate(1.0 / interval))
+                if stop.is_set():
+                    break
+                kind = random.choices(kinds, weights)[0]
+                if kind == 'message':
+                    payload = f'{{"message": "{MESSAGE_MARKER}{time.monotonic():.6f} hello"}}'
+                elif kind == 'typing':
+                    typing = not typing
+                    payload = f'{{"is_typing": {"true" if typing else "false"}}}'
+                else:
+                    new_status = random.choice([OrderStatus.NEW, OrderStatus.ACTIVE, OrderStatus.COMPLETED])
+                    payload = f'{{"order_status": "{new_status}"}}'
+                try:
+                    await websocket.send(payload)
+                    stats['sent'][kind] += 1
+                except Exception:
+                    stats['send_errors'] += 1
+                    break
+
+        # Ramp up connections at --ramp sockets per second
+        delay = 1.0 / options['ramp'] if options['ramp'] > 0 else 0
+        open_tasks = []
+        for index in range(options['connections']):
+            open_tasks.append(asyncio.create_task(open_socket(index)))
+            if delay:
+                await asyncio.sleep(delay)
+        sockets = [websocket for websocket in await asyncio.gather(*open_tasks) if websocket is not None]
+
+        if options['server_pid']:
+            stats['rss_connected'] = read_rss_kb(options['server_pid'])
+
+        readers = [asyncio.create_task(read_socket(websocket)) for websocket in sockets]
+        drivers = [asyncio.create_task(drive_socket(websocket)) for websocket in sockets]
+        started = time.perf_counter()
+        await asyncio.sleep(options['duration'])
+        stop.set()
+        await asyncio.gather(*drivers, return_exceptions=True)
+
+        # Give in-flight frames a moment to arrive before closing
+        await asyncio.sleep(1.0)
+        stats['elapsed'] = time.perf_counter() - started
+        for websocket in connected:
+            await websocket.close()
+        await asyncio.gather(*readers, return_exceptions=True)
+        stats['open_sockets'] = len(sockets)
+        return stats
+
+    def report(self, stats, options):
+        """
+        Print a summary of the run.
+        """
+        def ms(value):
+            return f'{value * 1000:.1f} ms' if value is not None else 'n/a'
+
+        attempted = options['connections']
+        opened = stats['open_sockets']
+        total_sent = sum(stats['sent'].values())
+
+        self.stdout.write('')
+        self.stdout.write(self.style.MIGRATE_HEADING('Connections'))
+        self.stdout.write(f'  opened: {opened}/{attempted} ({stats["connect_errors"]} errors)')
+        for pct in (50, 95, 99):
+            self.stdout.write(f'  connect p{pct}: {ms(percentile(stats["connect_times"], pct))}')
+        self.stdout.write(f'  connect max: {ms(max(stats["connect_times"]) if stats["connect_times"] else None)}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Traffic'))
+        self.stdout.write(
+            f'  sent: {total_sent} ({stats["sent"]["message"]} messages, '
+            f'{stats["sent"]["typing"]} typing, {stats["sent"]["status"]} status), '
+            f'{total_sent / stats["elapsed"]:.1f}/s'
+        )
+        self.stdout.write(f'  received frames: {stats["received"]} ({stats["received"] / stats["elapsed"]:.1f}/s)')
+        self.stdout.write(f'  send errors: {stats["send_errors"]}')
+        if stats['closed_by_server']:
+            self.stdout.write(f'  closed by server (code: count): {stats["closed_by_server"]}')
+        if total_sent:
+            error_rate = (stats['send_errors'] + stats['connect_errors']) / (total_sent + attempted)
+            self.stdout.write(f'  error rate: {error_rate * 100:.2f}%')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Message fan-out latency'))
+        self.stdout.write(f'  samples: {len(stats["latencies"])}')
+        for pct in (50, 90, 95, 99):
+            self.stdout.write(f'  p{pct}: {ms(percentile(stats["latencies"], pct))}')
+        self.stdout.write(f'  max: {ms(max(stats["latencies"]) if stats["latencies"] else None)}')
+
+        if stats['rss_before'] is not None and stats['rss_connected'] is not None and opened:
+            per_connection = (stats['rss_connected'] - stats['rss_before']) / opened
+            self.stdout.write(self.style.MIGRATE_HEADING('Server memory'))
+            self.stdout.write(f'  RSS before: {stats["rss_before"] / 1024:.1f} MB, with sockets: {stats["rss_connected"] / 1024:.1f} MB')
+            self.stdout.write(f'  per connection: {per_connection:.1f} KB')
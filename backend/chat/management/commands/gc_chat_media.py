@@ -0,0 +1,134 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from chat.models import ChatMessage, ChatMessageImage, ArchivedChatMessage, ChatMediaBlob
+from chat.storage import BLOB_PREFIX, chat_media_storage, is_blob
+
+
+'''
+gc_chat_media: Deletes chat attachment blobs that no message uses any more
+Blobs whose reference count has been zero for longer than the grace period are removed,
+as are blob files without a ChatMediaBlob row (left behind by rolled-back uploads).
+--recount rebuilds every reference count from the message tables first, repairing any
+drift from bulk operations that bypass signals.
+
+Example:
+    python manage.py gc_chat_media --grace-hours 24 --recount
+'''
+
+
+class Command(BaseCommand):
+    help = 'Delete unreferenced chat attachment blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=None,
+                            help='Keep unreferenced blobs this long (default: CHAT_MEDIA_GC_GRACE_HOURS)')
+        parser.add_argument('--recount', action='store_true',
+                            help='Recompute reference counts from the message tables before collecting')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        grace_hours = options['grace_hours']
+        if grace_hours is None:
+            grace_hours = getattr(settings, 'CHAT_MEDIA_GC_GRACE_HOURS', 24)
+        if grace_hours < 0:
+            raise CommandError('--grace-hours cannot be negative')
+        cutoff = timezone.now() - timedelta(hours=grace_hours)
+        dry_run = options['dry_run']
+
+        if options['recount']:
+            fixed = self.recount(dry_run)
+            self.stdout.write(f'Corrected {fixed} reference counts')
+
+        deleted, freed = self.collect_unreferenced(cutoff, dry_run)
+        orphans = self.collect_orphan_files(cutoff, dry_run)
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {deleted} unreferenced blobs ({freed} bytes) and {orphans} orphan files'
+        ))
+
+    def count_references(self):
+        """
+        Count blob references across live messages, message images and archived messages.
+        """
+        counts = Counter()
+        for name in ChatMessage.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True).iterator(chunk_size=2000):
+            counts[name] += 1
+        for name in ChatMessageImage.objects.values_list('image', flat=True).iterator(chunk_size=2000):
+            counts[name] += 1
+        for image, images in ArchivedChatMessage.objects.values_list('image', 'images').iterator(chunk_size=2000):
+            if image:
+                counts[image] += 1
+            for img in images:
+                counts[img.get('image')] += 1
+        return Counter({name: count for name, count in counts.items() if is_blob(name)})
+
+    def recount(self, dry_run):
+        counts = self.count_references()
+        now = timezone.now()
+        fixed = 0
+        for blob in ChatMediaBlob.objects.iterator(chunk_size=2000):
+            actual = counts.get(blob.name, 0)
+            if blob.ref_count == actual:
+                continue
+            fixed += 1
+            if self.verbosity > 1:
+                self.stdout.write(f'{blob.name}: {blob.ref_count} -> {actual}')
+            if not dry_run:
+                ChatMediaBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=actual,
+                    unreferenced_at=(blob.unreferenced_at or now) if actual == 0 else None
+                )
+        return fixed
+
+    def collect_unreferenced(self, cutoff, dry_run):
+        deleted = 0
+        freed = 0
+        candidates = ChatMediaBlob.objects.filter(ref_count__lte=0, unreferenced_at__lt=cutoff)
+        for blob in candidates.iterator(chunk_size=500):
+            if dry_run:
+                deleted += 1
+                freed += blob.size
+                continue
+            with transaction.atomic():
+                # Re-check under a row lock: an identical upload may have reused the blob
+                locked = ChatMediaBlob.objects.select_for_update().filter(pk=blob.pk, ref_count__lte=0).first()
+                if locked is None:
+                    continue
+                locked.delete()
+                chat_media_storage.delete(locked.name)
+            deleted += 1
+            freed += locked.size
+            if self.verbosity > 1:
+                self.stdout.write(f'Deleted {locked.name}')
+        return deleted, freed
+
+    def collect_orphan_files(self, cutoff, dry_run):
+        """
+        Delete blob files that have no ChatMediaBlob row and are older than the cutoff.
+        """
+        orphans = 0
+        for name in self.walk(BLOB_PREFIX):
+            if ChatMediaBlob.objects.filter(name=name).exists():
+                continue
+            if chat_media_storage.get_modified_time(name) >= cutoff:
+                continue
+            orphans += 1
+            if not dry_run:
+                chat_media_storage.delete(name)
+        return orphans
+
+    def walk(self, path):
+        try:
+            directories, files = chat_media_storage.listdir(path)
+        except (FileNotFoundError, NotImplementedError):
+            return
+        for file_name in files:
+            yield f'{path}/{file_name}'
+        for directory in directories:
+            yield from self.walk(f'{path}/{directory}')
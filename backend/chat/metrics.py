@@ -0,0 +1,67 @@
+import threading
+
+'''
+metrics.py: Lightweight in-process counters for the chat subsystem
+increment(): Adds to a named counter
+set_gauge(): Records the latest value of a named gauge
+adjust_gauge(): Moves a named gauge up or down
+snapshot(): Returns a copy of all counters and gauges
+'''
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def increment(name, amount=1):
+    """
+    Increase the counter called `name` by `amount`.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """
+    Record the current value of the gauge called `name`.
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def adjust_gauge(name, delta):
+    """
+    Add `delta` (which may be negative) to the gauge called `name`.
+    """
+    with _lock:
+        _gauges[name] = _gauges.get(name, 0) + delta
+
+
+def get(name, default=0):
+    """
+    Return the current value of a counter or gauge.
+    """
+    with _lock:
+        if name in _counters:
+            return _counters[name]
+        return _gauges.get(name, default)
+
+
+def snapshot():
+    """
+    Return a copy of all counters and gauges, e.g. for logging or an admin endpoint.
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+        }
+
+
+def reset():
+    """
+    Clear every counter and gauge.
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+'''
+Full-text search index for ChatMessage.message (see chat/search.py)
+PostgreSQL: GIN index on to_tsvector('english', message)
+SQLite: external-content FTS5 table kept in sync with triggers
+'''
+
+INDEX_NAME = 'chat_message_search_gin'
+FTS_TABLE = 'chat_chatmessage_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        ChatMessage = apps.get_model('chat', 'ChatMessage')
+        schema_editor.add_index(
+            ChatMessage,
+            GinIndex(SearchVector('message', config='english'), name=INDEX_NAME)
+        )
+
+    elif vendor == 'sqlite':
+        from chat.search import ensure_sqlite_fts
+        ensure_sqlite_fts(schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatroom_order_alter_chatroom_order_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_chatmessage_search_index'),
+        ('orders', '0002_order_orderitem_delete_orderreturn'),
+        ('products', '0004_alter_product_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'timestamp'], name='chat_msg_room_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['room', 'sender'], name='chat_msg_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['customer', '-updated_at'], name='chat_room_customer_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['farmer', '-updated_at'], name='chat_room_farmer_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['farmer', 'order_status', '-updated_at'], name='chat_room_farmer_status_idx'),
+        ),
+        # Drop the single-column room index only once the composites above exist
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='room',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.chatroom'),
+        ),
+    ]
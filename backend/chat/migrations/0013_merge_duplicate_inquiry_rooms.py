@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+'''
+Prepares for the chat_room_unique_inquiry constraint (0014). Kept in its own migration:
+PostgreSQL cannot build the unique index in the same transaction as these row updates.
+'''
+
+
+def merge_duplicate_inquiry_rooms(apps, schema_editor):
+    """
+    Fold duplicate inquiry rooms (same customer, farmer and product, no order) into the
+    oldest one, so the unique constraint can be created. Messages are moved, not deleted.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    ArchivedChatMessage = apps.get_model('chat', 'ArchivedChatMessage')
+
+    duplicates = ChatRoom.objects.filter(
+        order__isnull=True,
+        product__isnull=False
+    ).values(
+        'customer_id', 'farmer_id', 'product_id'
+    ).annotate(
+        rooms=Count('id'),
+        keep_id=Min('id')
+    ).filter(rooms__gt=1)
+
+    for group in duplicates:
+        rooms = ChatRoom.objects.filter(
+            order__isnull=True,
+            customer_id=group['customer_id'],
+            farmer_id=group['farmer_id'],
+            product_id=group['product_id']
+        )
+        keeper = rooms.get(id=group['keep_id'])
+        others = list(rooms.exclude(id=keeper.id))
+
+        ChatMessage.objects.filter(room__in=others).update(room=keeper)
+        ArchivedChatMessage.objects.filter(room__in=others).update(room=keeper)
+
+        keeper.has_unread_customer = keeper.has_unread_customer or any(room.has_unread_customer for room in others)
+        keeper.has_unread_farmer = keeper.has_unread_farmer or any(room.has_unread_farmer for room in others)
+        # Keep the quantity from the most recent inquiry
+        keeper.quantity = max([keeper] + others, key=lambda room: room.updated_at).quantity
+        keeper.save(update_fields=['has_unread_customer', 'has_unread_farmer', 'quantity'])
+
+        ChatRoom.objects.filter(id__in=[room.id for room in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_archivedchatmessage'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_inquiry_rooms, migrations.RunPython.noop),
+    ]
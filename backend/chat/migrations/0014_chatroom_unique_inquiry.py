@@ -0,0 +1,46 @@
+# Generated by Django 5.1.3 on 2026-10-19 10:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_merge_duplicate_inquiry_rooms'),
+        ('orders', '0002_order_orderitem_delete_orderreturn'),
+        ('products', '0004_alter_product_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatRoomIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('created_room', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('order__isnull', True)), fields=('customer', 'farmer', 'product'), name='chat_room_unique_inquiry'),
+        ),
+        migrations.AddField(
+            model_name='chatroomidempotencykey',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='chat.chatroom'),
+        ),
+        migrations.AddField(
+            model_name='chatroomidempotencykey',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_idempotency_keys', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroomidempotencykey',
+            constraint=models.UniqueConstraint(fields=('user', 'key'), name='chat_idempotency_user_key'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-19 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_chatroom_unique_inquiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedchatmessage',
+            name='image_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='image_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-19 10:12
+
+import chat.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_chatmessage_image_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('unreferenced_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='archivedchatmessage',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=chat.storage.get_chat_media_storage, upload_to='chat_images/'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=chat.storage.get_chat_media_storage, upload_to='chat_images/'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessageimage',
+            name='image',
+            field=models.ImageField(storage=chat.storage.get_chat_media_storage, upload_to='chat_images/multiple/'),
+        ),
+    ]
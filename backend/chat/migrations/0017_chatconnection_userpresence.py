@@ -0,0 +1,38 @@
+# Generated by Django 5.1.3 on 2026-10-19 10:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_chatmediablob'),
+        ('users', '0007_alter_customuser_phone_number'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPresence',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='presence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatConnection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_name', models.CharField(max_length=255, unique=True)),
+                ('connected_at', models.DateTimeField(auto_now_add=True)),
+                ('last_heartbeat', models.DateTimeField(db_index=True)),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='connections', to='chat.chatroom')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='chat_connections', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'room'], name='chat_conn_user_room_idx'), models.Index(fields=['room', 'user'], name='chat_conn_room_user_idx')],
+            },
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from users.models import CustomUser
 from products.models import Product
 from orders.models import OrderStatus, Order
+from .storage import get_chat_media_storage
 
 # Get the first user as a default (will be used only for migration)
 def get_default_user():
@@ -20,16 +21,20 @@ class ChatRoom(models.Model):
     # Unique room identifier
     room_id = models.CharField(max_length=255, unique=True)
     # The customer in this chat
+    # (indexed by chat_room_customer_upd_idx, which starts with it)
     customer = models.ForeignKey(
         CustomUser, 
         on_delete=models.CASCADE, 
-        related_name='customer_rooms'
+        related_name='customer_rooms',
+        db_index=False
     )
     # The farmer in this chat
+    # (indexed by chat_room_farmer_upd_idx and chat_room_farmer_status_idx)
     farmer = models.ForeignKey(
         CustomUser, 
         on_delete=models.CASCADE, 
-        related_name='farmer_rooms'
+        related_name='farmer_rooms',
+        db_index=False
     )
     # Product being discussed
     product = models.ForeignKey(
@@ -62,6 +67,25 @@ class ChatRoom(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Room lists: filter(Q(customer=user) | Q(farmer=user)).order_by('-updated_at')
+            models.Index(fields=['customer', '-updated_at'], name='chat_room_customer_upd_idx'),
+            models.Index(fields=['farmer', '-updated_at'], name='chat_room_farmer_upd_idx'),
+            # Farmer order board filtered by status
+            models.Index(fields=['farmer', 'order_status', '-updated_at'], name='chat_room_farmer_status_idx'),
+        ]
+        constraints = [
+            # One inquiry room per customer, farmer and product (see chat/rooms.py).
+            # Order rooms are excluded: every order gets its own room.
+            # Rooms whose product was deleted (NULL) never conflict.
+            models.UniqueConstraint(
+                fields=['customer', 'farmer', 'product'],
+                condition=models.Q(order__isnull=True),
+                name='chat_room_unique_inquiry'
+            ),
+        ]
+
     def __str__(self):
         return f"Chat between {self.customer.full_name} and {self.farmer.full_name} about {self.product.productName if self.product else 'deleted product'}"
 
@@ -75,10 +99,12 @@ Tracks read status and timestamps
 
 class ChatMessage(models.Model):
     # The room this message belongs to
+    # (no single-column index: the (room, ...) composite indexes in Meta cover room lookups)
     room = models.ForeignKey(
         ChatRoom, 
         on_delete=models.CASCADE, 
-        related_name='messages'
+        related_name='messages',
+        db_index=False
     )
     # User who sent the message
     sender = models.ForeignKey(
@@ -88,14 +114,28 @@ class ChatMessage(models.Model):
     )
     # Message content
     message = models.TextField(blank=True)
-    # Optional image attachment
-    image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
+    # Optional image attachment (deduplicated by content, see chat/storage.py)
+    image = models.ImageField(upload_to='chat_images/', storage=get_chat_media_storage, blank=True, null=True)
+    # Image referenced by URL instead of copied (e.g. the product image in post-checkout messages)
+    image_url = models.CharField(max_length=500, blank=True)
     # Is this message read by the recipient
     is_read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Room history and "latest message per room"
+            models.Index(fields=['room', 'timestamp'], name='chat_msg_room_ts_idx'),
+            # Reconnect catch-up and read watermarks (id ranges within a room)
+            models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+            # Unread counts and mark-as-read: only unread rows are indexed
+            models.Index(
+                fields=['room', 'sender'],
+                condition=models.Q(is_read=False),
+                name='chat_msg_unread_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"From {self.sender.full_name} at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
@@ -110,8 +150,8 @@ class ChatMessageImage(models.Model):
         on_delete=models.CASCADE,
         related_name='images'
     )
-    # Image file
-    image = models.ImageField(upload_to='chat_images/multiple/')
+    # Image file (deduplicated by content, see chat/storage.py)
+    image = models.ImageField(upload_to='chat_images/multiple/', storage=get_chat_media_storage)
     # Upload timestamp
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -120,3 +160,149 @@ class ChatMessageImage(models.Model):
 
     def __str__(self):
         return f"Image for message {self.message.id} uploaded at {self.uploaded_at.strftime('%Y-%m-%d %H:%M')}"
+
+
+'''
+ArchivedChatMessage: Cold storage for messages moved out of ChatMessage
+Rows keep the original message id, so history can be merged back in order
+See chat/archive.py and the archive_chat_messages management command
+'''
+
+
+class ArchivedChatMessage(models.Model):
+    # Same id the message had in ChatMessage
+    id = models.BigIntegerField(primary_key=True)
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        db_index=False
+    )
+    sender = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='archived_messages'
+    )
+    message = models.TextField(blank=True)
+    # Storage name of the main image (the file itself is left where it was)
+    image = models.ImageField(upload_to='chat_images/', storage=get_chat_media_storage, blank=True, null=True)
+    # Storage names and upload times of the ChatMessageImage rows
+    images = models.JSONField(default=list, blank=True)
+    image_url = models.CharField(max_length=500, blank=True)
+    is_read = models.BooleanField(default=True)
+    timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp'], name='chat_archived_room_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.id} in room {self.room_id}"
+
+
+'''
+ChatRoomIdempotencyKey: Remembers which room a client idempotency key created
+Lets a retried room creation request return the original room and status
+'''
+
+
+class ChatRoomIdempotencyKey(models.Model):
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='chat_idempotency_keys'
+    )
+    # Client-supplied key (Idempotency-Key header or idempotency_key field)
+    key = models.CharField(max_length=255)
+    # Hash of the request parameters, to reject a key reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    # Whether the original request created the room (201) or found it (200)
+    created_room = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='chat_idempotency_user_key'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for room {self.room_id}"
+
+
+'''
+ChatMediaBlob: One stored chat attachment file, shared by every message that uses it
+ref_count counts the messages, message images and archived messages pointing at it
+'''
+
+
+class ChatMediaBlob(models.Model):
+    # Storage name, e.g. chat_images/blobs/ab/cd/<sha256>.jpg
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    # Set when ref_count drops to zero; gc_chat_media deletes the file after a grace period
+    unreferenced_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+
+'''
+ChatConnection: One open chat WebSocket, refreshed by its server process every heartbeat
+Rows whose last_heartbeat is older than CHAT_PRESENCE_TTL belong to dead processes and are expired
+UserPresence: When a user was last connected to any chat room
+'''
+
+
+class ChatConnection(models.Model):
+    # Channel layer name of the consumer, unique per connection
+    channel_name = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='chat_connections',
+        # Covered by chat_conn_user_room_idx
+        db_index=False
+    )
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='connections',
+        # Covered by chat_conn_room_user_idx
+        db_index=False
+    )
+    connected_at = models.DateTimeField(auto_now_add=True)
+    last_heartbeat = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'room'], name='chat_conn_user_room_idx'),
+            models.Index(fields=['room', 'user'], name='chat_conn_room_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} connected to room {self.room_id}"
+
+
+class UserPresence(models.Model):
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='presence'
+    )
+    # Time the user's last chat connection closed or expired
+    last_seen = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user} last seen {self.last_seen}"
@@ -0,0 +1,180 @@
+import base64
+import json
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField, OuterRef, Subquery, Count, Q
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+from .models import ChatRoom, ChatMessage, ArchivedChatMessage, OrderStatus
+from .encoding import encode
+from .serializers import FarmerOrderSerializer
+
+logger = logging.getLogger(__name__)
+
+'''
+order_board.py: The farmer's order board (ChatRoomViewSet.farmer_orders)
+board_queryset(): The farmer's rooms, ordered in SQL by status priority, new orders and recency
+paginate(): Keyset (cursor) pagination over that ordering
+broadcast_room(): Pushes a changed or removed room to the farmer's board WebSocket
+
+Each row is annotated with its last message text and unread count, so serializing a
+page costs no per-room queries. Boards are kept current by "order_board" frames sent
+to the order_board_<farmer id> group (see OrderBoardConsumer) whenever a room is
+created, changes status or is deleted, instead of clients refetching the whole list.
+'''
+
+# Lower sorts first; statuses not listed sort last
+STATUS_PRIORITY = {
+    OrderStatus.NEW: 0,
+    OrderStatus.ACTIVE: 1,
+    OrderStatus.COMPLETED: 2,
+}
+DEFAULT_PRIORITY = 999
+
+# priority ASC, is_new_order DESC (new first), updated_at DESC, id DESC
+BOARD_ORDERING = ['priority', '-is_new_order', '-updated_at', '-id']
+
+
+def priority_expression():
+    return Case(
+        *[When(order_status=order_status, then=Value(priority)) for order_status, priority in STATUS_PRIORITY.items()],
+        default=Value(DEFAULT_PRIORITY),
+        output_field=IntegerField()
+    )
+
+
+def board_queryset(farmer_id, statuses=None, is_new_order=None):
+    """
+    The farmer's rooms in board order, with everything the board serializer needs.
+    """
+    latest_message = ChatMessage.objects.filter(room=OuterRef('pk')).order_by('-timestamp', '-id').values('message')[:1]
+    # Rooms whose history was archived fall back to the archive table
+    latest_archived = ArchivedChatMessage.objects.filter(room=OuterRef('pk')).order_by('-timestamp', '-id').values('message')[:1]
+    unread = ChatMessage.objects.filter(
+        room=OuterRef('pk'),
+        sender=OuterRef('customer'),
+        is_read=False
+    ).order_by().values('room').annotate(count=Count('id')).values('count')
+
+    queryset = ChatRoom.objects.filter(farmer_id=farmer_id)
+    if statuses:
+        queryset = queryset.filter(order_status__in=statuses)
+    if is_new_order is not None:
+        queryset = queryset.filter(is_new_order=is_new_order)
+
+    return queryset.select_related(
+        # product_detail (ProductSerializer) reads the farmer and both rating summaries
+        'customer', 'farmer', 'product', 'product__farmer',
+        'product__rating_summary', 'product__farmer__rating_summary'
+    ).annotate(
+        priority=priority_expression(),
+        last_message=Coalesce(Subquery(latest_message), Subquery(latest_archived)),
+        unread_messages=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+    ).order_by(*BOARD_ORDERING)
+
+
+def parse_statuses(values):
+    """
+    Turn ?status=new,pending (or repeated status parameters) into a list of statuses.
+
+    Raises ValueError for unknown statuses.
+    """
+    statuses = [status.strip() for value in values for status in value.split(',') if status.strip()]
+    unknown = set(statuses) - set(OrderStatus.values)
+    if unknown:
+        raise ValueError(f"Unknown order status: {', '.join(sorted(unknown))}")
+    return statuses
+
+
+def encode_cursor(room):
+    """
+    Opaque cursor pointing just after `room` in board order.
+    """
+    position = [room.priority, room.is_new_order, room.updated_at.isoformat(), room.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor. Raises ValueError for malformed cursors.
+    """
+    try:
+        priority, is_new_order, updated_at, room_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        updated_at = parse_datetime(updated_at)
+        if updated_at is None:
+            raise ValueError
+        return int(priority), bool(is_new_order), updated_at, int(room_id)
+    except (TypeError, ValueError, AttributeError):
+        raise ValueError('Invalid cursor')
+
+
+def after_cursor(queryset, cursor):
+    """
+    Rows that come after the cursor position in BOARD_ORDERING.
+    """
+    priority, is_new_order, updated_at, room_id = decode_cursor(cursor)
+    return queryset.filter(
+        Q(priority__gt=priority)
+        | Q(priority=priority, is_new_order__lt=is_new_order)
+        | Q(priority=priority, is_new_order=is_new_order, updated_at__lt=updated_at)
+        | Q(priority=priority, is_new_order=is_new_order, updated_at=updated_at, id__lt=room_id)
+    )
+
+
+def paginate(queryset, cursor=None, page_size=20):
+    """
+    Return (rooms, next cursor or None) for one page of the board.
+    """
+    if cursor:
+        queryset = after_cursor(queryset, cursor)
+    rooms = list(queryset[:page_size + 1])
+    if len(rooms) <= page_size:
+        return rooms, None
+    rooms = rooms[:page_size]
+    return rooms, encode_cursor(rooms[-1])
+
+
+def board_group_name(farmer_id):
+    return f'order_board_{farmer_id}'
+
+
+def build_board_event(action, room_data):
+    """
+    Build the order_board group event with its WebSocket frame already encoded.
+    """
+    return {
+        'type': 'order_board',
+        'text': encode({
+            'type': 'order_board',
+            'action': action,
+            'room': room_data
+        })
+    }
+
+
+def broadcast_room(farmer_id, room_pk, room_id, action='upsert'):
+    """
+    Send a board row (or its removal) to the farmer's board once the transaction commits.
+    """
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            if action == 'remove':
+                room_data = {'id': room_pk, 'room_id': room_id}
+            else:
+                room = board_queryset(farmer_id).filter(pk=room_pk).first()
+                if room is None:
+                    return
+                room_data = FarmerOrderSerializer(room).data
+            async_to_sync(channel_layer.group_send)(
+                board_group_name(farmer_id),
+                build_board_event(action, room_data)
+            )
+        except Exception as e:
+            logger.error(f"Error pushing room {room_id} to order board: {str(e)}")
+
+    transaction.on_commit(send)
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+from datetime import timedelta
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import ChatRoom, ChatConnection, UserPresence
+from .encoding import encode
+
+logger = logging.getLogger(__name__)
+
+'''
+presence.py: Who is connected to chat, per room and globally
+connect() / disconnect(): Record a WebSocket opening or closing, returning the presence events to send
+heartbeat(): Refreshes every connection served by this process in one UPDATE
+expire(): Removes connections of processes that stopped heartbeating (crashed or killed)
+get_presence(): Online flag and last-seen time for a set of users
+peer_presence_frame(): Current state of the other participant, sent when a connection opens
+start_heartbeat() / stop_heartbeat(): Per-process task that heartbeats and expires connections
+
+Connections are rows in ChatConnection, so every server process sees the same state.
+A user is online while any of their connections is fresher than CHAT_PRESENCE_TTL and
+"in" a room while one of those connections is to that room. Only transitions produce
+events, and they are sent through the channel layer to the groups of rooms where the
+other participant is currently connected, so nobody else receives them.
+'''
+
+# Channel names of the connections served by this process
+_local = set()
+_heartbeat_task = None
+
+
+def get_ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 90)
+
+
+def alive_connections():
+    """
+    Connections that heartbeated within the TTL.
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_ttl())
+    return ChatConnection.objects.filter(last_heartbeat__gte=cutoff)
+
+
+def build_presence_event(user_id, online, in_room, last_seen=None):
+    """
+    Build the presence group event with its WebSocket frame already encoded.
+    """
+    return {
+        'type': 'presence',
+        'user_id': user_id,
+        'text': encode({
+            'type': 'presence',
+            'user_id': user_id,
+            'online': online,
+            'in_room': in_room,
+            'last_seen': last_seen.isoformat() if last_seen else None
+        })
+    }
+
+
+def user_state(user_id, room_pk):
+    """
+    Return (online, in room) for a user from the live connections.
+    """
+    rooms = set(alive_connections().filter(user_id=user_id).values_list('room_id', flat=True))
+    return bool(rooms), room_pk in rooms
+
+
+def transition_events(user_id, room_pk, before, after, last_seen=None):
+    """
+    Return [(room group name, event)] for a change of a user's state from `before` to `after`.
+
+    Going online or offline is announced in every room of the user whose other participant
+    is connected; entering or leaving a room only in that room.
+    """
+    was_online, was_in_room = before
+    online, in_room = after
+
+    if was_online != online:
+        connected_rooms = set(alive_connections().filter(user_id=user_id).values_list('room_id', flat=True))
+        watched = alive_connections().filter(
+            Q(room__customer_id=user_id) | Q(room__farmer_id=user_id)
+        ).exclude(user_id=user_id).values_list('room_id', 'room__room_id').distinct()
+        return [
+            (f'chat_{room_id}', build_presence_event(user_id, online, pk in connected_rooms, last_seen))
+            for pk, room_id in watched
+        ]
+
+    if was_in_room != in_room:
+        room_id = ChatRoom.objects.filter(pk=room_pk).values_list('room_id', flat=True).first()
+        if room_id is not None:
+            return [(f'chat_{room_id}', build_presence_event(user_id, online, in_room, last_seen))]
+
+    return []
+
+
+def connect(channel_name, user_id, room_pk):
+    """
+    Record an open connection. Returns the presence events to send.
+    """
+    before = user_state(user_id, room_pk)
+    ChatConnection.objects.update_or_create(
+        channel_name=channel_name,
+        defaults={'user_id': user_id, 'room_id': room_pk, 'last_heartbeat': timezone.now()}
+    )
+    return transition_events(user_id, room_pk, before, (True, True))
+
+
+def remove_connection(connection, last_seen, stale_before=None):
+    """
+    Delete a connection row and return the resulting events.
+
+    With `stale_before`, the row is only deleted if it still has not heartbeated since then.
+    """
+    rows = ChatConnection.objects.filter(pk=connection.pk)
+    if stale_before is not None:
+        rows = rows.filter(last_heartbeat__lt=stale_before)
+    deleted, _ = rows.delete()
+    if not deleted:
+        return []
+
+    # Peers last heard of the user through this connection
+    before = (True, True)
+    after = user_state(connection.user_id, connection.room_id)
+    if after[0]:
+        return transition_events(connection.user_id, connection.room_id, before, after)
+
+    UserPresence.objects.update_or_create(user_id=connection.user_id, defaults={'last_seen': last_seen})
+    return transition_events(connection.user_id, connection.room_id, before, after, last_seen)
+
+
+def disconnect(channel_name):
+    """
+    Record a closed connection. Returns the presence events to send.
+    """
+    connection = ChatConnection.objects.filter(channel_name=channel_name).first()
+    if connection is None:
+        return []
+    return remove_connection(connection, timezone.now())
+
+
+def heartbeat(channel_names):
+    """
+    Mark this process's connections as alive. Returns the number of rows refreshed.
+    """
+    if not channel_names:
+        return 0
+    return ChatConnection.objects.filter(channel_name__in=channel_names).update(last_heartbeat=timezone.now())
+
+
+def expire(limit=500):
+    """
+    Remove connections that missed their heartbeats. Returns the presence events to send.
+
+    Any process may run this; the delete is guarded by the old heartbeat, so each stale
+    connection is announced once.
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_ttl())
+    events = []
+    for connection in ChatConnection.objects.filter(last_heartbeat__lt=cutoff).order_by('last_heartbeat')[:limit]:
+        # The user was last seen at the final heartbeat of the dead connection
+        events.extend(remove_connection(connection, connection.last_heartbeat, stale_before=cutoff))
+    if events:
+        logger.info(f"Expired stale chat connections, sending {len(events)} presence events")
+    return events
+
+
+def get_presence(user_ids):
+    """
+    Return {user id: {'online': bool, 'last_seen': datetime or None}} for `user_ids`.
+    """
+    user_ids = set(user_ids)
+    online = set(alive_connections().filter(user_id__in=user_ids).values_list('user_id', flat=True).distinct())
+    last_seen = dict(
+        UserPresence.objects.filter(user_id__in=user_ids - online).values_list('user_id', 'last_seen')
+    )
+    return {
+        user_id: {
+            'online': user_id in online,
+            'last_seen': None if user_id in online else last_seen.get(user_id)
+        }
+        for user_id in user_ids
+    }
+
+
+def peer_presence_frame(user_id, room_pk):
+    """
+    Encoded presence frame describing `user_id`, sent to a connection when it opens.
+    """
+    online, in_room = user_state(user_id, room_pk)
+    last_seen = None
+    if not online:
+        last_seen = UserPresence.objects.filter(user_id=user_id).values_list('last_seen', flat=True).first()
+    return build_presence_event(user_id, online, in_room, last_seen)['text']
+
+
+async def send_events(channel_layer, events):
+    for group, event in events:
+        await channel_layer.group_send(group, event)
+
+
+def start_heartbeat(channel_layer, channel_name):
+    """
+    Serve heartbeats for a connection from this process's heartbeat task.
+    """
+    global _heartbeat_task
+    _local.add(channel_name)
+
+    loop = asyncio.get_running_loop()
+    if _heartbeat_task is None or _heartbeat_task.done() or _heartbeat_task.get_loop() is not loop:
+        _heartbeat_task = loop.create_task(run_heartbeat(channel_layer))
+
+
+def stop_heartbeat(channel_name):
+    _local.discard(channel_name)
+
+
+async def run_heartbeat(channel_layer):
+    """
+    Every CHAT_PRESENCE_HEARTBEAT_INTERVAL seconds, refresh this process's connections and
+    expire those of dead processes. Stops when the process serves no connections.
+    """
+    interval = getattr(settings, 'CHAT_PRESENCE_HEARTBEAT_INTERVAL', 30)
+    while _local:
+        await asyncio.sleep(interval)
+        try:
+            await database_sync_to_async(heartbeat)(list(_local))
+            events = await database_sync_to_async(expire)()
+            await send_events(channel_layer, events)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in presence heartbeat: {str(e)}")
@@ -0,0 +1,218 @@
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlparse
+import requests
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Q
+from .models import ChatMessage
+from .storage import chat_media_storage, reuse_blob, release_references
+
+logger = logging.getLogger(__name__)
+
+'''
+product_images.py: Product images in post-checkout chat messages
+product_image_reference(): Normalises a product image URL for ChatMessage.image_url
+schedule_copy(): Optionally copies the image into local storage in the background
+copy_product_image(): Downloads (with timeouts and a size cap) into chat media storage
+
+Messages reference the product image by URL (products already live on Cloudinary), so
+creating the message never waits for a download. Only when CHAT_COPY_PRODUCT_IMAGES is on
+is a copy fetched by a worker thread, from CHAT_PRODUCT_IMAGE_HOSTS only. Copies are stored
+in the deduplicating chat media storage, so every message about the same image shares one file.
+'''
+
+# Storage names are content hashes; this only saves repeat downloads of the same URL
+_lock = threading.Lock()
+_stored_by_url = OrderedDict()
+# url -> [lock, users]; concurrent copies of one URL wait for the first download
+_url_locks = {}
+_executor = None
+
+MAX_URL_LENGTH = 500
+MAX_REDIRECTS = 3
+
+
+def product_image_reference(url):
+    """
+    Return the URL to store on the message, or '' if it is not usable.
+    """
+    url = (url or '').strip()
+    if not url or len(url) > MAX_URL_LENGTH:
+        return ''
+    parsed = urlparse(url)
+    if parsed.scheme in ('http', 'https') and parsed.hostname:
+        return url
+    # Media path, with or without the leading slash ("media/products/x.jpg")
+    media_prefix = settings.MEDIA_URL.strip('/') + '/'
+    path = url.lstrip('/')
+    if not parsed.scheme and not parsed.netloc and path.startswith(media_prefix) and len(path) > len(media_prefix):
+        return '/' + path
+    # Anything else ("undefined", "javascript:...", other paths) is dropped
+    return ''
+
+
+def can_copy(url):
+    """
+    Whether a background copy of `url` is enabled and allowed (avoids fetching arbitrary hosts).
+    """
+    if not getattr(settings, 'CHAT_COPY_PRODUCT_IMAGES', False):
+        return False
+    return host_allowed(url, getattr(settings, 'CHAT_PRODUCT_IMAGE_HOSTS', ['res.cloudinary.com']))
+
+
+def host_allowed(url, allowed_hosts):
+    parsed = urlparse(url)
+    return parsed.scheme in ('http', 'https') and parsed.hostname in allowed_hosts
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'CHAT_PRODUCT_IMAGE_WORKERS', 2),
+                thread_name_prefix='chat-product-image'
+            )
+        return _executor
+
+
+def schedule_copy(message_id, url):
+    """
+    Queue a background copy of the message's product image, once the current transaction commits.
+    """
+    if not can_copy(url):
+        return
+    transaction.on_commit(lambda: get_executor().submit(copy_in_background, message_id, url))
+
+
+def copy_in_background(message_id, url):
+    """
+    Worker entry point: copy, log failures, then release this thread's database connection.
+    """
+    try:
+        copy_product_image(message_id, url)
+    except Exception as e:
+        # The message keeps referencing the remote URL, so a failed copy loses nothing
+        logger.warning(f"Could not copy product image {url} for message {message_id}: {str(e)}")
+    finally:
+        connection.close()
+
+
+def fetch_image(url, max_bytes=None, timeout=None, allowed_hosts=None):
+    """
+    Download an image with connect/read timeouts and a size cap. Returns (content, content_type).
+
+    Redirects are followed only to `allowed_hosts`, so an allowed host cannot point the
+    server at internal addresses. The limits and hosts default to the
+    CHAT_PRODUCT_IMAGE_* settings.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'CHAT_PRODUCT_IMAGE_MAX_BYTES', 5 * 1024 * 1024)
+    if timeout is None:
+        timeout = getattr(settings, 'CHAT_PRODUCT_IMAGE_TIMEOUT', (3, 10))
+    if allowed_hosts is None:
+        allowed_hosts = getattr(settings, 'CHAT_PRODUCT_IMAGE_HOSTS', ['res.cloudinary.com'])
+
+    for _ in range(MAX_REDIRECTS + 1):
+        if not host_allowed(url, allowed_hosts):
+            raise ValueError(f"Host not allowed: {urlparse(url).hostname}")
+        response = requests.get(url, stream=True, timeout=timeout, allow_redirects=False)
+        if not response.is_redirect:
+            break
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    else:
+        raise ValueError(f"More than {MAX_REDIRECTS} redirects")
+
+    with response:
+        response.raise_for_status()
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        if not content_type.startswith('image/'):
+            raise ValueError(f"Not an image: {content_type or 'unknown content type'}")
+
+        declared = response.headers.get('Content-Length')
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ValueError(f"Image is larger than {max_bytes} bytes")
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f"Image is larger than {max_bytes} bytes")
+            chunks.append(chunk)
+
+    return b''.join(chunks), content_type
+
+
+def store_image(content, content_type):
+    """
+    Save the image in the deduplicating chat media storage (counts one reference).
+    """
+    extension = '.jpg' if content_type == 'image/jpeg' else (mimetypes.guess_extension(content_type) or '.img')
+    return chat_media_storage.save(f'product{extension}', ContentFile(content))
+
+
+def remember(url, name):
+    limit = getattr(settings, 'CHAT_PRODUCT_IMAGE_CACHE_SIZE', 1024)
+    with _lock:
+        _stored_by_url[url] = name
+        _stored_by_url.move_to_end(url)
+        while len(_stored_by_url) > limit:
+            _stored_by_url.popitem(last=False)
+
+
+def lookup(url):
+    with _lock:
+        name = _stored_by_url.get(url)
+        if name is not None:
+            _stored_by_url.move_to_end(url)
+        return name
+
+
+@contextmanager
+def url_lock(url):
+    """
+    Hold a lock for `url`, so only one worker downloads it at a time.
+    """
+    with _lock:
+        entry = _url_locks.setdefault(url, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _url_locks[url]
+
+
+def copy_product_image(message_id, url):
+    """
+    Store a local copy of `url` and switch the message from the URL to the copy.
+
+    Returns the storage name of the copy.
+    """
+    with url_lock(url):
+        name = lookup(url)
+        if name is None or not reuse_blob(name):
+            content, content_type = fetch_image(url)
+            name = store_image(content, content_type)
+            remember(url, name)
+
+    # Leave messages that got an uploaded image in the meantime alone
+    updated = ChatMessage.objects.filter(
+        Q(image='') | Q(image__isnull=True),
+        id=message_id
+    ).update(image=name, image_url='')
+    if not updated:
+        release_references([name])
+    return name
@@ -0,0 +1,204 @@
+import threading
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef
+from .models import ChatRoom, ChatMessage
+from .encoding import encode
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+'''
+read_receipts.py: Batched read receipts
+mark_read(): Moves a user's "read up to message id" watermark forward in memory
+flush(): Writes pending watermarks (all, or a given reader's) to the database in one transaction
+broadcast_read_receipt(): Tells the other participant how far a user has read
+
+Clients call mark_read repeatedly while scrolling; instead of one UPDATE and a room
+save per call, watermarks are coalesced and flushed every CHAT_READ_RECEIPT_FLUSH_INTERVAL
+seconds (or as soon as CHAT_READ_RECEIPT_MAX_PENDING rooms are waiting). The REST
+mark_read endpoints flush the caller's own watermark at once, so their response and the
+next room list already reflect it.
+'''
+
+_lock = threading.Lock()
+# (room pk, reader id) -> highest message id the reader has seen
+_watermarks = {}
+# Keys whose watermark has not been written to the database yet
+_pending = set()
+_flush_timer = None
+
+
+def latest_message_id(room_pk):
+    """
+    Return the id of the newest message in a room, or None if the room is empty.
+    """
+    return ChatMessage.objects.filter(room_id=room_pk).aggregate(latest=Max('id'))['latest']
+
+
+def mark_read(room_pk, reader_id, up_to_message_id=None):
+    """
+    Record that `reader_id` has read room `room_pk` up to `up_to_message_id`.
+
+    Defaults to (and is capped at) the newest message in the room. Returns the new
+    watermark if it moved forward, or None if nothing changed.
+    """
+    latest_id = latest_message_id(room_pk)
+    if latest_id is None:
+        return None
+
+    if up_to_message_id is None or up_to_message_id > latest_id:
+        up_to_message_id = latest_id
+
+    key = (room_pk, reader_id)
+    with _lock:
+        if _watermarks.get(key, 0) >= up_to_message_id:
+            metrics.increment('chat.read_receipts.coalesced')
+            return None
+
+        _watermarks[key] = up_to_message_id
+        _pending.add(key)
+        pending_count = len(_pending)
+
+    if pending_count >= getattr(settings, 'CHAT_READ_RECEIPT_MAX_PENDING', 500):
+        flush()
+    else:
+        schedule_flush()
+
+    return up_to_message_id
+
+
+def get_watermark(room_pk, reader_id):
+    """
+    Return the in-memory watermark for a reader, or 0 if none is known.
+    """
+    with _lock:
+        return _watermarks.get((room_pk, reader_id), 0)
+
+
+def schedule_flush():
+    """
+    Start the background flush timer unless one is already running.
+    """
+    global _flush_timer
+    with _lock:
+        if _flush_timer is not None:
+            return
+        _flush_timer = threading.Timer(
+            getattr(settings, 'CHAT_READ_RECEIPT_FLUSH_INTERVAL', 2.0),
+            flush_in_background
+        )
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def flush_in_background():
+    """
+    Timer callback: flush, then release this thread's database connection.
+    """
+    global _flush_timer
+    with _lock:
+        _flush_timer = None
+    try:
+        flush()
+    finally:
+        connection.close()
+
+
+def flush(keys=None):
+    """
+    Write every pending watermark, or only those of the (room pk, reader id) `keys`, to
+    the database.
+
+    Marks the other participant's messages up to the watermark as read and clears the
+    reader's unread flag on the room, unless newer unread messages arrived meanwhile.
+    Returns the number of messages marked as read.
+    """
+    with _lock:
+        selected = _pending if keys is None else _pending.intersection(keys)
+        batch = {key: _watermarks[key] for key in selected}
+        _pending.difference_update(batch)
+
+        # Keep the dictionary bounded; clean entries can always be rebuilt
+        if len(_watermarks) > getattr(settings, 'CHAT_READ_RECEIPT_CACHE_SIZE', 10000):
+            kept = {key: _watermarks[key] for key in _pending.union(batch)}
+            _watermarks.clear()
+            _watermarks.update(kept)
+
+    if not batch:
+        return 0
+
+    rooms = {
+        room['pk']: room
+        for room in ChatRoom.objects.filter(
+            pk__in={room_pk for room_pk, _ in batch}
+        ).values('pk', 'customer_id', 'farmer_id')
+    }
+
+    updated = 0
+    try:
+        with transaction.atomic():
+            for (room_pk, reader_id), up_to_message_id in batch.items():
+                room = rooms.get(room_pk)
+                if room is None:
+                    continue
+
+                updated += ChatMessage.objects.filter(
+                    room_id=room_pk,
+                    id__lte=up_to_message_id,
+                    is_read=False
+                ).exclude(sender_id=reader_id).update(is_read=True)
+
+                # Clear the reader's unread flag only if nothing newer is waiting
+                unread_flag = 'has_unread_customer' if reader_id == room['customer_id'] else 'has_unread_farmer'
+                newer_unread = ChatMessage.objects.filter(
+                    room_id=OuterRef('pk'),
+                    id__gt=up_to_message_id,
+                    is_read=False
+                ).exclude(sender_id=reader_id)
+                ChatRoom.objects.filter(pk=room_pk).exclude(Exists(newer_unread)).update(**{unread_flag: False})
+    except Exception as e:
+        logger.error(f"Error flushing read receipts: {str(e)}")
+        # Put the batch back so the next flush retries it
+        with _lock:
+            for key, up_to_message_id in batch.items():
+                if _watermarks.get(key, 0) <= up_to_message_id:
+                    _watermarks[key] = up_to_message_id
+                _pending.add(key)
+        return 0
+
+    metrics.increment('chat.read_receipts.flushes')
+    metrics.increment('chat.read_receipts.messages_marked', updated)
+    return updated
+
+
+def broadcast_read_receipt(room_id, reader_id, up_to_message_id):
+    """
+    Send a read_receipt event to the room group from synchronous code (REST views).
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        f'chat_{room_id}',
+        build_read_receipt_event(reader_id, up_to_message_id)
+    )
+
+
+def build_read_receipt_event(reader_id, up_to_message_id):
+    """
+    Build the read_receipt group event with its WebSocket frame already encoded.
+    """
+    return {
+        'type': 'read_receipt',
+        'user_id': reader_id,
+        'text': encode({
+            'type': 'read_receipt',
+            'user_id': reader_id,
+            'up_to_message_id': up_to_message_id
+        })
+    }
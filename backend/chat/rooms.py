@@ -0,0 +1,130 @@
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from users.models import CustomUser
+from .models import ChatRoom, ChatRoomIdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+'''
+rooms.py: Race-free chat room creation
+create_room_once(): Creates an inquiry room, or returns the one a concurrent request created
+get_idempotent_room(): Looks up the room created earlier for a client idempotency key
+remember_idempotent_room(): Records which room an idempotency key produced
+
+Inquiry rooms (rooms without an order) are unique per customer, farmer and product at
+the database level (see ChatRoom.Meta.constraints), so double clicks cannot create
+duplicates: the losing insert fails and the winner's room is returned instead.
+Rooms without a product cannot be covered by that constraint (NULLs never conflict,
+and deleting products sets theirs to NULL), so creating one locks the farmer's row
+and looks again before inserting.
+Order rooms are created per order and are unique through ChatRoom.order.
+'''
+
+
+def create_room_once(customer, farmer, product=None, **defaults):
+    """
+    Create the inquiry room for (customer, farmer, product) unless it already exists.
+
+    Returns (room, created). `created` is True only for the request that inserted the row,
+    so callers can send initial messages exactly once.
+    """
+    if product is None:
+        return create_productless_room_once(customer, farmer, **defaults)
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(
+                customer=customer,
+                farmer=farmer,
+                product=product,
+                **defaults
+            )
+            return room, True
+    except IntegrityError:
+        # Another request created the room between our lookup and insert
+        room = ChatRoom.objects.filter(
+            customer=customer,
+            farmer=farmer,
+            product=product,
+            order__isnull=True
+        ).first()
+        if room is None:
+            raise
+        logger.info(f"Chat room {room.room_id} was created concurrently, reusing it")
+        return room, False
+
+
+def create_productless_room_once(customer, farmer, **defaults):
+    """
+    create_room_once() for a room without a product, serialized on the farmer's row.
+    """
+    with transaction.atomic():
+        # Concurrent creations for the same farmer wait here for the first to commit
+        CustomUser.objects.select_for_update().get(pk=farmer.pk)
+        room = ChatRoom.objects.filter(
+            customer=customer,
+            farmer=farmer,
+            product__isnull=True,
+            order__isnull=True
+        ).order_by('id').first()
+        if room is not None:
+            logger.info(f"Chat room {room.room_id} was created concurrently, reusing it")
+            return room, False
+        return ChatRoom.objects.create(customer=customer, farmer=farmer, product=None, **defaults), True
+
+
+def get_idempotency_key(request):
+    """
+    Client-supplied idempotency key from the Idempotency-Key header or the request body.
+    """
+    key = request.headers.get('Idempotency-Key') or request.data.get('idempotency_key')
+    if not key:
+        return None
+    return str(key)[:ChatRoomIdempotencyKey._meta.get_field('key').max_length]
+
+
+def request_fingerprint(*values):
+    """
+    Short hash of the parameters a key was first used with.
+    """
+    return hashlib.sha256('|'.join(str(value) for value in values).encode()).hexdigest()
+
+
+def get_idempotent_room(user, key, fingerprint):
+    """
+    Return the stored ChatRoomIdempotencyKey for (user, key), or None if unknown or expired.
+
+    Raises ValueError if the key was first used with different parameters.
+    """
+    ttl = getattr(settings, 'CHAT_IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+    record = ChatRoomIdempotencyKey.objects.select_related('room').filter(user=user, key=key).first()
+    if record is None:
+        return None
+
+    if record.created_at < timezone.now() - timedelta(seconds=ttl):
+        record.delete()
+        return None
+
+    if record.fingerprint != fingerprint:
+        raise ValueError('Idempotency key was already used with different parameters')
+    return record
+
+
+def remember_idempotent_room(user, key, fingerprint, room, created):
+    """
+    Record that `key` produced `room`. A concurrent request with the same key keeps the first record.
+    """
+    try:
+        with transaction.atomic():
+            ChatRoomIdempotencyKey.objects.create(
+                user=user,
+                key=key,
+                fingerprint=fingerprint,
+                room=room,
+                created_room=created
+            )
+    except IntegrityError:
+        pass
@@ -0,0 +1,160 @@
+import html
+import re
+from django.db import connection, connections
+from django.db.models import F, FloatField, TextField
+from django.db.models.expressions import RawSQL, Value
+
+'''
+search.py: Full-text search over chat messages
+search_messages(): Filters a ChatMessage queryset by a text query and annotates
+`rank` (higher is better) and `headline` (snippet with highlight markers)
+render_headline(): Turns a headline into safe HTML with <mark> tags
+ensure_sqlite_fts(): Creates the SQLite FTS5 table and triggers if they are missing
+
+PostgreSQL uses to_tsvector('english', message) backed by the GIN expression index
+from migration 0010; SQLite uses the FTS5 table chat_chatmessage_fts kept in sync by
+triggers. Other databases fall back to a case-insensitive substring match.
+
+SQLite drops triggers whenever Django rebuilds a table during a migration, so
+ensure_sqlite_fts() also runs after every migrate (see ChatConfig.ready).
+'''
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'chat_chatmessage_fts'
+
+SQLITE_FTS_TRIGGERS = {
+    f'{FTS_TABLE}_ai': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chat_chatmessage BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message); END"
+    ),
+    f'{FTS_TABLE}_ad': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chat_chatmessage BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message); END"
+    ),
+    f'{FTS_TABLE}_au': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF message ON chat_chatmessage BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message); "
+        f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message); END"
+    ),
+}
+
+# Highlight markers that cannot appear in HTML-escaped text; swapped for <mark> tags on output
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+
+def search_messages(queryset, query):
+    """
+    Restrict `queryset` to messages matching `query`, annotated with rank and headline.
+
+    Returns an empty queryset if the query has no searchable words.
+    """
+    query = (query or '').strip()
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor == 'postgresql':
+        return search_postgres(queryset, terms)
+    if connection.vendor == 'sqlite':
+        return search_sqlite(queryset, terms)
+    return search_fallback(queryset, terms)
+
+
+def search_postgres(queryset, terms):
+    from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+
+    # Must match the indexed expression exactly for the GIN index to be used
+    vector = SearchVector('message', config=SEARCH_CONFIG)
+    # Terms are plain words (\w+), so a raw tsquery is safe; the last word is a prefix match
+    raw_query = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+    search_query = SearchQuery(raw_query, config=SEARCH_CONFIG, search_type='raw')
+
+    return queryset.annotate(
+        search=vector
+    ).filter(
+        search=search_query
+    ).annotate(
+        rank=SearchRank(vector, search_query),
+        headline=SearchHeadline(
+            'message',
+            search_query,
+            config=SEARCH_CONFIG,
+            start_sel=HIGHLIGHT_START,
+            stop_sel=HIGHLIGHT_STOP,
+            max_words=30,
+            min_words=10,
+        ),
+    ).order_by('-rank', '-timestamp')
+
+
+def search_sqlite(queryset, terms):
+    # Quote every word so user input cannot inject FTS5 syntax; the last word is a prefix match
+    match = ' '.join(f'"{term}"' for term in terms[:-1])
+    match = f'{match} "{terms[-1]}"*'.strip()
+
+    table = queryset.model._meta.db_table
+    return queryset.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+    ).annotate(
+        # bm25() is lower for better matches, so negate it to rank like PostgreSQL
+        rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (match,),
+            output_field=FloatField(),
+        ),
+        headline=RawSQL(
+            f"SELECT snippet({FTS_TABLE}, 0, %s, %s, '...', 30) FROM {FTS_TABLE} "
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (HIGHLIGHT_START, HIGHLIGHT_STOP, match),
+            output_field=TextField(),
+        ),
+    ).order_by('-rank', '-timestamp')
+
+
+def search_fallback(queryset, terms):
+    for term in terms:
+        queryset = queryset.filter(message__icontains=term)
+    return queryset.annotate(
+        rank=Value(0.0, output_field=FloatField()),
+        headline=F('message'),
+    ).order_by('-timestamp')
+
+
+def render_headline(headline):
+    """
+    HTML-escape a headline and turn the highlight markers into <mark> tags.
+    """
+    if not headline:
+        return ''
+    return html.escape(headline).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+
+
+def ensure_sqlite_fts(using='default'):
+    """
+    Create the FTS5 table and its sync triggers on SQLite if they are missing.
+
+    If any trigger had to be (re)created the index may be stale, so it is rebuilt
+    from chat_chatmessage. Does nothing on other databases.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            (f'{FTS_TABLE}_%',)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing == set(SQLITE_FTS_TRIGGERS):
+            return
+
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"message, content='chat_chatmessage', content_rowid='id', tokenize='porter unicode61')"
+        )
+        for statement in SQLITE_FTS_TRIGGERS.values():
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
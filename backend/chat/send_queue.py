@@ -0,0 +1,99 @@
+import asyncio
+from collections import deque
+from . import metrics
+
+'''
+send_queue.py: Bounded per-connection outbound queue for WebSocket frames
+put(): Queues a frame; low-value frames (typing, read receipts) are coalesced by key
+get(): Waits for the next frame to write to the socket
+
+When the queue is full, queued low-value frames are dropped first. If only important
+frames (messages, order updates) are waiting, put() reports an overflow and the
+consumer disconnects the client, which can resume with last_seen_message_id.
+'''
+
+
+class OutboundQueue:
+    """
+    FIFO of encoded frames with a size limit and a coalesce-or-drop policy.
+    """
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        # Entries are [coalesce_key, text]; coalesce_key is None for important frames
+        self.entries = deque()
+        # coalesce_key -> queued entry, so a newer frame can replace an older one in place
+        self.coalescable = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, text, coalesce_key=None):
+        """
+        Queue a frame. Returns False if an important frame does not fit (client too slow).
+        """
+        if self.closed:
+            return True
+
+        # Replace a queued frame with the same key instead of queueing another one
+        if coalesce_key is not None and coalesce_key in self.coalescable:
+            self.coalescable[coalesce_key][1] = text
+            metrics.increment('chat.send_queue.frames_coalesced')
+            return True
+
+        if len(self.entries) >= self.max_size:
+            if coalesce_key is not None:
+                metrics.increment('chat.send_queue.frames_dropped')
+                return True
+            if not self.drop_oldest_coalescable():
+                metrics.increment('chat.send_queue.overflows')
+                return False
+
+        entry = [coalesce_key, text]
+        self.entries.append(entry)
+        if coalesce_key is not None:
+            self.coalescable[coalesce_key] = entry
+
+        metrics.adjust_gauge('chat.send_queue.depth', 1)
+        if len(self.entries) > metrics.get('chat.send_queue.max_depth'):
+            metrics.set_gauge('chat.send_queue.max_depth', len(self.entries))
+        self.ready.set()
+        return True
+
+    def drop_oldest_coalescable(self):
+        """
+        Remove the oldest low-value frame to make room. Returns False if there is none.
+        """
+        for entry in self.entries:
+            if entry[0] is not None:
+                self.entries.remove(entry)
+                del self.coalescable[entry[0]]
+                metrics.adjust_gauge('chat.send_queue.depth', -1)
+                metrics.increment('chat.send_queue.frames_dropped')
+                return True
+        return False
+
+    async def get(self):
+        """
+        Wait for and return the next frame's text.
+        """
+        while not self.entries:
+            self.ready.clear()
+            await self.ready.wait()
+
+        coalesce_key, text = self.entries.popleft()
+        if coalesce_key is not None:
+            del self.coalescable[coalesce_key]
+        metrics.adjust_gauge('chat.send_queue.depth', -1)
+        return text
+
+    def close(self):
+        """
+        Stop accepting frames and forget the queued ones.
+        """
+        self.closed = True
+        metrics.adjust_gauge('chat.send_queue.depth', -len(self.entries))
+        self.entries.clear()
+        self.coalescable.clear()
@@ -1,10 +1,13 @@
 from rest_framework import serializers
-from .models import ChatRoom, ChatMessage, ChatMessageImage
+from .models import ChatRoom, ChatMessage, ChatMessageImage, ArchivedChatMessage
 # from users.models import CustomUser
 # from products.models import Product
 from users.serializers import UserCreateSerializer
 from products.serializers import ProductSerializer
 from django.utils import timezone
+from .search import render_headline
+from .archive import latest_archived_message
+from django.core.files.storage import default_storage
 # import datetime
 
 class ChatMessageImageSerializer(serializers.ModelSerializer):
@@ -17,6 +20,12 @@ class ChatMessageImageSerializer(serializers.ModelSerializer):
         fields = ['id', 'message', 'image', 'uploaded_at']
         read_only_fields = ['id', 'uploaded_at']
 
+def message_preview(text):
+    """
+    First 50 characters of a message, for room lists
+    """
+    return text[:50] + '...' if len(text) > 50 else text
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     """
     Serializer for the ChatRoom model.
@@ -44,9 +53,12 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         """
         # Get the latest message for this room
         latest_message = ChatMessage.objects.filter(room=obj).order_by('-timestamp').first()
+        # Rooms whose history was archived fall back to the archive table
+        if latest_message is None:
+            latest_message = latest_archived_message(obj)
         
         if latest_message:
-            return latest_message.message[:50] + '...' if len(latest_message.message) > 50 else latest_message.message
+            return message_preview(latest_message.message)
         return ""
     
     def get_unread_count(self, obj):
@@ -88,6 +100,24 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         days = int(hours / 24)
         return f"{days} day{'s' if days != 1 else ''} ago"
 
+class FarmerOrderSerializer(ChatRoomSerializer):
+    """
+    ChatRoomSerializer for the farmer order board (order_board.board_queryset).
+    Reads the last message and unread count from query annotations instead of
+    querying per room, and includes the board priority for client-side placement.
+    """
+    priority = serializers.IntegerField(read_only=True)
+    
+    class Meta(ChatRoomSerializer.Meta):
+        fields = ChatRoomSerializer.Meta.fields + ['priority']
+    
+    def get_last_message_text(self, obj):
+        return message_preview(obj.last_message or '')
+    
+    def get_unread_count(self, obj):
+        # Messages from the customer the farmer has not read
+        return obj.unread_messages
+
 class ChatMessageSerializer(serializers.ModelSerializer):
     """
     Serializer for the ChatMessage model.
@@ -99,9 +129,9 @@ class ChatMessageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ChatMessage
-        fields = ['id', 'room', 'sender', 'message', 'image', 'images', 'is_read', 
+        fields = ['id', 'room', 'sender', 'message', 'image', 'image_url', 'images', 'is_read', 
                   'timestamp', 'sender_detail', 'all_image_urls']
-        read_only_fields = ['id', 'timestamp', 'is_read', 'all_image_urls']
+        read_only_fields = ['id', 'timestamp', 'is_read', 'image_url', 'all_image_urls']
     
     def get_all_image_urls(self, instance):
         """
@@ -117,6 +147,13 @@ class ChatMessageSerializer(serializers.ModelSerializer):
             else:
                 all_images.append(instance.image.url)
         
+        # Add image referenced by URL (e.g. product image in post-checkout messages)
+        if instance.image_url:
+            if request:
+                all_images.append(request.build_absolute_uri(instance.image_url))
+            else:
+                all_images.append(instance.image_url)
+        
         # Add additional images
         for img in instance.images.all():
             if request:
@@ -138,6 +175,12 @@ class ChatMessageSerializer(serializers.ModelSerializer):
             if request:
                 representation['image'] = request.build_absolute_uri(instance.image.url)
         
+        # Relative referenced URLs (local media) are made absolute too
+        if representation['image_url']:
+            request = self.context.get('request')
+            if request:
+                representation['image_url'] = request.build_absolute_uri(instance.image_url)
+        
         # Make sure all image URLs in the images list are absolute
         for image_data in representation['images']:
             if image_data['image']:
@@ -147,3 +190,94 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         
         return representation
 
+
+
+class ChatMessageSearchSerializer(serializers.ModelSerializer):
+    """
+    Serializer for chat message search results.
+    Adds the room's public id, the sender's name, the match rank and a highlighted snippet.
+    """
+    room_id = serializers.CharField(source='room.room_id', read_only=True)
+    sender_name = serializers.CharField(source='sender.full_name', read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'room', 'room_id', 'sender', 'sender_name', 'message',
+                  'headline', 'rank', 'timestamp']
+        read_only_fields = fields
+
+    def get_headline(self, obj):
+        """
+        Returns the matching snippet as HTML with matches wrapped in <mark> tags
+        """
+        return render_headline(getattr(obj, 'headline', ''))
+
+
+class ArchivedChatMessageSerializer(serializers.ModelSerializer):
+    """
+    Serializer for archived chat messages.
+    Produces the same fields as ChatMessageSerializer so clients can't tell them apart.
+    """
+    sender_detail = UserCreateSerializer(source='sender', read_only=True)
+    image = serializers.SerializerMethodField()
+    image_url = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+    all_image_urls = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedChatMessage
+        fields = ['id', 'room', 'sender', 'message', 'image', 'image_url', 'images', 'is_read',
+                  'timestamp', 'sender_detail', 'all_image_urls']
+        read_only_fields = fields
+
+    def build_url(self, name):
+        """
+        Absolute URL for a stored file name
+        """
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_image(self, instance):
+        return self.build_url(instance.image.name) if instance.image else None
+
+    def get_image_url(self, instance):
+        if not instance.image_url:
+            return ''
+        request = self.context.get('request')
+        return request.build_absolute_uri(instance.image_url) if request else instance.image_url
+
+    def get_images(self, instance):
+        # Archived images no longer have ChatMessageImage rows, so there is no image id
+        return [
+            {
+                'id': None,
+                'message': instance.id,
+                'image': self.build_url(img['image']),
+                'uploaded_at': img['uploaded_at'],
+            }
+            for img in instance.images
+        ]
+
+    def get_all_image_urls(self, instance):
+        urls = []
+        if instance.image:
+            urls.append(self.build_url(instance.image.name))
+        if instance.image_url:
+            urls.append(self.get_image_url(instance))
+        urls.extend(self.build_url(img['image']) for img in instance.images)
+        return urls
+
+
+def serialize_history(messages, context=None):
+    """
+    Serialize a mix of ChatMessage and ArchivedChatMessage instances (see archive.room_history)
+    """
+    live = ChatMessageSerializer(context=context)
+    archived = ArchivedChatMessageSerializer(context=context)
+    return [
+        (archived if isinstance(message, ArchivedChatMessage) else live).to_representation(message)
+        for message in messages
+    ]
@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from .models import ChatRoom, ChatMessage, ChatMessageImage, ArchivedChatMessage
+from .storage import release_references
+from .order_board import broadcast_room
+
+'''
+signals.py: Keeps ChatMediaBlob reference counts in step with deleted rows
+Deleting a message, message image or archived message releases the blobs it used
+(this includes cascades from deleted rooms and users)
+
+Also pushes new rooms, order status changes and deleted rooms to the farmer's order board
+'''
+
+
+@receiver(post_delete, sender=ChatMessage)
+def release_message_image(sender, instance, **kwargs):
+    if instance.image:
+        release_references([instance.image.name])
+
+
+@receiver(post_delete, sender=ChatMessageImage)
+def release_message_extra_image(sender, instance, **kwargs):
+    if instance.image:
+        release_references([instance.image.name])
+
+
+@receiver(post_delete, sender=ArchivedChatMessage)
+def release_archived_images(sender, instance, **kwargs):
+    names = [img.get('image') for img in instance.images]
+    if instance.image:
+        names.append(instance.image.name)
+    release_references(names)
+
+
+@receiver(post_init, sender=ChatRoom)
+def remember_board_state(sender, instance, **kwargs):
+    # Compared in post_save to push only changes that move a room on the board
+    instance._board_state = (instance.order_status, instance.is_new_order)
+
+
+@receiver(post_save, sender=ChatRoom)
+def push_room_to_board(sender, instance, created, **kwargs):
+    state = (instance.order_status, instance.is_new_order)
+    if created or state != instance._board_state:
+        broadcast_room(instance.farmer_id, instance.pk, instance.room_id)
+    instance._board_state = state
+
+
+@receiver(post_delete, sender=ChatRoom)
+def remove_room_from_board(sender, instance, **kwargs):
+    broadcast_room(instance.farmer_id, instance.pk, instance.room_id, action='remove')
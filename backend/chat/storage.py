@@ -0,0 +1,186 @@
+import hashlib
+import os
+from collections import Counter
+from django.core.files import File
+from django.core.files.storage import Storage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+'''
+storage.py: Content-addressed, deduplicating storage for chat attachments
+ChatMediaStorage: Names every upload by its SHA-256 and writes each distinct file once
+reuse_blob(): Counts another reference to a blob that is already stored
+add_references(): Counts new rows pointing at blobs (paths that bypass storage.save)
+release_references(): Uncounts deleted rows; unreferenced blobs are collected by gc_chat_media
+
+Files live under chat_images/blobs/ in the configured default storage. ChatMediaBlob keeps
+one row per blob with the number of messages, message images and archived messages that
+use it; saving an upload counts as one reference and post_delete signals release them
+(see signals.py). The original upload_to of the image fields is not used for new files.
+'''
+
+BLOB_PREFIX = 'chat_images/blobs'
+
+
+def blob_name(digest, extension=''):
+    """
+    Storage name of the blob with SHA-256 `digest`, fanned out over two directory levels.
+    """
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_PREFIX}/')
+
+
+def hash_content(content):
+    """
+    Return (sha256 hex digest, size) of a File, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+@deconstructible
+class ChatMediaStorage(Storage):
+    """
+    Deduplicating front for default_storage.
+
+    save() returns the name of the existing blob when the same bytes were stored before,
+    so repeated attachments cost a hash instead of a write.
+    """
+
+    @property
+    def backend(self):
+        return default_storage
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest, size = hash_content(content)
+        extension = os.path.splitext(name)[1].lower()[:10]
+        name = blob_name(digest, extension)
+
+        # Count the reference before touching the file: gc_chat_media only deletes blobs
+        # whose row it can lock with no references, so the file cannot vanish after this
+        register_blob(name, digest, size)
+
+        if not self.backend.exists(name):
+            content.seek(0)
+            saved = self.backend.save(name, content, max_length=max_length)
+            if saved != name:
+                # A concurrent upload of the same bytes wrote `name` first; keep only that copy
+                self.backend.delete(saved)
+        return name
+
+    def _open(self, name, mode='rb'):
+        return self.backend.open(name, mode)
+
+    def _save(self, name, content):
+        return self.backend.save(name, content)
+
+    def delete(self, name):
+        self.backend.delete(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+chat_media_storage = ChatMediaStorage()
+
+
+def get_chat_media_storage():
+    """
+    Storage callable for the chat image fields (keeps migrations independent of settings).
+    """
+    return chat_media_storage
+
+
+def register_blob(name, digest, size):
+    """
+    Record one more reference to the blob `name`, creating its row on first use.
+    """
+    from .models import ChatMediaBlob
+
+    if ChatMediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, unreferenced_at=None):
+        return
+    try:
+        with transaction.atomic():
+            ChatMediaBlob.objects.create(name=name, sha256=digest, size=size, ref_count=1)
+    except IntegrityError:
+        # Another upload of the same bytes created the row first
+        add_references([name])
+
+
+def reuse_blob(name):
+    """
+    Count one more reference to an existing blob. Returns False (counting nothing) if the
+    blob has been collected, in which case the caller has to store the content again.
+    """
+    from .models import ChatMediaBlob
+
+    if not ChatMediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, unreferenced_at=None):
+        return False
+    if not chat_media_storage.exists(name):
+        release_references([name])
+        return False
+    return True
+
+
+def add_references(names):
+    """
+    Count one reference per occurrence of a blob name in `names` (other names are ignored).
+    """
+    from .models import ChatMediaBlob
+
+    for name, count in Counter(name for name in names if is_blob(name)).items():
+        ChatMediaBlob.objects.filter(name=name).update(
+            ref_count=F('ref_count') + count,
+            unreferenced_at=None
+        )
+
+
+def release_references(names):
+    """
+    Drop one reference per occurrence of a blob name in `names`.
+
+    Blobs left without references are stamped with unreferenced_at; their files are
+    removed by gc_chat_media after a grace period, in case an identical upload reuses them.
+    """
+    from .models import ChatMediaBlob
+
+    counts = Counter(name for name in names if is_blob(name))
+    for name, count in counts.items():
+        ChatMediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - count)
+    if counts:
+        ChatMediaBlob.objects.filter(
+            name__in=list(counts),
+            ref_count__lte=0,
+            unreferenced_at__isnull=True
+        ).update(unreferenced_at=timezone.now())
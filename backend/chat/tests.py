@@ -0,0 +1,326 @@
+import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from products.models import Product
+from users.models import CustomUser
+from .models import ChatRoom, ChatMessage
+from . import read_receipts
+from .product_images import product_image_reference
+from .views import ChatRoomViewSet
+
+'''
+tests.py: Chat room API tests
+ConditionalGetTests: Room list and detail answer a current If-None-Match with 304, unserialized
+HotPathIndexTests: The chat hot-path queries use the indexes made for them (PostgreSQL only)
+ConcurrentRoomCreationTests: Parallel requests for a room without a product create one room
+TranscriptExportTests: CSV transcripts can't smuggle spreadsheet formulas
+MarkReadTests: mark_read writes the caller's receipt before answering
+ProductImageReferenceTests: Only web URLs and media paths are stored as message images
+PostCheckoutMessageTests: The post-checkout message falls back to the product image
+'''
+
+
+def create_user(number, user_type):
+    return CustomUser.objects.create_user(
+        f'+92300{number:07d}', f'{user_type.lower()}{number}@example.com', f'User {number}',
+        user_type, 'Punjab', 'Lahore', password='password'
+    )
+
+
+class ConditionalGetTests(APITestCase):
+    """
+    ETags on ChatRoomViewSet (AgroConnect/conditional.py).
+    """
+    def setUp(self):
+        self.customer = create_user(1, 'CUSTOMER')
+        self.farmer = create_user(2, 'FARMER')
+        product = Product.objects.create(
+            farmer=self.farmer, productName='Mango', category='Fruits', description='Sindhri',
+            price=10, stockQuantity=5,
+        )
+        self.room = ChatRoom.objects.create(room_id='room-1', customer=self.customer, farmer=self.farmer, product=product)
+        ChatMessage.objects.create(room=self.room, sender=self.customer, message='Hello')
+        self.client.force_authenticate(self.customer)
+
+    def assertNotModifiedWithoutSerializing(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with mock.patch.object(ChatRoomViewSet, 'get_serializer', side_effect=AssertionError('serialized')):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+        return etag
+
+    def test_list_not_modified(self):
+        self.assertNotModifiedWithoutSerializing('/api/chat/rooms/')
+
+    def test_detail_not_modified(self):
+        self.assertNotModifiedWithoutSerializing(f'/api/chat/rooms/{self.room.room_id}/')
+
+    def test_new_message_changes_the_etag(self):
+        url = f'/api/chat/rooms/{self.room.room_id}/'
+        etag = self.assertNotModifiedWithoutSerializing(url)
+
+        ChatMessage.objects.create(room=self.room, sender=self.farmer, message='Hi')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL')
+class HotPathIndexTests(TestCase):
+    """
+    EXPLAIN the hot-path queries and check they use the indexes of migration
+    chat/0011_chat_hot_path_indexes.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                id=f'user{i}', phone_number=f'+92300{i:07d}', email=f'user{i}@example.com',
+                full_name=f'User {i}', user_type='FARMER' if i % 5 == 0 else 'CUSTOMER',
+                province='Punjab', city='Lahore',
+            )
+            for i in range(100)
+        ])
+        cls.farmers = [user for user in users if user.user_type == 'FARMER']
+        cls.customers = [user for user in users if user.user_type == 'CUSTOMER']
+        products = Product.objects.bulk_create([
+            Product(farmer=cls.farmers[i % len(cls.farmers)], productName=f'Product {i}', category='Fruits',
+                    description='Fresh', price=10, stockQuantity=5)
+            for i in range(1000)
+        ])
+        statuses = ['pending', 'shipped', 'delivered', 'completed']
+        cls.rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(
+                room_id=f'room-{i}', customer=cls.customers[i % len(cls.customers)],
+                farmer=product.farmer, product=product, order_status=statuses[i % len(statuses)],
+            )
+            for i, product in enumerate(products)
+        ])
+        now = timezone.now()
+        messages = []
+        for i in range(20000):
+            # One busy room, the rest of the history spread over every room
+            room = cls.rooms[0] if i % 10 == 0 else cls.rooms[i % len(cls.rooms)]
+            messages.append(ChatMessage(
+                room=room, sender=room.customer if i % 2 else room.farmer, message='Hello',
+                is_read=i % 20 != 0, timestamp=now - timedelta(seconds=i),
+            ))
+        ChatMessage.objects.bulk_create(messages, batch_size=5000)
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE chat_chatroom')
+            cursor.execute('ANALYZE chat_chatmessage')
+            # The test tables are small; make the planner choose between indexes only
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, *names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in names), f"None of {names} in:\n{plan}")
+
+    def test_room_list(self):
+        user = self.customers[0]
+        queryset = ChatRoom.objects.filter(Q(customer=user) | Q(farmer=user)).order_by('-updated_at')
+        self.assertUsesIndex(queryset, 'chat_room_customer_upd_idx')
+
+        farmer = self.farmers[0]
+        queryset = ChatRoom.objects.filter(Q(customer=farmer) | Q(farmer=farmer)).order_by('-updated_at')
+        self.assertUsesIndex(queryset, 'chat_room_farmer_upd_idx', 'chat_room_farmer_status_idx')
+
+    def test_order_board(self):
+        queryset = ChatRoom.objects.filter(
+            farmer=self.farmers[0], order_status__in=['pending', 'shipped']
+        ).order_by('-updated_at')
+        self.assertUsesIndex(queryset, 'chat_room_farmer_status_idx', 'chat_room_farmer_upd_idx')
+
+    def test_unread_messages(self):
+        room = self.rooms[0]
+        self.assertUsesIndex(ChatMessage.objects.filter(room=room, sender=room.customer, is_read=False), 'chat_msg_unread_idx')
+        # Mark as read (chat/read_receipts.py)
+        queryset = ChatMessage.objects.filter(room=room, id__lte=10**9, is_read=False).exclude(sender=room.customer)
+        self.assertUsesIndex(queryset, 'chat_msg_unread_idx')
+
+    def test_latest_message(self):
+        self.assertUsesIndex(ChatMessage.objects.filter(room=self.rooms[0]).order_by('-timestamp')[:1], 'chat_msg_room_ts_idx')
+
+    def test_reconnect_catch_up(self):
+        # A client that missed the last few messages of a room, while other rooms went on
+        room = self.rooms[1]
+        last_seen = ChatMessage.objects.filter(room=room).order_by('-id').values_list('id', flat=True)[5]
+        queryset = ChatMessage.objects.filter(room=room, id__gt=last_seen).order_by('id')[:51]
+        self.assertUsesIndex(queryset, 'chat_msg_room_id_idx')
+
+
+class ProductImageReferenceTests(SimpleTestCase):
+    """
+    product_image_reference() for the product_image sent with a chat message.
+    """
+    def test_keeps_web_urls(self):
+        url = 'https://res.cloudinary.com/demo/image/upload/mango.jpg'
+        self.assertEqual(product_image_reference(url), url)
+
+    def test_roots_media_paths(self):
+        self.assertEqual(product_image_reference('media/products/mango.jpg'), '/media/products/mango.jpg')
+        self.assertEqual(product_image_reference(' /media/products/mango.jpg '), '/media/products/mango.jpg')
+
+    def test_drops_everything_else(self):
+        for value in ['', None, 'undefined', 'null', 'javascript:alert(1)', '//example.com/media/x.jpg',
+                      '/static/x.jpg', 'media/', 'https://', 'ftp://example.com/x.jpg']:
+            with self.subTest(value=value):
+                self.assertEqual(product_image_reference(value), '')
+
+
+class PostCheckoutMessageTests(APITestCase):
+    """
+    The first message of a post-checkout room (ChatRoomViewSet.create_or_get_room).
+    """
+    url = '/api/chat/rooms/create_or_get_room/'
+    image = 'https://res.cloudinary.com/demo/image/upload/mango.jpg'
+
+    def setUp(self):
+        self.customer = create_user(1, 'CUSTOMER')
+        self.farmer = create_user(2, 'FARMER')
+        self.product = Product.objects.create(
+            farmer=self.farmer, productName='Mango', category='Fruits', description='Sindhri',
+            price=10, stockQuantity=5, imageUrl=self.image,
+        )
+        self.client.force_authenticate(self.customer)
+
+    def checkout_image(self, product_image_url):
+        with mock.patch('chat.views.schedule_copy') as schedule_copy:
+            response = self.client.post(self.url, {
+                'customer': self.customer.id, 'farmer': self.farmer.id, 'product': self.product.id,
+                'is_post_checkout': True, 'product_image_url': product_image_url,
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        message = ChatMessage.objects.get(room__room_id=response.data['room_id'])
+        schedule_copy.assert_called_once_with(message.id, message.image_url)
+        return message.image_url
+
+    def test_uses_the_sent_image(self):
+        self.assertEqual(self.checkout_image('/media/products/mango.jpg'), '/media/products/mango.jpg')
+
+    def test_falls_back_to_the_product_image(self):
+        for value in ['undefined', 'javascript:alert(1)', '', None]:
+            with self.subTest(value=value):
+                ChatRoom.objects.all().delete()
+                self.assertEqual(self.checkout_image(value), self.image)
+
+
+class TranscriptExportTests(APITestCase):
+    """
+    GET /api/chat/rooms/<room_id>/export/ (chat/transcripts.py).
+    """
+    def setUp(self):
+        self.customer = create_user(1, 'CUSTOMER')
+        self.customer.full_name = '@SUM(A1:A9)'
+        self.customer.save()
+        self.farmer = create_user(2, 'FARMER')
+        self.room = ChatRoom.objects.create(room_id='room-1', customer=self.customer, farmer=self.farmer)
+        for text in ['=HYPERLINK("http://evil.example","Invoice")', '+92 300 1234567', '-5 kg', '\tcmd', 'Fresh - today']:
+            ChatMessage.objects.create(room=self.room, sender=self.customer, message=text)
+        self.client.force_authenticate(self.farmer)
+
+    def test_csv_escapes_formulas(self):
+        response = self.client.get(f'/api/chat/rooms/{self.room.room_id}/export/', {'file_format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+
+        self.assertEqual([row['message'] for row in rows], [
+            '\'=HYPERLINK("http://evil.example","Invoice")', "'+92 300 1234567", "'-5 kg", "'\tcmd", 'Fresh - today',
+        ])
+        self.assertEqual({row['sender_name'] for row in rows}, {"'@SUM(A1:A9)"})
+        # Timestamps are not user input and stay as they are
+        self.assertTrue(rows[0]['timestamp'][0].isdigit())
+
+    def test_jsonl_is_unchanged(self):
+        response = self.client.get(f'/api/chat/rooms/{self.room.room_id}/export/', {'file_format': 'jsonl'})
+        self.assertIn('"=HYPERLINK(', b''.join(response.streaming_content).decode())
+
+
+class MarkReadTests(APITestCase):
+    """
+    The REST mark_read endpoints flush the caller's watermark synchronously.
+    """
+    def setUp(self):
+        read_receipts._watermarks.clear()
+        read_receipts._pending.clear()
+        self.customer = create_user(1, 'CUSTOMER')
+        self.farmer = create_user(2, 'FARMER')
+        self.room = ChatRoom.objects.create(room_id='room-1', customer=self.customer, farmer=self.farmer)
+        for text in ['Hello', 'Is it fresh?']:
+            ChatMessage.objects.create(room=self.room, sender=self.customer, message=text)
+        ChatRoom.objects.filter(pk=self.room.pk).update(has_unread_farmer=True)
+        self.client.force_authenticate(self.farmer)
+
+    def assertRoomRead(self):
+        self.assertFalse(ChatMessage.objects.filter(room=self.room, is_read=False).exists())
+        self.room.refresh_from_db()
+        self.assertFalse(self.room.has_unread_farmer)
+
+    def test_room_mark_read(self):
+        response = self.client.post(f'/api/chat/rooms/{self.room.room_id}/mark_read/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['messages_updated'], 2)
+        self.assertEqual(response.data['read_up_to'], ChatMessage.objects.latest('id').id)
+        self.assertRoomRead()
+
+        # Nothing new to mark the second time
+        response = self.client.post(f'/api/chat/rooms/{self.room.room_id}/mark_read/')
+        self.assertEqual(response.data['messages_updated'], 0)
+
+    def test_message_mark_read(self):
+        response = self.client.post('/api/chat/messages/mark_read/', {'room_id': self.room.room_id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['messages_read'], 2)
+        self.assertRoomRead()
+
+
+class ConcurrentRoomCreationTests(TransactionTestCase):
+    """
+    create_or_get_room called by several requests at once (chat/rooms.py).
+    """
+    REQUESTS = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite':
+            self.skipTest("SQLite's shared in-memory test database rejects concurrent writers")
+        self.customer = create_user(1, 'CUSTOMER')
+        self.farmer = create_user(2, 'FARMER')
+
+    def test_parallel_creations_without_product_share_one_room(self):
+        barrier = threading.Barrier(self.REQUESTS)
+
+        def request(i):
+            try:
+                client = APIClient()
+                client.force_authenticate(self.customer)
+                barrier.wait()
+                response = client.post('/api/chat/rooms/create_or_get_room/', {
+                    'customer': self.customer.id,
+                    'farmer': self.farmer.id,
+                }, format='json')
+                return response.status_code, response.data['room_id']
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.REQUESTS) as executor:
+            results = list(executor.map(request, range(self.REQUESTS)))
+
+        self.assertEqual({code for code, _ in results}, {status.HTTP_200_OK})
+        self.assertEqual(len({room_id for _, room_id in results}), 1)
+        self.assertEqual(ChatRoom.objects.filter(customer=self.customer, farmer=self.farmer).count(), 1)
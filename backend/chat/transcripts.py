@@ -0,0 +1,178 @@
+import csv
+import json
+from html import escape
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .archive import iter_room_history
+from .models import ArchivedChatMessage
+from .serializers import ChatMessageSerializer, ArchivedChatMessageSerializer
+
+'''
+transcripts.py: Streaming chat transcript downloads (ChatRoomViewSet.export)
+transcript_rows(): One dict per message (live and archived), with absolute image links
+render_csv() / render_jsonl() / render_html(): Turn rows into text
+csv_cell(): Neutralizes CSV cells a spreadsheet would run as a formula
+transcript_response(): StreamingHttpResponse that writes the transcript as it is read
+
+Messages come from archive.iter_room_history, so at most one database chunk and one
+output chunk (CHAT_EXPORT_CHUNK_BYTES) are in memory regardless of the thread length.
+Under ASGI the generator is advanced in batches through sync_to_async; Django would
+otherwise read a synchronous iterator into a list before sending it.
+'''
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+}
+
+CSV_COLUMNS = ['id', 'timestamp', 'sender_id', 'sender_name', 'message', 'image_urls']
+
+# Spreadsheets treat cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def transcript_rows(room, request=None):
+    """
+    Yield the room's messages, oldest first, as plain dicts.
+    """
+    context = {'request': request}
+    # Only get_all_image_urls is used; it builds the same links the chat UI shows
+    live = ChatMessageSerializer(context=context)
+    archived = ArchivedChatMessageSerializer(context=context)
+
+    for message in iter_room_history(room):
+        serializer = archived if isinstance(message, ArchivedChatMessage) else live
+        row = {
+            'id': message.id,
+            'timestamp': message.timestamp.isoformat(),
+            'sender_id': message.sender_id,
+            'sender_name': message.sender.full_name,
+            'message': message.message,
+            'image_urls': serializer.get_all_image_urls(message),
+        }
+        # The prefetched images queryset and the image FieldFile refer back to the message;
+        # dropping them lets it be freed right away instead of at the next full garbage collection
+        message.__dict__.pop('_prefetched_objects_cache', None)
+        message.__dict__.pop('image', None)
+        yield row
+
+
+class Echo:
+    """
+    File-like object whose write() returns the written text, for csv.writer
+    """
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    """
+    Prefix text a spreadsheet would evaluate (e.g. a message "=HYPERLINK(...)") with a quote,
+    so it is shown as typed.
+    """
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def render_csv(room, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        # Names and messages are user input
+        yield writer.writerow([csv_cell(value) for value in [
+            row['id'], row['timestamp'], row['sender_id'], row['sender_name'],
+            row['message'], ' '.join(row['image_urls'])
+        ]])
+
+
+def render_jsonl(room, rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def render_html(room, rows):
+    title = escape(f"Chat between {room.customer.full_name} and {room.farmer.full_name}")
+    product = escape(room.product.productName) if room.product else 'deleted product'
+    yield (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+        f'<title>{title}</title>'
+        '<style>body{font-family:sans-serif;max-width:800px;margin:auto}'
+        '.meta{color:#666;font-size:.85em}li{margin-bottom:1em}</style>'
+        f'</head><body><h1>{title}</h1>'
+        f'<p class="meta">Product: {product} &middot; Room {escape(room.room_id)} &middot; '
+        f'Exported {escape(timezone.now().isoformat())}</p><ol>\n'
+    )
+    for row in rows:
+        links = ''.join(
+            f'<br><a href="{escape(url)}">{escape(url)}</a>' for url in row['image_urls']
+        )
+        text = escape(row['message']).replace('\n', '<br>')
+        yield (
+            f'<li><span class="meta">{escape(row["timestamp"])} &middot; '
+            f'{escape(row["sender_name"])}</span><br>{text}{links}</li>\n'
+        )
+    yield '</ol></body></html>\n'
+
+
+RENDERERS = {
+    'csv': render_csv,
+    'jsonl': render_jsonl,
+    'html': render_html,
+}
+
+
+def stream_transcript(room, file_format, request=None):
+    """
+    Yield the encoded transcript in chunks of about CHAT_EXPORT_CHUNK_BYTES.
+    """
+    chunk_bytes = getattr(settings, 'CHAT_EXPORT_CHUNK_BYTES', 64 * 1024)
+    buffer = []
+    size = 0
+    for text in RENDERERS[file_format](room, transcript_rows(room, request)):
+        data = text.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def iterate_in_thread(iterator, batch_size=8):
+    """
+    Async iterator over a synchronous one, advancing it a few items at a time in the
+    request's database thread.
+    """
+    next_batch = sync_to_async(lambda: list(islice(iterator, batch_size)), thread_sensitive=True)
+    try:
+        while True:
+            batch = await next_batch()
+            if not batch:
+                return
+            for item in batch:
+                yield item
+    finally:
+        # Release the database cursors if the client disconnected mid-download
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+def transcript_response(room, file_format, request):
+    """
+    Streaming download of the room transcript in `file_format` (one of FORMATS).
+    """
+    content = stream_transcript(room, file_format, request)
+    # DRF wraps the Django request
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        content = iterate_in_thread(content)
+
+    response = StreamingHttpResponse(content, content_type=FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="chat-{room.room_id}.{file_format}"'
+    return response
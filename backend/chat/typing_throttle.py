@@ -0,0 +1,69 @@
+import time
+
+'''
+typing_throttle.py: Server-side debouncing of typing indicators
+TypingThrottle: Decides whether an incoming is_typing frame is broadcast,
+suppressed (no state change) or deferred (state change inside the minimum interval)
+'''
+
+SEND = 'send'
+SUPPRESS = 'suppress'
+DEFER = 'defer'
+
+
+class TypingThrottle:
+    """
+    Tracks the typing state of one connection and throttles broadcasts.
+
+    Only state changes are broadcast, and never more often than `min_interval`
+    seconds. A change that arrives too early is deferred; later frames simply
+    overwrite the wanted state, so rapid toggling collapses into one send.
+    """
+
+    def __init__(self, min_interval=1.0, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.clock = clock
+        # State most recently broadcast to the room
+        self.sent_state = False
+        # State the client most recently asked for
+        self.wanted_state = False
+        self.last_sent_at = None
+
+    def submit(self, is_typing):
+        """
+        Register an incoming frame and return SEND, SUPPRESS or DEFER.
+        """
+        self.wanted_state = bool(is_typing)
+
+        if self.wanted_state == self.sent_state:
+            return SUPPRESS
+
+        if self.retry_in() > 0:
+            return DEFER
+
+        return SEND
+
+    def retry_in(self):
+        """
+        Seconds left until the next broadcast is allowed (0 if allowed now).
+        """
+        if self.last_sent_at is None:
+            return 0
+        elapsed = self.clock() - self.last_sent_at
+        return max(0, self.min_interval - elapsed)
+
+    def pending(self):
+        """
+        Return the state to broadcast after a deferral, or None if nothing changed.
+        """
+        if self.wanted_state != self.sent_state:
+            return self.wanted_state
+        return None
+
+    def mark_sent(self, is_typing):
+        """
+        Record that `is_typing` has been broadcast to the room.
+        """
+        self.sent_state = bool(is_typing)
+        self.wanted_state = self.sent_state
+        self.last_sent_at = self.clock()
@@ -1,42 +1,83 @@
-from django.db.models import Q
+from django.db.models import Q, Case, When, Count, Max
+from django.utils import timezone
 from django.http import Http404
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 import uuid
 import logging
-import requests
-from django.core.files import File
-from django.core.files.temp import NamedTemporaryFile
-from django.conf import settings
-import os
 from .models import ChatRoom, ChatMessage, ChatMessageImage, OrderStatus
-from .serializers import ChatRoomSerializer, ChatMessageSerializer #, ChatMessageImageSerializer
+from .serializers import ChatRoomSerializer, FarmerOrderSerializer, ChatMessageSerializer, ChatMessageSearchSerializer, serialize_history #, ChatMessageImageSerializer
+from .search import search_messages
+from .archive import room_history
+from .product_images import product_image_reference, schedule_copy
+from .rooms import create_room_once, get_idempotency_key, request_fingerprint, get_idempotent_room, remember_idempotent_room
+from . import read_receipts, presence, order_board, transcripts
 from users.models import CustomUser
 from products.models import Product
+from products.cache import catalogue_version
+from AgroConnect.conditional import ConditionalGetMixin
 
 logger = logging.getLogger(__name__)
 
 
+def parse_message_id(value):
+    """
+    Convert an optional message id from request data to an int (None if missing or invalid)
+    """
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class FarmerOrderPagination(PageNumberPagination):
+    """
+    Page size settings for the farmer order board (pages are selected by cursor)
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 '''
 ChatRoomViewSet: Main controller for chat rooms
-create(): Handles room creation (both regular and post-checkout)
-messages(): Retrieves conversation history
-mark_read(): Updates read status
+create(): Handles idempotent room creation (both regular and post-checkout)
+messages(): Retrieves conversation history (including archived messages)
+export(): Streams the conversation as a CSV, JSONL or HTML download
+mark_read(): Updates read status (batched through read_receipts)
 update_order_status(): Farmer-only status updates
+presence(): Online/last-seen state of the other participant in each room
+farmer_orders(): Cursor-paginated farmer order board, sorted in the database
 '''
 
 
 
-class ChatRoomViewSet(viewsets.ModelViewSet):
+class ChatRoomViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing chat rooms.
     
     Provides CRUD operations and custom actions for chat rooms.
+    List and detail responses carry ETags and answer If-None-Match with 304.
     """
     serializer_class = ChatRoomSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # product_detail is nested in each room
+    conditional_fields = ('updated_at', 'product__updated_at')
+    
+    def get_conditional_extra(self, queryset):
+        """
+        Rooms also show their last message and unread count, user and product details
+        (covered by the catalogue version) and a time since the order, in minutes.
+        """
+        messages = ChatMessage.objects.filter(room__in=queryset.values('pk')).aggregate(
+            last=Max('id'),
+            unread=Count('id', filter=Q(is_read=False))
+        )
+        return (messages['last'], messages['unread'], catalogue_version(), timezone.now().strftime('%Y%m%d%H%M'))
     
     def get_queryset(self):
         """
@@ -47,6 +88,9 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             Q(customer=user) | Q(farmer=user)
             # SELECT * FROM chat_room 
             # WHERE customer_id = {user.id} OR farmer_id = {user.id}
+        ).select_related(
+            # product_detail (ProductSerializer) reads the farmer and both rating summaries
+            'product__farmer', 'product__rating_summary', 'product__farmer__rating_summary'
         ).order_by('-updated_at')
     
     def get_object(self):
@@ -104,6 +148,18 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            # A retried request with the same idempotency key gets the original room back
+            idempotency_key = get_idempotency_key(request)
+            fingerprint = request_fingerprint('create_or_get_room', customer_id, farmer_id, product_id)
+            if idempotency_key:
+                try:
+                    record = get_idempotent_room(request.user, idempotency_key, fingerprint)
+                except ValueError as e:
+                    return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+                if record:
+                    serializer = ChatRoomSerializer(record.room, context={'request': request})
+                    return Response(serializer.data)
+            
             # Check if the users exist
             try:
                 customer = CustomUser.objects.get(id=customer_id)
@@ -125,106 +181,52 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_404_NOT_FOUND
                     )
             
-            # Check if a room already exists between these users for this product
-            existing_room = None
-            
+            # Find an existing room between these users in one query,
+            # preferring the room about this product, then the oldest one
+            rooms = ChatRoom.objects.filter(customer=customer, farmer=farmer)
             if product:
-                # First try to find a room with the exact product
-                existing_room = ChatRoom.objects.filter(
-                    customer=customer,
-                    farmer=farmer,
-                    product=product
-                ).first()
-            
-            if not existing_room:
-                # If no room with exact product, find any room between these users
-                existing_room = ChatRoom.objects.filter(
-                    customer=customer,
-                    farmer=farmer
-                ).first()
-            
-            if existing_room:
-                # Return the existing room
-                serializer = ChatRoomSerializer(
-                    existing_room, 
-                    context={'request': request}
+                rooms = rooms.order_by(Case(When(product=product, then=0), default=1), 'id')
+            else:
+                rooms = rooms.order_by('id')
+            room = rooms.first()
+            created = False
+            
+            if room is None:
+                # Create a new room with a unique ID; a concurrent duplicate request gets this room back
+                room, created = create_room_once(
+                    customer,
+                    farmer,
+                    product,
+                    room_id=f"{customer.id}_{farmer.id}_{uuid.uuid4().hex[:8]}",
+                    quantity=quantity
                 )
-                return Response(serializer.data)
             
-            # Create a new room with a unique ID
-            room_id = f"{customer.id}_{farmer.id}_{uuid.uuid4().hex[:8]}"
-            
-            new_room = ChatRoom.objects.create(
-                room_id=room_id,
-                customer=customer,
-                farmer=farmer,
-                product=product,
-                quantity=quantity
-            )
-            
-            # If this is a post-checkout room, create an initial message
-            if is_post_checkout and product:
-                # Check if a message already exists in the room
-                existing_message = ChatMessage.objects.filter(
-                    room=new_room,
-                    sender=customer,
-                    message__contains=product.productName
-                ).first()
+            # If this is a new post-checkout room, create the initial message (only once, by the creator)
+            if created and is_post_checkout and product:
+                # Create welcome message from customer to farmer
+                message_text = f"Hello! I've just purchased {quantity} {quantity > 1 and 'units' or 'unit'} of {product.productName}. I'd like to discuss delivery options and any other details about my order."
                 
-                if existing_message:
-                    logger.info(f"Initial message already exists in room {room_id}, skipping creation")
-                else:
-                    # Create welcome message from customer to farmer
-                    message_text = f"Hello! I've just purchased {quantity} {quantity > 1 and 'units' or 'unit'} of {product.productName}. I'd like to discuss delivery options and any other details about my order."
-                    
-                    message = ChatMessage.objects.create(
-                        room=new_room,
-                        sender=customer,
-                        message=message_text
-                    )
-                    
-                    # If product image URL was provided, try to attach it to the message
-                    if product_image_url:
-                        try:
-                            # The URL might be relative or absolute, handle both cases
-                            if product_image_url.startswith('http'):
-                                # For absolute URLs, we need to download the image
-                                response = requests.get(product_image_url)
-                                if response.status_code == 200:
-                                    # Create a temporary file
-                                    img_temp = NamedTemporaryFile(delete=True)
-                                    img_temp.write(response.content)
-                                    img_temp.flush()
-                                    
-                                    # Save the image to the message
-                                    message.image.save(
-                                        f"product_{product.id}.jpg",
-                                        File(img_temp)
-                                    )
-                            else:
-                                # For relative URLs, we can use the product's image directly
-                                # Strip leading slash if present
-                                if product_image_url.startswith('/'):
-                                    product_image_url = product_image_url[1:]
-                                
-                                # Get the path relative to MEDIA_ROOT
-                                image_path = os.path.join(settings.MEDIA_ROOT, product_image_url)
-                                
-                                if os.path.exists(image_path):
-                                    with open(image_path, 'rb') as f:
-                                        message.image.save(
-                                            f"product_{product.id}.jpg",
-                                            File(f)
-                                        )
-                        except Exception as e:
-                            print(f"Error attaching product image: {str(e)}")
+                # Reference the product image by URL instead of downloading it during checkout;
+                # a client value that isn't a usable image falls back to the product's own image
+                image_url = product_image_reference(product_image_url) or product_image_reference(product.imageUrl)
+                message = ChatMessage.objects.create(
+                    room=room,
+                    sender=customer,
+                    message=message_text,
+                    image_url=image_url
+                )
+                # Optional local copy, fetched in the background (see product_images.py)
+                schedule_copy(message.id, image_url)
                 
                 # Set unread flag for farmer
-                new_room.has_unread_farmer = True
-                new_room.save()
+                room.has_unread_farmer = True
+                room.save(update_fields=['has_unread_farmer', 'updated_at'])
+            
+            if idempotency_key:
+                remember_idempotent_room(request.user, idempotency_key, fingerprint, room, created)
             
             serializer = ChatRoomSerializer(
-                new_room, 
+                room, 
                 context={'request': request}
             )
             return Response(serializer.data)
@@ -240,7 +242,9 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         Create a new chat room between a customer and a farmer about a product.
         
         If a room already exists for the same customer, farmer and product,
-        return the existing room instead of creating a new one.
+        return the existing room instead of creating a new one. Concurrent duplicate
+        requests are resolved by a unique constraint, and clients may send an
+        Idempotency-Key header so that retries return the original response.
         """
         try:
             data = request.data
@@ -281,6 +285,21 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
+            # A retried request with the same idempotency key gets the original room and status back
+            idempotency_key = get_idempotency_key(request)
+            fingerprint = request_fingerprint('create', customer_id, farmer_id, product_id, is_post_checkout)
+            if idempotency_key:
+                try:
+                    record = get_idempotent_room(user, idempotency_key, fingerprint)
+                except ValueError as e:
+                    return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+                if record:
+                    serializer = self.get_serializer(record.room)
+                    return Response(
+                        serializer.data,
+                        status=status.HTTP_201_CREATED if record.created_room else status.HTTP_200_OK
+                    )
+            
             # Get the customer, farmer and product
             try:
                 customer = CustomUser.objects.get(id=customer_id)
@@ -294,31 +313,35 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 )
             
             # Check if a room already exists
-            existing_room = ChatRoom.objects.filter(
+            room = ChatRoom.objects.filter(
                 customer=customer,
                 farmer=farmer,
                 product=product
-            ).first()
+            ).order_by('id').first()
+            created = False
+            
+            if room is None:
+                # Create a new room with a unique ID; a concurrent duplicate request gets this room back
+                room, created = create_room_once(
+                    customer,
+                    farmer,
+                    product,
+                    room_id=str(uuid.uuid4()),
+                    quantity=quantity
+                )
             
-            if existing_room:
+            if not created:
                 # Update quantity if it has changed
-                if existing_room.quantity != quantity:
-                    existing_room.quantity = quantity
-                    existing_room.save()
+                if room.quantity != quantity:
+                    room.quantity = quantity
+                    room.save(update_fields=['quantity', 'updated_at'])
+                
+                if idempotency_key:
+                    remember_idempotent_room(user, idempotency_key, fingerprint, room, False)
                     
-                serializer = self.get_serializer(existing_room)
+                serializer = self.get_serializer(room)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             
-            # Create a new room with a unique ID
-            room_id = str(uuid.uuid4())
-            room = ChatRoom.objects.create(
-                room_id=room_id,
-                customer=customer,
-                farmer=farmer,
-                product=product,
-                quantity=quantity
-            )
-            
             # Check if this is a post-checkout chat creation
             if is_post_checkout:
                 try:
@@ -336,7 +359,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     room.has_unread_farmer = True
                     room.save()
                     
-                    logger.info(f"Created post-checkout chat room {room_id} with initial message")
+                    logger.info(f"Created post-checkout chat room {room.room_id} with initial message")
                 except Exception as msg_error:
                     logger.error(f"Error creating initial message for post-checkout chat: {str(msg_error)}")
                     # Continue even if message creation fails
@@ -365,6 +388,9 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     logger.error(f"Error creating initial message for chat: {str(msg_error)}")
                     # Continue even if message creation fails
             
+            if idempotency_key:
+                remember_idempotent_room(user, idempotency_key, fingerprint, room, True)
+            
             serializer = self.get_serializer(room)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
             
@@ -388,8 +414,8 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             if user != room.customer and user != room.farmer:
                 return Response({"error": "You are not a participant in this chat"}, status=status.HTTP_403_FORBIDDEN)
             
-            # Get all messages for this room
-            messages = ChatMessage.objects.filter(room=room).order_by('timestamp')
+            # Get all messages for this room, including archived ones
+            messages = room_history(room)
             
             # Update unread flags based on who is viewing the messages
             if user == room.customer and room.has_unread_customer:
@@ -400,17 +426,46 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 room.save(update_fields=['has_unread_farmer'])
             
             # Serialize messages with request context for proper URL handling
-            serializer = ChatMessageSerializer(messages, many=True, context={'request': request})
-            
-            return Response(serializer.data)
+            return Response(serialize_history(messages, context={'request': request}))
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Download the room transcript, including archived messages and image links.
+        
+        ?file_format=csv (default), jsonl or html. The file is streamed, so threads of
+        any length are exported without loading them into memory.
+        """
+        try:
+            room = self.get_object()
+            user = request.user
+            
+            # Check if user is a participant in the chat
+            if user != room.customer and user != room.farmer:
+                return Response({"error": "You are not a participant in this chat"}, status=status.HTTP_403_FORBIDDEN)
+            
+            file_format = request.query_params.get('file_format', 'csv').lower()
+            if file_format not in transcripts.FORMATS:
+                return Response(
+                    {"error": f"Unsupported format. Must be one of: {', '.join(transcripts.FORMATS)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            logger.info(f"User {user.id} exporting room {room.room_id} as {file_format}")
+            return transcripts.transcript_response(room, file_format, request)
+        except Http404:
+            raise
+        except Exception as e:
+            logger.error(f"Error exporting chat transcript: {str(e)}")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """
-        Mark all messages in a chat room as reaLoook when i click on proceed to checkout button two times message goes this must go one timed for the current user.
+        Mark all messages in a chat room as read for the current user.
         """
         try:
             # Get the chat room using our overridden get_object method
@@ -418,34 +473,29 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             
             # Check if the user is a participant
             user = request.user
-            if user != room.customer and user != room.farmer:
+            if user.id != room.customer_id and user.id != room.farmer_id:
                 return Response(
                     {"error": "You are not a participant in this chat"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Get the other user in the chat
-            other_user = room.farmer if user == room.customer else room.customer
-            
-            # Mark messages from the other user as read
-            updated = ChatMessage.objects.filter(
-                room=room,
-                sender=other_user,
-                is_read=False
-            ).update(is_read=True)
-            
-            # Update the unread flags in the chat room
-            if user == room.customer:
-                room.has_unread_customer = False
-            else:
-                room.has_unread_farmer = False
-            room.save()
+            # Move the read watermark forward; the database write is batched
+            watermark = read_receipts.mark_read(
+                room.pk,
+                user.id,
+                parse_message_id(request.data.get('up_to_message_id'))
+            )
+            if watermark is not None:
+                read_receipts.broadcast_read_receipt(room.room_id, user.id, watermark)
+            # Write the caller's own receipt now rather than on the next timed flush
+            updated = read_receipts.flush([(room.pk, user.id)])
             
             return Response(
                 {
                     "status": "success", 
                     "message": "All messages marked as read",
                     "messages_updated": updated,
+                    "read_up_to": watermark or read_receipts.get_watermark(room.pk, user.id),
                 },
                 status=status.HTTP_200_OK
             )
@@ -510,35 +560,80 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['get'])
+    def presence(self, request):
+        """
+        Presence of the other participant in each of the user's chat rooms.
+        
+        Lets room lists show who is online without opening a WebSocket per room.
+        """
+        try:
+            user = request.user
+            rooms = list(self.get_queryset().values_list('room_id', 'customer_id', 'farmer_id'))
+            peers = {
+                room_id: farmer_id if customer_id == user.id else customer_id
+                for room_id, customer_id, farmer_id in rooms
+            }
+            states = presence.get_presence(peers.values())
+            
+            return Response([
+                {
+                    'room_id': room_id,
+                    'user_id': peer_id,
+                    'online': states[peer_id]['online'],
+                    'last_seen': states[peer_id]['last_seen']
+                }
+                for room_id, peer_id in peers.items()
+            ])
+            
+        except Exception as e:
+            logger.error(f"Error fetching chat presence: {str(e)}")
+            return Response(
+                {'error': f'Failed to fetch presence: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
     @action(detail=False, methods=['get'])
     def farmer_orders(self, request):
         """
-        Get all orders (chat rooms) for the farmer, sorted by status and recency.
+        Get the farmer's orders (chat rooms), sorted by status priority and recency.
         
-        This endpoint is specifically for the farmer dashboard.
+        This endpoint is specifically for the farmer dashboard. Sorting happens in the
+        database (see order_board.py) and results are cursor-paginated:
+        ?status=new,pending filters by order status, ?is_new_order=true|false by the
+        new-order flag, ?page_size sets the page length and ?cursor continues from the
+        "next" link. Later changes arrive over the ws/farmer/orders/ WebSocket.
         """
         try:
             user = request.user
             
-            # Get all chat rooms where the user is the farmer
-            chat_rooms = ChatRoom.objects.filter(farmer=user).order_by('-updated_at')
+            try:
+                statuses = order_board.parse_statuses(request.query_params.getlist('status'))
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Sort by status priority: NEW, ACTIVE, COMPLETED
-            # This is done in Python rather than the database for more flexibility
-            status_priority = {
-                OrderStatus.NEW: 0,
-                OrderStatus.ACTIVE: 1,
-                OrderStatus.COMPLETED: 2
-            }
+            is_new_order = request.query_params.get('is_new_order')
+            if is_new_order is not None:
+                is_new_order = is_new_order.lower() in ('1', 'true', 'yes')
             
-            sorted_rooms = sorted(chat_rooms, key=lambda room: (
-                status_priority.get(room.order_status, 999),  # Sort by status priority
-                not room.is_new_order,  # Then by is_new_order (True first)
-                -room.updated_at.timestamp()  # Then by updated_at (newest first)
-            ))
+            paginator = FarmerOrderPagination()
+            page_size = paginator.get_page_size(request)
             
-            serializer = self.get_serializer(sorted_rooms, many=True)
-            return Response(serializer.data)
+            queryset = order_board.board_queryset(user.id, statuses, is_new_order)
+            try:
+                rooms, next_cursor = order_board.paginate(queryset, request.query_params.get('cursor'), page_size)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            serializer = FarmerOrderSerializer(rooms, many=True, context=self.get_serializer_context())
+            next_link = None
+            if next_cursor:
+                next_link = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+            
+            return Response({
+                'next': next_link,
+                'results': serializer.data
+            })
             
         except Exception as e:
             logger.error(f"Error fetching farmer orders: {str(e)}")
@@ -551,8 +646,19 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
 '''
 ChatMessageViewSet: Manages message CRUD operations
 Handles text messages and image attachments
+search(): Full-text search over the user's own conversations
 '''
 
+
+class ChatSearchPagination(PageNumberPagination):
+    """
+    Page size settings for message search results
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 class ChatMessageViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing chat messages.
@@ -601,11 +707,17 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             if user != room.customer and user != room.farmer:
                 return Response({"error": "You are not a participant in this chat"}, status=status.HTTP_403_FORBIDDEN)
             
+            # Product image URLs are referenced, not downloaded (see product_images.py)
+            image_url = ''
+            if isinstance(product_image, str):
+                image_url = product_image_reference(product_image)
+            
             # Create message object
             message = ChatMessage.objects.create(
                 room=room,
                 sender=user,
-                message=message_text
+                message=message_text,
+                image_url=image_url
             )
             
             # Handle single image upload
@@ -615,30 +727,14 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 message.save()
             
             # Handle product image if provided
-            if product_image:
-                # If product_image is a URL, download and save it
-                if isinstance(product_image, str) and (product_image.startswith('http://') or product_image.startswith('https://')):
-                    try:
-                        import requests
-                        from django.core.files.base import ContentFile
-                        import uuid
-                        
-                        # Download the image
-                        response = requests.get(product_image)
-                        if response.status_code == 200:
-                            # Generate a unique filename
-                            file_extension = product_image.split('.')[-1] if '.' in product_image else 'jpg'
-                            filename = f"product_image_{uuid.uuid4()}.{file_extension}"
-                            
-                            # Save the image to the message
-                            message.image.save(filename, ContentFile(response.content), save=True)
-                    except Exception as e:
-                        print(f"Error downloading product image: {e}")
-                
-                # If product_image is a file, save it directly
-                elif hasattr(product_image, 'read'):
-                    message.image = product_image
-                    message.save()
+            if image_url:
+                # Optional local copy, fetched in the background
+                schedule_copy(message.id, image_url)
+            
+            # If product_image is a file, save it directly
+            elif product_image and hasattr(product_image, 'read'):
+                message.image = product_image
+                message.save()
             
             # Handle multiple images
             images = request.FILES.getlist('images')
@@ -712,30 +808,30 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             
             # Check if user is a participant
             user = request.user
-            if user.id != room.customer.id and user.id != room.farmer.id:
+            if user.id != room.customer_id and user.id != room.farmer_id:
                 logger.error(f"User {user.id} is not a participant in this chat room")
                 return Response(
                     {"error": "You are not a participant in this chat room"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Mark messages from the other user as read
-            other_user = room.farmer if user.id == room.customer.id else room.customer
-            unread_count = ChatMessage.objects.filter(
-                room=room,
-                sender=other_user,
-                is_read=False
-            ).update(is_read=True)
-            
-            # Update room's unread status
-            if user.id == room.customer.id:
-                room.has_unread_customer = False
-            else:
-                room.has_unread_farmer = False
-            room.save()
+            # Move the read watermark forward; the database write is batched
+            watermark = read_receipts.mark_read(
+                room.pk,
+                user.id,
+                parse_message_id(request.data.get('up_to_message_id'))
+            )
+            if watermark is not None:
+                read_receipts.broadcast_read_receipt(room.room_id, user.id, watermark)
+            # Write the caller's own receipt now rather than on the next timed flush
+            updated = read_receipts.flush([(room.pk, user.id)])
             
             return Response(
-                {"success": True, "messages_read": unread_count},
+                {
+                    "success": True,
+                    "messages_read": updated,
+                    "read_up_to": watermark or read_receipts.get_watermark(room.pk, user.id),
+                },
                 status=status.HTTP_200_OK
             )
             
@@ -745,3 +841,32 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Search messages in the current user's chat rooms.
+        
+        Query parameters: q (search text), room_id (optional, limit to one room), page, page_size.
+        Results are ranked by relevance and include a highlighted snippet.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"error": "Search query 'q' is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Only rooms where the user is a participant
+        messages = self.get_queryset().select_related('room', 'sender')
+        
+        room_id = request.query_params.get('room_id')
+        if room_id:
+            messages = messages.filter(room__room_id=room_id)
+        
+        results = search_messages(messages, query)
+        
+        paginator = ChatSearchPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        serializer = ChatMessageSearchSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
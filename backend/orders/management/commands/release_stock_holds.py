@@ -0,0 +1,70 @@
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from orders.stock import confirm_reservation, expired_reservations, release_reservation
+
+
+'''
+release_stock_holds: Gives back stock held for orders whose payment did not go through in time
+Holds past their expiry are checked against their payment intent first: if the payment
+was authorized but the webhook was missed, the hold is confirmed instead; otherwise the
+payment intent is cancelled (so it can no longer be paid) and the stock is released.
+Run it every few minutes, e.g. from cron.
+
+Example:
+    python manage.py release_stock_holds --dry-run
+'''
+
+# Payment intents in these states have been authorized (manual capture) or paid
+AUTHORIZED = ('requires_capture', 'succeeded')
+# Payment intents in these states can still be cancelled
+CANCELLABLE = ('requires_payment_method', 'requires_confirmation', 'requires_action')
+
+
+class Command(BaseCommand):
+    help = 'Release expired stock holds of unpaid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be released')
+
+    def handle(self, *args, **options):
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        dry_run = options['dry_run']
+        released = confirmed = skipped = 0
+
+        for reservation in expired_reservations().iterator(chunk_size=500):
+            try:
+                payment_status = self.payment_status(reservation.order)
+            except stripe.error.StripeError as e:
+                # Try again on the next run rather than release stock that may be paid for
+                self.stderr.write(f'Reservation {reservation.id}: could not check payment: {str(e)}')
+                skipped += 1
+                continue
+
+            if payment_status in AUTHORIZED:
+                if not dry_run:
+                    confirm_reservation(reservation)
+                confirmed += 1
+            elif payment_status == 'processing':
+                skipped += 1
+            else:
+                if not dry_run:
+                    if payment_status in CANCELLABLE:
+                        try:
+                            stripe.PaymentIntent.cancel(reservation.order.payment_intent_id)
+                        except stripe.error.StripeError as e:
+                            self.stderr.write(f'Reservation {reservation.id}: could not cancel payment: {str(e)}')
+                            skipped += 1
+                            continue
+                    release_reservation(reservation)
+                released += 1
+
+        verb = 'Would release' if dry_run else 'Released'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {released} expired holds; {confirmed} were paid for, {skipped} skipped'
+        ))
+
+    def payment_status(self, order):
+        if order is None or not order.payment_intent_id:
+            return None
+        return stripe.PaymentIntent.retrieve(order.payment_intent_id).status
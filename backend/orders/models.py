@@ -120,3 +120,35 @@ class OrderItem(models.Model):
     
     def __str__(self):
         return f"{self.quantity} of {self.product.productName} in Order {self.order.id}"
+
+
+class StockReservation(models.Model):
+    """
+    Stock taken from a product for an order (see orders/stock.py).
+    
+    The quantity is subtracted from Product.stockQuantity when the hold is created.
+    A HELD reservation lasts until expires_at while the payment is pending; it is then
+    either CONFIRMED (payment authorized, the stock stays sold) or RELEASED (payment
+    failed, cancelled or timed out, the stock is given back).
+    """
+    class Status(models.TextChoices):
+        HELD = 'held', 'Held'
+        CONFIRMED = 'confirmed', 'Confirmed'
+        RELEASED = 'released', 'Released'
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.quantity} of product {self.product_id} for order {self.order_id} ({self.status})"
+    
+    class Meta:
+        indexes = [
+            # Expired holds (release_stock_holds)
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ]
@@ -0,0 +1,146 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from products.models import Product
+from products.cache import invalidate_catalogue
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+'''
+stock.py: Stock reservations for orders (StockReservation)
+reserve_stock(): Takes stock from a product and holds it for STOCK_HOLD_MINUTES
+confirm_reservations(): Keeps an order's stock once its payment is authorized
+release_reservations(): Gives an order's stock back (payment failed or cancelled)
+release_reservation(): Gives one hold's stock back, e.g. when it has expired
+
+Stock is taken with a single conditional UPDATE ... SET stockQuantity = stockQuantity - n
+WHERE stockQuantity >= n, so concurrent buyers never oversell and never wait on a lock
+held across a read and a write: whoever's UPDATE runs first gets the stock, and an
+UPDATE matching no row means there is not enough left.
+
+Status changes are conditional UPDATEs on the current status too, so webhook retries
+and the expiry command (release_stock_holds) can run concurrently without giving stock
+back twice, and expiry never releases a hold that was confirmed meanwhile. A RELEASED
+reservation whose payment is authorized afterwards takes its stock again, if there
+still is enough.
+
+These updates bypass model signals and auto_now, so they set Product.updated_at and
+invalidate the catalogue cache themselves.
+'''
+
+
+class InsufficientStock(ValueError):
+    """
+    Raised by reserve_stock() when the product does not have enough stock left.
+    """
+
+
+def take_stock(product_id, quantity):
+    """
+    Subtract `quantity` from the product's stock if that much is left. Returns whether it was.
+    """
+    taken = Product.objects.filter(id=product_id, stockQuantity__gte=quantity).update(
+        stockQuantity=F('stockQuantity') - quantity,
+        updated_at=timezone.now(),
+    )
+    if taken:
+        invalidate_catalogue()
+    return bool(taken)
+
+
+def return_stock(product_id, quantity):
+    Product.objects.filter(id=product_id).update(
+        stockQuantity=F('stockQuantity') + quantity,
+        updated_at=timezone.now(),
+    )
+    invalidate_catalogue()
+
+
+def reserve_stock(product, quantity, order=None):
+    """
+    Take `quantity` of the product's stock and hold it for STOCK_HOLD_MINUTES.
+
+    Raises InsufficientStock if there is not enough left; nothing is changed then.
+    """
+    hold_minutes = getattr(settings, 'STOCK_HOLD_MINUTES', 30)
+    with transaction.atomic():
+        if not take_stock(product.id, quantity):
+            raise InsufficientStock(f"Not enough {product.productName} left in stock")
+        reservation = StockReservation.objects.create(
+            product=product,
+            order=order,
+            quantity=quantity,
+            expires_at=timezone.now() + timedelta(minutes=hold_minutes),
+        )
+    logger.info(f"Reserved {quantity} of product {product.id} (reservation {reservation.id})")
+    return reservation
+
+
+def release_reservation(reservation, statuses=(StockReservation.Status.HELD,)):
+    """
+    Give a reservation's stock back if its status is one of `statuses` (by default only
+    while it is held). Returns False if it was not.
+    """
+    with transaction.atomic():
+        released = StockReservation.objects.filter(
+            id=reservation.id, status__in=statuses
+        ).update(status=StockReservation.Status.RELEASED, updated_at=timezone.now())
+        if not released:
+            return False
+        return_stock(reservation.product_id, reservation.quantity)
+    logger.info(f"Released {reservation.quantity} of product {reservation.product_id} (reservation {reservation.id})")
+    return True
+
+
+def confirm_reservation(reservation):
+    """
+    Make a reservation permanent. A released reservation takes its stock again first.
+
+    Returns False if it was released and there is no longer enough stock.
+    """
+    Status = StockReservation.Status
+    now = timezone.now()
+    with transaction.atomic():
+        if StockReservation.objects.filter(id=reservation.id, status=Status.HELD).update(status=Status.CONFIRMED, updated_at=now):
+            return True
+        if not StockReservation.objects.filter(id=reservation.id, status=Status.RELEASED).update(status=Status.CONFIRMED, updated_at=now):
+            # Already confirmed
+            return True
+        if not take_stock(reservation.product_id, reservation.quantity):
+            # Undo the status change; the stock is gone
+            transaction.set_rollback(True)
+            logger.warning(f"Reservation {reservation.id} was released and product {reservation.product_id} has sold out since")
+            return False
+    logger.info(f"Re-reserved {reservation.quantity} of product {reservation.product_id} (reservation {reservation.id})")
+    return True
+
+
+def confirm_reservations(order):
+    """
+    Confirm all of an order's reservations. Returns False if any could not be confirmed.
+    """
+    reservations = order.reservations.exclude(status=StockReservation.Status.CONFIRMED)
+    return all([confirm_reservation(reservation) for reservation in reservations])
+
+
+def release_reservations(order):
+    """
+    Give back all the stock an order holds, confirmed or not. Returns how many
+    reservations were released.
+    """
+    statuses = (StockReservation.Status.HELD, StockReservation.Status.CONFIRMED)
+    return sum(
+        release_reservation(reservation, statuses)
+        for reservation in order.reservations.exclude(status=StockReservation.Status.RELEASED)
+    )
+
+
+def expired_reservations(now=None):
+    return StockReservation.objects.filter(
+        status=StockReservation.Status.HELD,
+        expires_at__lt=now or timezone.now(),
+    ).select_related('order')
@@ -6,6 +6,7 @@ from django.http import HttpResponse #, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from .models import Order, OrderStatus
+from .stock import confirm_reservations, release_reservations
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -61,8 +62,12 @@ def stripe_webhook(request):
     # Handle specific event types
     if event['type'] == 'payment_intent.succeeded':
         handle_payment_intent_succeeded(event['data']['object'])
+    elif event['type'] == 'payment_intent.amount_capturable_updated':
+        handle_payment_intent_authorized(event['data']['object'])
     elif event['type'] == 'payment_intent.payment_failed':
         handle_payment_intent_failed(event['data']['object'])
+    elif event['type'] == 'payment_intent.canceled':
+        handle_payment_intent_canceled(event['data']['object'])
     elif event['type'] == 'charge.refunded':
         handle_charge_refunded(event['data']['object'])
     
@@ -80,6 +85,9 @@ def handle_payment_intent_succeeded(payment_intent):
             logger.error(f"Order not found for payment intent: {payment_intent['id']}")
             return
         
+        # Paid for: the held stock is sold
+        confirm_reservations(order)
+        
         # If the payment was automatically captured (not our default flow, but possible)
         if payment_intent.get('status') == 'succeeded' and payment_intent.get('capture_method') != 'manual':
             order.status = OrderStatus.COMPLETED
@@ -94,6 +102,28 @@ def handle_payment_intent_succeeded(payment_intent):
     except Exception as e:
         logger.error(f"Error handling payment_intent.succeeded: {str(e)}")
 
+def handle_payment_intent_authorized(payment_intent):
+    """
+    Handle authorized (manual capture) payment intents: the held stock is now sold.
+    
+    If the hold had already expired and the product sold out meanwhile, the
+    authorization is cancelled instead.
+    """
+    try:
+        logger.info(f"Payment intent authorized: {payment_intent['id']}")
+        
+        order = Order.objects.filter(payment_intent_id=payment_intent['id']).first()
+        if not order:
+            logger.error(f"Order not found for payment intent: {payment_intent['id']}")
+            return
+        
+        if not confirm_reservations(order):
+            logger.warning(f"Order {order.id} is out of stock; cancelling its payment authorization")
+            stripe.PaymentIntent.cancel(payment_intent['id'])
+    
+    except Exception as e:
+        logger.error(f"Error handling payment_intent.amount_capturable_updated: {str(e)}")
+
 def handle_payment_intent_failed(payment_intent):
     """Handle failed payment intent events."""
     try:
@@ -105,6 +135,9 @@ def handle_payment_intent_failed(payment_intent):
             logger.error(f"Order not found for payment intent: {payment_intent['id']}")
             return
         
+        # Give the held stock back to other buyers; a later successful attempt takes it again
+        release_reservations(order)
+        
         # Update order status to indicate failure
         order.status = OrderStatus.NEW  # Reset to NEW so customer can try again
         order.save()
@@ -113,6 +146,29 @@ def handle_payment_intent_failed(payment_intent):
     except Exception as e:
         logger.error(f"Error handling payment_intent.payment_failed: {str(e)}")
 
+def handle_payment_intent_canceled(payment_intent):
+    """Handle cancelled payment intents (cancelled holds, expired authorizations)."""
+    try:
+        logger.info(f"Payment intent canceled: {payment_intent['id']}")
+        
+        order = Order.objects.filter(payment_intent_id=payment_intent['id']).first()
+        if not order:
+            logger.error(f"Order not found for payment intent: {payment_intent['id']}")
+            return
+        
+        # Goods that have left the farm do not go back into stock
+        if order.status in (OrderStatus.SHIPPED, OrderStatus.DELIVERED, OrderStatus.COMPLETED):
+            logger.warning(f"Payment for order {order.id} was cancelled after shipping")
+            return
+        
+        release_reservations(order)
+        order.status = OrderStatus.NEW
+        order.save()
+        logger.info(f"Order {order.id} marked as new after its payment was cancelled")
+    
+    except Exception as e:
+        logger.error(f"Error handling payment_intent.canceled: {str(e)}")
+
 def handle_charge_refunded(charge):
     """Handle refunded charge events."""
     try:
@@ -0,0 +1,126 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+from products.models import Product
+from users.models import CustomUser
+from .models import StockReservation
+from .stock import InsufficientStock, reserve_stock
+
+'''
+tests.py: Stock reservation tests
+ReserveStockConcurrencyTests: Parallel buyers against limited stock never oversell it
+
+The buyers run on real threads, each with its own database connection, so these are
+TransactionTestCases (a TestCase's transaction would hide the other threads' writes),
+run against PostgreSQL like the application.
+'''
+
+STOCK = 25
+BUYERS = 40
+
+
+def create_user(number, user_type):
+    return CustomUser.objects.create_user(
+        f'+92300{number:07d}', f'{user_type.lower()}{number}@example.com', f'User {number}',
+        user_type, 'Punjab', 'Lahore', password='password'
+    )
+
+
+# Forty customers are created per test; the default hasher would dominate the run time
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReserveStockConcurrencyTests(TransactionTestCase):
+    """
+    Many buyers reserving the same product at once get exactly the stock there is.
+    """
+    def setUp(self):
+        if connection.vendor == 'sqlite':
+            self.skipTest("SQLite's shared in-memory test database rejects concurrent writers")
+        self.farmer = create_user(0, 'FARMER')
+        self.product = Product.objects.create(
+            farmer=self.farmer, productName='Mango', category='Fruits', description='Sindhri',
+            price=10, stockQuantity=STOCK,
+        )
+
+    def run_buyers(self, buy, count=BUYERS):
+        """
+        Run `buy(i)` for `count` buyers on as many threads, all starting together.
+        """
+        barrier = threading.Barrier(count)
+
+        def run(i):
+            try:
+                barrier.wait()
+                return buy(i)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            return list(executor.map(run, range(count)))
+
+    def assertStockSold(self, sold, quantity=1):
+        self.product.refresh_from_db()
+        self.assertGreaterEqual(self.product.stockQuantity, 0)
+        self.assertEqual(self.product.stockQuantity, STOCK - sold * quantity)
+        held = StockReservation.objects.filter(product=self.product, status=StockReservation.Status.HELD)
+        self.assertEqual(held.count(), sold)
+        self.assertEqual(sum(held.values_list('quantity', flat=True)), sold * quantity)
+
+    def test_parallel_reservations_sell_exactly_the_stock(self):
+        def buy(i):
+            try:
+                reserve_stock(self.product, 1)
+                return True
+            except InsufficientStock:
+                return False
+
+        results = self.run_buyers(buy)
+
+        self.assertEqual(results.count(True), STOCK)
+        self.assertEqual(results.count(False), BUYERS - STOCK)
+        self.assertStockSold(STOCK)
+
+    def test_parallel_reservations_of_several_units_leave_the_remainder(self):
+        def buy(i):
+            try:
+                reserve_stock(self.product, 3)
+                return True
+            except InsufficientStock:
+                return False
+
+        results = self.run_buyers(buy)
+
+        # 8 buyers get 3 each; the last unit is not enough for anyone
+        self.assertEqual(results.count(True), STOCK // 3)
+        self.assertStockSold(STOCK // 3, quantity=3)
+
+    def test_parallel_payment_intents_answer_409_when_sold_out(self):
+        customers = [create_user(i + 1, 'CUSTOMER') for i in range(BUYERS)]
+        ids = itertools.count()
+
+        def payment_intent(**kwargs):
+            return SimpleNamespace(id=f'pi_test_{next(ids)}', client_secret='secret')
+
+        def buy(i):
+            client = APIClient()
+            client.force_authenticate(customers[i])
+            return client.post('/api/orders/orders/create-payment-intent/', {
+                'product_id': self.product.id,
+                'farmer_id': self.farmer.id,
+                'quantity': 1,
+            }, format='json').status_code
+
+        with mock.patch('orders.views.stripe.Customer.create', return_value=SimpleNamespace(id='cus_test')), \
+                mock.patch('orders.views.stripe.PaymentIntent.create', side_effect=payment_intent):
+            codes = self.run_buyers(buy)
+
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), STOCK)
+        self.assertEqual(codes.count(status.HTTP_409_CONFLICT), BUYERS - STOCK)
+        self.assertStockSold(STOCK)
+        # Every hold belongs to the order that was placed for it
+        self.assertFalse(StockReservation.objects.filter(order__isnull=True).exists())
@@ -9,7 +9,8 @@ from rest_framework import status, permissions, viewsets
 from rest_framework.decorators import action
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from chat.models import ChatRoom, ChatMessage
-from .models import Order, OrderItem, OrderStatus
+from .models import Order, OrderItem, OrderStatus, StockReservation
+from .stock import InsufficientStock, reserve_stock, release_reservation
 from .serializers import RecentOrderSerializer, OrderSerializer #, OrderItemSerializer, FarmerDashboardSerializer, 
 from users.permissions import IsFarmer
 from users.models import CustomUser
@@ -79,6 +80,9 @@ class OrderViewSet(viewsets.ModelViewSet):
         This endpoint creates a payment intent with manual capture,
         saves the order with PENDING status, and creates a chat room
         for communication between customer and farmer.
+        
+        The ordered quantity is taken from the product's stock first and held for
+        STOCK_HOLD_MINUTES (see orders/stock.py); 409 if there is not enough left.
         """
         try:
             # Log incoming request for debugging
@@ -88,7 +92,6 @@ class OrderViewSet(viewsets.ModelViewSet):
             # Extract order data
             data = request.data
             product_id = data.get('product_id')
-            quantity = int(data.get('quantity', 1))
             farmer_id = data.get('farmer_id')
             
             # Validate required fields
@@ -98,6 +101,16 @@ class OrderViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            try:
+                quantity = int(data.get('quantity', 1))
+            except (TypeError, ValueError):
+                quantity = 0
+            if quantity < 1:
+                return Response(
+                    {'error': 'Quantity must be a positive whole number'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
             # Get product and calculate total
             try:
                 product = Product.objects.get(id=product_id)
@@ -108,55 +121,73 @@ class OrderViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Calculate total in cents for Stripe
-            total_amount = int(float(product.price) * quantity * 100)
+            # Take the stock now and hold it while the customer pays, so concurrent
+            # buyers cannot oversell it; released if the payment fails or times out
+            try:
+                reservation = reserve_stock(product, quantity)
+            except InsufficientStock as e:
+                return Response(
+                    {'error': str(e)}, 
+                    status=status.HTTP_409_CONFLICT
+                )
             
-            # Create Stripe customer if needed
-            stripe_customer = stripe.Customer.create(
-                email=request.user.email,
-                metadata={'user_id': request.user.id}
-            )
+            try:
+                # Calculate total in cents for Stripe
+                total_amount = int(float(product.price) * quantity * 100)
             
-            # Create payment intent with manual capture
-            payment_intent = stripe.PaymentIntent.create(
-                amount=total_amount,
-                currency='usd',
-                customer=stripe_customer.id,
-                metadata={
-                    'product_id': product_id,
-                    'farmer_id': farmer_id,
-                    'quantity': quantity
-                },
-                capture_method='manual',  # Important: funds are only authorized, not captured yet
-                description=f'Order for {quantity} of {product.productName} from AgroConnect'
-            )
+                # Create Stripe customer if needed
+                stripe_customer = stripe.Customer.create(
+                    email=request.user.email,
+                    metadata={'user_id': request.user.id}
+                )
             
-            # Create order record
-            order = Order.objects.create(
-                user=request.user,
-                total=total_amount / 100,  # Convert back to dollars for database
-                status=OrderStatus.PENDING,
-                payment_intent_id=payment_intent.id
-            )
+                # Create payment intent with manual capture
+                payment_intent = stripe.PaymentIntent.create(
+                    amount=total_amount,
+                    currency='usd',
+                    customer=stripe_customer.id,
+                    metadata={
+                        'product_id': product_id,
+                        'farmer_id': farmer_id,
+                        'quantity': quantity
+                    },
+                    capture_method='manual',  # Important: funds are only authorized, not captured yet
+                    description=f'Order for {quantity} of {product.productName} from AgroConnect'
+                )
             
-            # Create order item
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price_at_order_time=product.price
-            )
+                # Create order record
+                order = Order.objects.create(
+                    user=request.user,
+                    total=total_amount / 100,  # Convert back to dollars for database
+                    status=OrderStatus.PENDING,
+                    payment_intent_id=payment_intent.id
+                )
             
-            # Create chat room for order communication
-            chat_room = ChatRoom.objects.create(
-                room_id=f"order_{order.id}_{request.user.id}_{farmer.id}",
-                customer=request.user,
-                farmer=farmer,
-                product=product,
-                quantity=quantity,
-                order=order,
-                order_status=OrderStatus.PENDING
-            )
+                # The held stock now belongs to this order
+                StockReservation.objects.filter(id=reservation.id).update(order=order)
+                
+                # Create order item
+                OrderItem.objects.create(
+                    order=order,
+                    product=product,
+                    quantity=quantity,
+                    price_at_order_time=product.price
+                )
+            
+                # Create chat room for order communication
+                chat_room = ChatRoom.objects.create(
+                    room_id=f"order_{order.id}_{request.user.id}_{farmer.id}",
+                    customer=request.user,
+                    farmer=farmer,
+                    product=product,
+                    quantity=quantity,
+                    order=order,
+                    order_status=OrderStatus.PENDING
+                )
+            except Exception:
+                # No order was placed, so give the stock back
+                release_reservation(reservation)
+                raise
             
             # Send notification message using ChatMessage model
             try:
@@ -174,7 +205,8 @@ class OrderViewSet(viewsets.ModelViewSet):
             # Return client secret for frontend to complete payment
             return Response({
                 'client_secret': payment_intent.client_secret,
-                'order_id': order.id
+                'order_id': order.id,
+                'stock_held_until': reservation.expires_at
             }, status=status.HTTP_201_CREATED)
             
         except stripe.error.StripeError as e:
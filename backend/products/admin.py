@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product
+from .models import Product, ProductImport
 
 # Register your models here.
 
@@ -9,3 +9,9 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('category',)
     search_fields = ('productName', 'description')
     readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(ProductImport)
+class ProductImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'farmer', 'status', 'rows', 'created_count', 'updated_count', 'error_count', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'finished_at')
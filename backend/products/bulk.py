@@ -0,0 +1,327 @@
+import csv
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from .models import Product, ProductImport
+from .serializers import ProductSerializer
+from .cache import invalidate_catalogue
+from .search import invalidate_vocabulary
+
+logger = logging.getLogger(__name__)
+
+'''
+bulk.py: Bulk product creation and updates for a farmer (ProductViewSet.bulk)
+import_products(): Validates rows in one pass and writes them with bulk_create/bulk_update
+read_csv(): Streams product rows from an uploaded CSV file
+schedule_import(): Runs a ProductImport (large CSV upload) on a worker thread
+stalled_imports(): Imports left unfinished by a server restart or crash (recover_product_imports)
+
+Rows use the ProductSerializer fields. A row with an "id" updates that product, which
+must belong to the farmer, and only changes the fields it contains; any other row
+creates a product. In CSV files empty cells are left out of the row.
+
+Imports are all or nothing: every row is validated, rows are written in batches of
+PRODUCT_IMPORT_BATCH_SIZE inside one transaction, and if any row is invalid the
+transaction is rolled back and the per-row errors are returned instead. The serializers
+(and so their compiled validators) are built once per import, not once per row.
+
+bulk_create and bulk_update do not send model signals, so the catalogue cache and the
+search vocabulary are invalidated here.
+
+Worker threads live in the server process, so a restart or crash leaves its imports
+pending or running for good. Nothing of an interrupted import was committed, so the
+recover_product_imports command runs (or fails) imports still unfinished
+PRODUCT_IMPORT_STALE_MINUTES after their upload. A job is claimed (pending -> running)
+before it runs, so a job is never imported twice by a worker and the command.
+'''
+
+_lock = threading.Lock()
+_executor = None
+
+
+class ImportResult:
+    """
+    Outcome of import_products(): row and write counts plus the first errors.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = []
+        self.updated = []
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.error_count += 1
+        if len(self.errors) < getattr(settings, 'PRODUCT_IMPORT_MAX_ERRORS', 100):
+            self.errors.append({'row': row, 'errors': errors})
+
+
+class RowValidator:
+    """
+    Validates product rows against ProductSerializer, reusing one serializer per mode.
+    """
+    def __init__(self, context):
+        self.create = ProductSerializer(context=context)
+        self.update = ProductSerializer(context=context, partial=True)
+
+    def validate(self, data, partial):
+        serializer = self.update if partial else self.create
+        return serializer.run_validation(data)
+
+
+def parse_id(value):
+    try:
+        product_id = int(value)
+    except (TypeError, ValueError):
+        raise serializers.ValidationError({'id': ["A valid product id is required."]})
+    if product_id < 1:
+        raise serializers.ValidationError({'id': ["A valid product id is required."]})
+    return product_id
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_products(farmer, rows, context=None):
+    """
+    Create and update the farmer's products from `rows`, an iterable of
+    (row number, data) pairs. Returns an ImportResult; nothing is written unless every
+    row is valid.
+    """
+    result = ImportResult()
+    validator = RowValidator(context or {})
+    batch_size = getattr(settings, 'PRODUCT_IMPORT_BATCH_SIZE', 500)
+    seen_ids = set()
+
+    with transaction.atomic():
+        for batch in batches(rows, batch_size):
+            result.rows += len(batch)
+
+            # Parse update ids first so the batch's products are fetched in one query
+            parsed = []
+            for number, data in batch:
+                product_id = None
+                id_error = None
+                try:
+                    if isinstance(data, dict) and data.get('id') not in (None, ''):
+                        product_id = parse_id(data['id'])
+                        if product_id in seen_ids:
+                            raise serializers.ValidationError({'id': ["This product appears more than once in the import."]})
+                        seen_ids.add(product_id)
+                except serializers.ValidationError as e:
+                    id_error = serializers.as_serializer_error(e)
+                parsed.append((number, data, product_id, id_error))
+
+            ids = [product_id for _, _, product_id, id_error in parsed if product_id is not None and not id_error]
+            existing = Product.objects.in_bulk(ids) if ids else {}
+
+            to_create = []
+            to_update = []
+            update_fields = set()
+            for number, data, product_id, id_error in parsed:
+                if id_error:
+                    result.add_error(number, id_error)
+                    continue
+                product = existing.get(product_id)
+                if product_id is not None and (product is None or product.farmer_id != farmer.pk):
+                    result.add_error(number, {'id': ["Product not found."]})
+                    continue
+                try:
+                    values = validator.validate(data, partial=product is not None)
+                except serializers.ValidationError as e:
+                    result.add_error(number, serializers.as_serializer_error(e))
+                    continue
+
+                if product is None:
+                    to_create.append(Product(farmer=farmer, **values))
+                else:
+                    for field, value in values.items():
+                        setattr(product, field, value)
+                    update_fields.update(values)
+                    to_update.append(product)
+
+            # Once a row has failed nothing will be kept, so only validation continues
+            if result.error_count:
+                continue
+
+            if to_create:
+                result.created.extend(Product.objects.bulk_create(to_create))
+            if to_update:
+                # bulk_update does not apply auto_now
+                now = timezone.now()
+                for product in to_update:
+                    product.updated_at = now
+                Product.objects.bulk_update(to_update, sorted(update_fields) + ['updated_at'])
+                result.updated.extend(to_update)
+
+        if result.error_count:
+            transaction.set_rollback(True)
+            result.created = []
+            result.updated = []
+        elif result.created or result.updated:
+            invalidate_catalogue()
+            invalidate_vocabulary()
+
+    logger.info(
+        f"Product import for {farmer.email}: {result.rows} rows, {len(result.created)} created, "
+        f"{len(result.updated)} updated, {result.error_count} invalid"
+    )
+    return result
+
+
+def read_csv(binary_file):
+    """
+    Yield (line number, row) pairs from a CSV file opened in binary mode, reading it
+    as it goes. Whitespace is trimmed and empty cells are dropped.
+    """
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.DictReader(text)
+        for row in reader:
+            data = {
+                key.strip(): value.strip()
+                for key, value in row.items()
+                # Extra cells are collected under the key None
+                if key and isinstance(value, str) and value.strip()
+            }
+            yield reader.line_num, data
+    finally:
+        # The caller owns the file; don't let the wrapper close it
+        text.detach()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'PRODUCT_IMPORT_WORKERS', 1),
+                thread_name_prefix='product-import'
+            )
+        return _executor
+
+
+def schedule_import(job):
+    """
+    Queue a ProductImport for a worker thread, once the current transaction commits.
+    """
+    job_id = job.pk
+    transaction.on_commit(lambda: get_executor().submit(run_import_in_background, job_id))
+
+
+def run_import(job):
+    """
+    Import a pending ProductImport's CSV file and record the outcome on the job.
+
+    Returns False without doing anything if the job was claimed by someone else.
+    """
+    claimed = ProductImport.objects.filter(
+        pk=job.pk, status=ProductImport.Status.PENDING
+    ).update(status=ProductImport.Status.RUNNING)
+    if not claimed:
+        logger.info(f"Product import {job.pk} is no longer pending, skipping it")
+        return False
+    job.status = ProductImport.Status.RUNNING
+
+    try:
+        with job.file.open('rb') as binary_file:
+            result = import_products(job.farmer, read_csv(binary_file))
+    except (UnicodeDecodeError, csv.Error) as e:
+        result = ImportResult()
+        result.add_error(None, {'non_field_errors': [f"Could not read the CSV file: {str(e)}"]})
+
+    job.rows = result.rows
+    job.created_count = len(result.created)
+    job.updated_count = len(result.updated)
+    job.error_count = result.error_count
+    job.errors = result.errors
+    job.status = ProductImport.Status.FAILED if result.error_count else ProductImport.Status.COMPLETED
+    job.finished_at = timezone.now()
+    job.save()
+    job.file.delete(save=True)
+    return True
+
+
+def fail_import(job, message):
+    """
+    Mark an import failed with `message` and delete its file.
+    """
+    ProductImport.objects.filter(pk=job.pk).update(
+        status=ProductImport.Status.FAILED,
+        errors=[{'row': None, 'errors': {'non_field_errors': [message]}}],
+        error_count=1,
+        finished_at=timezone.now(),
+    )
+    if job.file:
+        job.file.delete(save=False)
+        ProductImport.objects.filter(pk=job.pk).update(file='')
+
+
+def stalled_imports(minutes=None):
+    """
+    Unfinished imports uploaded more than `minutes` (default PRODUCT_IMPORT_STALE_MINUTES)
+    ago, oldest first.
+    """
+    if minutes is None:
+        minutes = getattr(settings, 'PRODUCT_IMPORT_STALE_MINUTES', 60)
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    return (
+        ProductImport.objects
+        .filter(finished_at__isnull=True, created_at__lt=cutoff)
+        .select_related('farmer')
+        .order_by('created_at')
+    )
+
+
+def rerun_import(job):
+    """
+    Run a stalled import again. Its interrupted run was rolled back, so a running job
+    is put back to pending first.
+    """
+    ProductImport.objects.filter(pk=job.pk, status=ProductImport.Status.RUNNING).update(
+        status=ProductImport.Status.PENDING
+    )
+    job.status = ProductImport.Status.PENDING
+    if not job.file:
+        fail_import(job, "The uploaded file is no longer available; please upload it again.")
+        return False
+    try:
+        return run_import(job)
+    except Exception as e:
+        logger.error(f"Product import {job.pk} failed: {str(e)}")
+        fail_import(job, "The import could not be completed.")
+        return False
+
+
+def run_import_in_background(job_id):
+    """
+    Worker entry point: run the import, mark it failed on unexpected errors, then
+    release this thread's database connection.
+    """
+    try:
+        job = ProductImport.objects.select_related('farmer').get(pk=job_id)
+    except ProductImport.DoesNotExist:
+        connection.close()
+        return
+
+    try:
+        run_import(job)
+    except Exception as e:
+        logger.error(f"Product import {job_id} failed: {str(e)}")
+        fail_import(job, "The import could not be completed.")
+    finally:
+        connection.close()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+from AgroConnect.conditional import etag_matches, mark_revalidate, not_modified
+
+logger = logging.getLogger(__name__)
+
+'''
+cache.py: Versioned response cache for the public catalogue (ProductViewSet.all and retrieve)
+cached_response(): Serves a GET from the cache, building and storing it on a miss, with ETag/304 support
+invalidate_catalogue(): Makes every cached catalogue response stale (after the transaction commits)
+
+Entries are stored under the current catalogue version, which invalidate_catalogue()
+increments whenever a product or a farmer's public profile changes (see
+products/signals.py), so stale pages are never looked up again and simply expire.
+Code that changes products with queryset.update() or bulk operations bypasses the
+signals and must call invalidate_catalogue() itself.
+
+The cache is the MARKETPLACE_CACHE_ALIAS entry of CACHES: local memory by default, or a
+shared backend (set MARKETPLACE_CACHE_URL) so invalidation reaches every server process.
+'''
+
+VERSION_KEY = 'products:catalogue:version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')]
+
+
+def initial_version():
+    # Starting from the clock, a version key that was evicted never comes back with a
+    # value whose entries may still be cached
+    return time.time_ns() // 1000
+
+
+def catalogue_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # add() keeps a version another process has just set
+        cache.add(VERSION_KEY, initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Evicted or never set
+        cache.add(VERSION_KEY, initial_version(), timeout=None)
+
+
+def invalidate_catalogue():
+    """
+    Invalidate all cached catalogue responses once the current transaction commits.
+
+    Bumping before the commit would let a concurrent request cache the old rows under
+    the new version.
+    """
+    transaction.on_commit(bump_version)
+
+
+def response_cache_key(request, name):
+    """
+    Cache key for a GET: endpoint name, host and the sorted query parameters.
+    """
+    params = urlencode(sorted((key, sorted(values)) for key, values in request.query_params.lists()), doseq=True)
+    # Paginated responses contain absolute links, so the host is part of the key
+    raw = f'{name}|{request.get_host()}|{request.path}|{params}'
+    return 'products:response:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def compute_etag(data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+    return '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+
+
+def conditional_response(request, data, etag):
+    """
+    200 with `data`, or 304 if the client already has this version.
+    """
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response = Response(data)
+    response['ETag'] = etag
+    return mark_revalidate(response)
+
+
+def cached_response(request, name, build):
+    """
+    Return the response for a catalogue GET, calling `build()` (which returns a DRF
+    Response) only if it is not cached for the current catalogue version.
+
+    Only 200 responses are cached; anything else is returned as built.
+    """
+    cache = get_cache()
+    key = response_cache_key(request, name)
+    try:
+        version = catalogue_version()
+        entry = cache.get(key, version=version)
+    except Exception as e:
+        # A shared cache being down must not take the catalogue down with it
+        logger.error(f"Error reading marketplace cache: {str(e)}")
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        # Same ETag as a cached response, so clients revalidate the same way
+        return conditional_response(request, response.data, compute_etag(response.data))
+
+    if entry is None:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        entry = (data, compute_etag(data))
+        try:
+            cache.set(key, entry, timeout=getattr(settings, 'MARKETPLACE_CACHE_TTL', 300), version=version)
+        except Exception as e:
+            logger.error(f"Error writing marketplace cache: {str(e)}")
+
+    data, etag = entry
+    return conditional_response(request, data, etag)
@@ -0,0 +1,111 @@
+from decimal import Decimal, InvalidOperation
+from products.models import Product
+
+'''
+filters.py: Server-side filters and sort options for the marketplace listing (ProductViewSet.all)
+filter_marketplace(): Applies the query parameters below to a Product queryset
+get_sort_ordering(): Maps ?sort= to an ordering backed by an index on Product
+get_top_rated_ordering(): Maps ?sort= of the top rated listing to an ordering backed by
+an index on reviews.ProductRating
+
+Query parameters:
+    category     One or more categories (?category=Fruits,Vegetables or repeated)
+    min_price    Lowest price (inclusive)
+    max_price    Highest price (inclusive)
+    min_discount Lowest discount percentage (inclusive)
+    in_stock     true to only show products with stock left
+    city         Farmer's city (case-insensitive)
+    sort         newest (default), price_asc, price_desc or discount
+'''
+
+# Every ordering ends with the primary key so cursor positions are unique
+MARKETPLACE_SORTS = {
+    'newest': ('-created_at', '-id'),       # product_created_idx
+    'price_asc': ('price', 'id'),           # product_price_idx
+    'price_desc': ('-price', '-id'),        # product_price_idx, scanned backwards
+    'discount': ('-discount', '-id'),       # product_discount_idx
+}
+DEFAULT_SORT = 'newest'
+
+# Top rated listing (ProductViewSet.top_rated), over the products' rating summaries
+TOP_RATED_SORTS = {
+    'rating': ('-rating_summary__average', '-rating_summary__count', '-id'),   # product_rating_average_idx
+    'reviews': ('-rating_summary__count', '-rating_summary__average', '-id'),  # product_rating_count_idx
+}
+DEFAULT_TOP_RATED_SORT = 'rating'
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def get_sort_ordering(params):
+    """
+    Return the ordering tuple for ?sort=. Raises ValueError for unknown sort options.
+    """
+    sort = params.get('sort') or DEFAULT_SORT
+    if sort not in MARKETPLACE_SORTS:
+        raise ValueError(f"Invalid sort. Must be one of: {', '.join(MARKETPLACE_SORTS)}")
+    return MARKETPLACE_SORTS[sort]
+
+
+def get_top_rated_ordering(params):
+    """
+    Return the ordering tuple for ?sort= of the top rated listing. Raises ValueError for
+    unknown sort options.
+    """
+    sort = params.get('sort') or DEFAULT_TOP_RATED_SORT
+    if sort not in TOP_RATED_SORTS:
+        raise ValueError(f"Invalid sort. Must be one of: {', '.join(TOP_RATED_SORTS)}")
+    return TOP_RATED_SORTS[sort]
+
+
+def parse_decimal(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"{name} must be a number")
+    # NaN and Infinity parse, but the price lookup rejects them with a ValidationError
+    if not number.is_finite():
+        raise ValueError(f"{name} must be a number")
+    return number
+
+
+def filter_marketplace(queryset, params):
+    """
+    Filter a Product queryset by the marketplace query parameters.
+
+    Raises ValueError (with a message for the client) for invalid values.
+    """
+    categories = [c.strip() for value in params.getlist('category') for c in value.split(',') if c.strip()]
+    if categories:
+        valid = {choice for choice, _ in Product.CATEGORY_CHOICES}
+        unknown = set(categories) - valid
+        if unknown:
+            raise ValueError(f"Unknown category: {', '.join(sorted(unknown))}")
+        queryset = queryset.filter(category__in=categories)
+
+    min_price = parse_decimal(params, 'min_price')
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+
+    max_price = parse_decimal(params, 'max_price')
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+
+    min_discount = params.get('min_discount')
+    if min_discount not in (None, ''):
+        try:
+            queryset = queryset.filter(discount__gte=int(min_discount))
+        except ValueError:
+            raise ValueError("min_discount must be a whole number")
+
+    if (params.get('in_stock') or '').lower() in TRUE_VALUES:
+        queryset = queryset.filter(stockQuantity__gt=0)
+
+    city = (params.get('city') or '').strip()
+    if city:
+        queryset = queryset.filter(farmer__city__iexact=city)
+
+    return queryset
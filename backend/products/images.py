@@ -0,0 +1,293 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+import requests
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from chat.encoding import absolute_media_url
+from chat.product_images import fetch_image, host_allowed, url_lock
+
+logger = logging.getLogger(__name__)
+
+'''
+images.py: Resized product images (ProductViewSet.image)
+image_variants(): Size-specific URLs of a product's images, for ProductSerializer
+open_variant(): Opens a resized image, fetching and resizing the source on a cache miss
+DiskCache: Size-bounded directory of resized images, least recently used evicted first
+
+Product images are external URLs (Cloudinary) of whatever size the farmer uploaded. For
+images on PRODUCT_IMAGE_HOSTS the API also gives URLs of copies no larger than each of
+PRODUCT_IMAGE_SIZES (longest side in pixels), served by this server:
+
+    /api/products/<id>/image/<slot>/<size>/<digest>/
+
+where slot 1-3 is imageUrl, imageUrl2 or imageUrl3 and digest identifies the source URL.
+A URL therefore always shows the same picture: it is served with a long-lived immutable
+Cache-Control, and changing a product image changes its URLs.
+
+The first request for an image downloads the source once (with timeouts, a size cap and
+redirects followed only to allowed hosts), decodes it once and writes every size,
+recompressed as WebP, to the disk cache; later requests read the file without touching
+the database. Sources that cannot be fetched or
+decoded are not retried for PRODUCT_IMAGE_RETRY_SECONDS and the endpoint redirects to the
+original URL meanwhile.
+'''
+
+IMAGE_FIELDS = {1: 'imageUrl', 2: 'imageUrl2', 3: 'imageUrl3'}
+CONTENT_TYPE = 'image/webp'
+# Reads refresh a file's recency at most this often (seconds), to avoid a write per hit
+TOUCH_INTERVAL = 60
+
+_lock = threading.Lock()
+_disk_cache = None
+
+
+class ImageUnavailable(Exception):
+    """
+    Raised by open_variant() when the source image cannot be fetched or decoded.
+    """
+
+
+def get_sizes():
+    return getattr(settings, 'PRODUCT_IMAGE_SIZES', {'thumb': 200, 'small': 400, 'medium': 800})
+
+
+def get_allowed_hosts():
+    return getattr(settings, 'PRODUCT_IMAGE_HOSTS', ['res.cloudinary.com'])
+
+
+def can_proxy(url):
+    """
+    Whether resized copies of `url` are served (avoids fetching arbitrary hosts).
+    """
+    return host_allowed(url, get_allowed_hosts())
+
+
+def source_digest(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def variant_name(digest, pixels):
+    return f'{digest}-{pixels}.webp'
+
+
+def image_variants(product):
+    """
+    {field: {size name: URL}} for the product's images that can be resized.
+    """
+    variants = {}
+    prefix = None
+    for slot, field in IMAGE_FIELDS.items():
+        url = getattr(product, field)
+        if not url or not can_proxy(url):
+            continue
+        if prefix is None:
+            prefix = reverse('product-list')
+        digest = source_digest(url)
+        variants[field] = {
+            name: absolute_media_url(f'{prefix}{product.pk}/image/{slot}/{name}/{digest}/')
+            for name in get_sizes()
+        }
+    return variants
+
+
+class DiskCache:
+    """
+    Files in a directory whose total size is kept under `max_bytes` by deleting the least
+    recently used. Recency is the file's modification time, so server processes sharing
+    the directory share it too.
+
+    Each process counts what it writes on top of the size found by its last scan, and
+    scans (evicting down to 90% of the limit) once that goes over the limit, so the
+    bound is approximate while several processes write at once.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.prune_lock = threading.Lock()
+        # Bytes in the directory as far as this process knows; None until the first scan
+        self.size = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def open(self, name):
+        """
+        Open a cached file for reading, or return None if it is not cached.
+        """
+        path = self.path(name)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            if time.time() - os.fstat(file.fileno()).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            # Evicted meanwhile; the open file is still readable
+            pass
+        return file
+
+    def write(self, name, content):
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            if self.size is not None:
+                self.size += len(content)
+            over = self.size is None or self.size > self.max_bytes
+        if over:
+            self.prune()
+
+    def entries(self):
+        """
+        (modification time, size, path) of every file in the cache.
+        """
+        try:
+            subdirectories = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for subdirectory in subdirectories:
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def prune(self):
+        """
+        Delete the least recently used files until the cache is under 90% of its limit.
+        """
+        # One scan at a time; writers arriving meanwhile need not wait for it
+        if not self.prune_lock.acquire(blocking=False):
+            return
+        try:
+            entries = list(self.entries())
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                removed = 0
+                for _, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                logger.info(f"Evicted {removed} resized product images from {self.directory}")
+            with self.lock:
+                self.size = total
+        finally:
+            self.prune_lock.release()
+
+
+def get_disk_cache():
+    global _disk_cache
+    with _lock:
+        if _disk_cache is None:
+            _disk_cache = DiskCache(
+                getattr(settings, 'PRODUCT_IMAGE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'image_cache')),
+                getattr(settings, 'PRODUCT_IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+            )
+        return _disk_cache
+
+
+def render_variants(content, sizes):
+    """
+    Decode an image once and encode a WebP copy no larger than each of `sizes` (longest
+    side in pixels; smaller images are not enlarged). Returns {pixels: bytes}.
+    """
+    max_pixels = getattr(settings, 'PRODUCT_IMAGE_MAX_PIXELS', 40_000_000)
+    quality = getattr(settings, 'PRODUCT_IMAGE_QUALITY', 80)
+    largest = max(sizes)
+
+    with Image.open(BytesIO(content)) as source:
+        width, height = source.size
+        # Checked before decoding, so a small file cannot expand into a huge bitmap
+        if width * height > max_pixels:
+            raise ValueError(f"Image is larger than {max_pixels} pixels")
+        # JPEGs decode straight at a reduced scale that is still at least `largest`
+        source.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            transparent = 'A' in image.mode or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+
+        variants = {}
+        # Each size is scaled down from the next larger one, not from the original
+        for pixels in sorted(set(sizes), reverse=True):
+            image = image.copy()
+            image.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            image.save(output, 'WEBP', quality=quality)
+            variants[pixels] = output.getvalue()
+    return variants
+
+
+def open_variant(url, pixels):
+    """
+    Open the copy of image `url` no larger than `pixels`, making every size of it first
+    if it is not cached. Returns a binary file object.
+
+    Raises ImageUnavailable if the image cannot be fetched or decoded.
+    """
+    digest = source_digest(url)
+    name = variant_name(digest, pixels)
+    disk_cache = get_disk_cache()
+    failure_key = f'product-image-failed:{digest}'
+
+    # Concurrent requests for a new image wait for one download instead of each fetching it
+    with url_lock(url):
+        file = disk_cache.open(name)
+        if file is not None:
+            return file
+        if cache.get(failure_key):
+            raise ImageUnavailable(f"Image {url} failed recently")
+
+        try:
+            content, content_type = fetch_image(
+                url,
+                max_bytes=getattr(settings, 'PRODUCT_IMAGE_MAX_BYTES', 10 * 1024 * 1024),
+                timeout=getattr(settings, 'PRODUCT_IMAGE_TIMEOUT', (3, 10)),
+                allowed_hosts=get_allowed_hosts(),
+            )
+            variants = render_variants(content, get_sizes().values())
+        except (requests.RequestException, ValueError, OSError, Image.DecompressionBombError) as e:
+            cache.set(failure_key, True, getattr(settings, 'PRODUCT_IMAGE_RETRY_SECONDS', 300))
+            logger.warning(f"Could not resize product image {url}: {str(e)}")
+            raise ImageUnavailable(str(e)) from e
+
+        for size, data in variants.items():
+            try:
+                disk_cache.write(variant_name(digest, size), data)
+            except OSError as e:
+                # Still serve this request; the next one tries to cache it again
+                logger.error(f"Could not cache resized product image {url}: {str(e)}")
+        logger.info(f"Resized product image {url} ({len(content)} bytes) to {sorted(variants)}")
+
+    return BytesIO(variants[pixels])
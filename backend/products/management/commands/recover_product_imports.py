@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.bulk import fail_import, rerun_import, stalled_imports
+
+
+'''
+recover_product_imports: Finishes background CSV imports interrupted by a restart or crash
+Imports run on worker threads of the server process (products/bulk.py), so one that was
+pending or running when the process stopped is never picked up again. This runs every
+import still unfinished PRODUCT_IMPORT_STALE_MINUTES after its upload, in this process,
+or with --fail marks them failed so the farmer uploads the file again. Run it after
+deploys and every few minutes, e.g. from cron.
+
+Example:
+    python manage.py recover_product_imports --older-than 30
+'''
+
+
+class Command(BaseCommand):
+    help = 'Run or fail background product imports left unfinished'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Minutes since upload (default: PRODUCT_IMPORT_STALE_MINUTES)')
+        parser.add_argument('--fail', action='store_true',
+                            help='Mark the imports failed instead of running them')
+
+    def handle(self, *args, **options):
+        if options['older_than'] is not None and options['older_than'] < 0:
+            raise CommandError('--older-than must not be negative')
+
+        ran = failed = 0
+        for job in stalled_imports(options['older_than']):
+            if options['fail']:
+                fail_import(job, "The import was interrupted; please upload the file again.")
+                failed += 1
+            elif rerun_import(job):
+                ran += 1
+                self.stdout.write(f'Import {job.pk}: {job.status}, {job.created_count} created, '
+                                  f'{job.updated_count} updated, {job.error_count} invalid rows')
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(f'Ran {ran} stalled product imports, failed {failed}'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.recommendations import refresh_neighbours
+
+
+'''
+refresh_recommendations: Recomputes the related products lists (products/recommendations.py)
+By default only the lists that may have changed since the previous run are recomputed:
+those of products bought or asked about since then (and of everything their customers
+chose), of edited products, and of products without a list. Run it every few minutes,
+e.g. from cron, and with --full now and then (e.g. nightly).
+
+Example:
+    python manage.py refresh_recommendations --full
+'''
+
+
+class Command(BaseCommand):
+    help = 'Recompute related product recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every product, not only changed ones')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Lists written per query (default: 500)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        written = refresh_neighbours(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed related products of {written} products'))
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+'''
+Full-text search index for products (see products/search.py)
+PostgreSQL: GIN index on the weighted tsvector of productName, category and description
+SQLite: FTS5 table with the farmer's city, kept in sync with triggers
+'''
+
+INDEX_NAME = 'product_search_gin'
+FTS_TABLE = 'products_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        Product = apps.get_model('products', 'Product')
+        # Same expression as products.search.search_vector()
+        vector = (
+            SearchVector('productName', config='english', weight='A')
+            + SearchVector('category', config='english', weight='B')
+            + SearchVector('description', config='english', weight='C')
+        )
+        schema_editor.add_index(Product, GinIndex(vector, name=INDEX_NAME))
+
+    elif vendor == 'sqlite':
+        from products.search import ensure_sqlite_fts
+        ensure_sqlite_fts(schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au', 'cu'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_marketplace_indexes'),
+        ('users', '0007_alter_customuser_phone_number'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-19 11:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductNeighbours',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbours', serialize=False, to='products.product')),
+                ('neighbour_ids', models.BinaryField()),
+                ('computed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+'''
+SQLite only: drop the product search triggers of migration 0006
+The triggers read the users table, and SQLite refuses to rebuild a table (as
+users.0008_customuser_location does) while a trigger refers to it. A full migrate
+applies this migration first (products comes before users); ProductsConfig recreates
+the missing triggers, with a full reindex, once migrate has finished.
+'''
+
+FTS_TABLE = 'products_product_fts'
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for suffix in ('ai', 'ad', 'au', 'cu'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+
+
+def create_search_triggers(apps, schema_editor):
+    from products.search import ensure_sqlite_fts
+    ensure_sqlite_fts(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_neighbours'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, create_search_triggers),
+    ]
@@ -37,3 +37,55 @@ class Product(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Marketplace sort options (products/filters.py MARKETPLACE_SORTS)
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['-discount', '-id'], name='product_discount_idx'),
+            # Marketplace filtered by category, newest first
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ]
+
+class ProductImport(models.Model):
+    """
+    A CSV product import run in the background (products/bulk.py), for files too large
+    to import within the request. The farmer polls it for the outcome.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'        # Uploaded, waiting for a worker
+        RUNNING = 'running', 'Running'
+        COMPLETED = 'completed', 'Completed'  # Every row was imported
+        FAILED = 'failed', 'Failed'           # Nothing was imported; see errors
+    
+    farmer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='product_imports')
+    # Deleted once the import has run
+    file = models.FileField(upload_to='product_imports/', blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    # [{"row": <line number>, "errors": {field: [messages]}}], the first PRODUCT_IMPORT_MAX_ERRORS
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Product import {self.pk} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+class ProductNeighbours(models.Model):
+    """
+    Precomputed related products of a product, most related first
+    (products/recommendations.py, refreshed by the refresh_recommendations command).
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='neighbours')
+    # Product ids packed as 64-bit integers (recommendations.pack_ids)
+    neighbour_ids = models.BinaryField()
+    # Start of the run that computed the list; the newest one is the next run's watermark
+    computed_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Related products of {self.product_id}"
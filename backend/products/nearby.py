@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+from users.geo import EARTH_RADIUS_KM, covering_prefixes
+
+'''
+nearby.py: Products from farms near a point (ProductViewSet.nearby)
+parse_location(): Reads lat, lng and radius_km from the query parameters
+nearby_products(): Products within a radius, annotated with distance_km and nearest first
+
+Farms are located by CustomUser.latitude / longitude. The candidate farmers are found
+through the indexed geohash column (users/geo.py covering_prefixes), so only farms in
+the few cells around the point are read; the exact great-circle distance is then
+computed, filtered and sorted in SQL.
+'''
+
+
+def parse_coordinate(params, name, low, high):
+    value = params.get(name)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def parse_location(params, user=None):
+    """
+    Return (latitude, longitude, radius_km) from ?lat=&lng=&radius_km=.
+
+    Without lat/lng the user's own saved location is used. Raises ValueError (with a
+    message for the client) for missing or invalid values.
+    """
+    if params.get('lat') in (None, '') and params.get('lng') in (None, ''):
+        if user is None or user.latitude is None or user.longitude is None:
+            raise ValueError("lat and lng are required (no location saved on your profile)")
+        latitude, longitude = user.latitude, user.longitude
+    else:
+        latitude = parse_coordinate(params, 'lat', -90, 90)
+        longitude = parse_coordinate(params, 'lng', -180, 180)
+
+    max_radius = getattr(settings, 'NEARBY_MAX_RADIUS_KM', 300)
+    radius = params.get('radius_km')
+    if radius in (None, ''):
+        radius_km = getattr(settings, 'NEARBY_DEFAULT_RADIUS_KM', 30)
+    else:
+        radius_km = parse_coordinate(params, 'radius_km', 0, max_radius)
+    return latitude, longitude, radius_km
+
+
+def distance_expression(latitude, longitude):
+    """
+    Haversine distance in km from the point to the product's farm.
+    """
+    farm_lat = Radians(F('farmer__latitude'))
+    farm_lng = Radians(F('farmer__longitude'))
+    half_dlat = (farm_lat - Radians(latitude)) / 2
+    half_dlng = (farm_lng - Radians(longitude)) / 2
+    a = Power(Sin(half_dlat), 2) + Cos(Radians(latitude)) * Cos(farm_lat) * Power(Sin(half_dlng), 2)
+    # Rounding can push a just above 1 for antipodal points
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(Least(a, 1.0)))
+
+
+def nearby_products(queryset, latitude, longitude, radius_km):
+    """
+    Restrict a Product queryset to farms within radius_km of the point, nearest first.
+    """
+    in_cells = Q()
+    for prefix in covering_prefixes(latitude, longitude, radius_km):
+        in_cells |= Q(farmer__geohash__startswith=prefix)
+
+    return queryset.filter(in_cells).annotate(
+        distance_km=distance_expression(latitude, longitude)
+    ).filter(
+        distance_km__lte=radius_km
+    ).order_by('distance_km', 'id')
@@ -0,0 +1,236 @@
+import math
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from chat.models import ChatRoom
+from orders.models import OrderItem
+from .models import Product, ProductNeighbours
+from .search import split_words
+
+'''
+recommendations.py: Related products ("customers also bought or asked about", ProductViewSet.related_products)
+refresh_neighbours(): Recomputes the stored neighbour lists (refresh_recommendations command)
+related_product_ids(): A product's neighbour ids, read from memory
+
+Two products are related when the same customers bought or asked about both. Each
+customer's interest in a product is weighted (a purchase counts more than a chat about
+it) and products are compared by the cosine similarity of their customer vectors, so
+best sellers do not crowd out every list. Lists are topped up with products whose name
+and description share words (same category first), then with the newest products of
+the same category.
+
+Lists are stored per product (ProductNeighbours) as packed 64-bit ids. The batch job is
+incremental: it only recomputes products whose customers bought or asked about something
+since the previous run, products edited since then, and products without a list; --full
+recomputes everything, also picking up new products as fallbacks of older ones.
+
+Each server process keeps all lists in memory (about 8 bytes per neighbour), reloaded
+every RECOMMENDATION_RELOAD_SECONDS, so serving a product's list is a dictionary lookup.
+'''
+
+PURCHASE_WEIGHT = 2.0
+INQUIRY_WEIGHT = 1.0
+# Words in more than this share of products ("fresh", "organic") say little about similarity
+COMMON_WORD_SHARE = 0.1
+
+_lock = threading.Lock()
+_neighbours = {}
+_loaded_at = None
+
+
+def pack_ids(ids):
+    return array('q', ids).tobytes()
+
+
+def unpack_ids(data):
+    ids = array('q')
+    ids.frombytes(bytes(data))
+    return ids.tolist()
+
+
+def neighbour_count():
+    return getattr(settings, 'RECOMMENDATION_NEIGHBOURS', 12)
+
+
+def load_interactions():
+    """
+    Customer interest in products: ({customer: {product: weight}}, {product: {customer: weight}}).
+    """
+    by_customer = defaultdict(dict)
+    purchases = OrderItem.objects.values_list('order__user_id', 'product_id')
+    for customer_id, product_id in purchases.iterator(chunk_size=5000):
+        by_customer[customer_id][product_id] = PURCHASE_WEIGHT
+    inquiries = ChatRoom.objects.filter(product__isnull=False).values_list('customer_id', 'product_id')
+    for customer_id, product_id in inquiries.iterator(chunk_size=5000):
+        interests = by_customer[customer_id]
+        # Every purchase also opens a chat; count the stronger signal once
+        interests[product_id] = max(interests.get(product_id, 0), INQUIRY_WEIGHT)
+
+    by_product = defaultdict(dict)
+    for customer_id, interests in by_customer.items():
+        for product_id, weight in interests.items():
+            by_product[product_id][customer_id] = weight
+    return by_customer, by_product
+
+
+class Catalogue:
+    """
+    Categories, ages and words of every product, with an inverted word index, for the
+    category and text fallbacks.
+    """
+    def __init__(self):
+        self.products = {}
+        self.newest_by_category = defaultdict(list)
+        self.index = defaultdict(list)
+        rows = Product.objects.order_by('-created_at', '-id').values_list('id', 'category', 'productName', 'description')
+        for product_id, category, name, description in rows.iterator(chunk_size=2000):
+            words = frozenset(split_words(f'{name} {description}'))
+            self.products[product_id] = (category, words)
+            self.newest_by_category[category].append(product_id)
+            for word in words:
+                self.index[word].append(product_id)
+        self.max_postings = max(2, int(len(self.products) * COMMON_WORD_SHARE))
+
+    def __contains__(self, product_id):
+        return product_id in self.products
+
+    def similar_text(self, product_id):
+        """
+        Products sharing words with the product, same category first, then by Jaccard similarity.
+        """
+        category, words = self.products[product_id]
+        shared = Counter()
+        for word in words:
+            postings = self.index[word]
+            if len(postings) <= self.max_postings:
+                shared.update(postings)
+        shared.pop(product_id, None)
+
+        def key(other):
+            other_category, other_words = self.products[other]
+            jaccard = shared[other] / len(words | other_words)
+            return (other_category == category, jaccard, other)
+        return sorted(shared, key=key, reverse=True)
+
+
+def co_interest(product_id, by_customer, by_product, norms):
+    """
+    Products the product's customers were also interested in, by cosine similarity.
+    """
+    scores = defaultdict(float)
+    for customer_id, weight in by_product.get(product_id, {}).items():
+        for other, other_weight in by_customer[customer_id].items():
+            if other != product_id:
+                scores[other] += weight * other_weight
+    norm = norms.get(product_id)
+    return sorted(scores, key=lambda other: (scores[other] / (norm * norms[other]), other), reverse=True)
+
+
+def compute_neighbours(product_id, catalogue, by_customer, by_product, norms):
+    limit = neighbour_count()
+    neighbours = []
+    seen = {product_id}
+
+    def extend(candidates):
+        for other in candidates:
+            if len(neighbours) >= limit:
+                return
+            # Interactions may reference products deleted since
+            if other not in seen and other in catalogue:
+                seen.add(other)
+                neighbours.append(other)
+
+    extend(co_interest(product_id, by_customer, by_product, norms))
+    if len(neighbours) < limit:
+        extend(catalogue.similar_text(product_id))
+    if len(neighbours) < limit:
+        category = catalogue.products[product_id][0]
+        extend(catalogue.newest_by_category[category])
+    return neighbours
+
+
+def changed_products(since, by_customer, by_product):
+    """
+    Products whose neighbour lists may have changed since the last run.
+    """
+    new_interest = set(OrderItem.objects.filter(order__created_at__gte=since).values_list('product_id', flat=True))
+    new_interest.update(
+        ChatRoom.objects.filter(created_at__gte=since, product__isnull=False).values_list('product_id', flat=True)
+    )
+    # A product's customer vector changed, so did its similarity to everything its customers chose
+    changed = set(new_interest)
+    for product_id in new_interest:
+        for customer_id in by_product.get(product_id, {}):
+            changed.update(by_customer[customer_id])
+
+    changed.update(Product.objects.filter(updated_at__gte=since).values_list('id', flat=True))
+    changed.update(Product.objects.filter(neighbours__isnull=True).values_list('id', flat=True))
+    return changed
+
+
+def refresh_neighbours(full=False, batch_size=500):
+    """
+    Recompute the neighbour lists that may have changed (all of them if `full`).
+    Returns the number of lists written.
+    """
+    started = timezone.now()
+    since = None if full else ProductNeighbours.objects.aggregate(latest=Max('computed_at'))['latest']
+
+    by_customer, by_product = load_interactions()
+    norms = {
+        product_id: math.sqrt(sum(weight * weight for weight in customers.values()))
+        for product_id, customers in by_product.items()
+    }
+    catalogue = Catalogue()
+
+    if since is None:
+        targets = set(catalogue.products)
+    else:
+        targets = changed_products(since, by_customer, by_product)
+    targets = sorted(product_id for product_id in targets if product_id in catalogue)
+
+    for start in range(0, len(targets), batch_size):
+        rows = [
+            ProductNeighbours(
+                product_id=product_id,
+                neighbour_ids=pack_ids(compute_neighbours(product_id, catalogue, by_customer, by_product, norms)),
+                computed_at=started,
+            )
+            for product_id in targets[start:start + batch_size]
+        ]
+        ProductNeighbours.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['neighbour_ids', 'computed_at'],
+        )
+    return len(targets)
+
+
+def neighbour_map():
+    """
+    {product id: packed neighbour ids}, reloaded every RECOMMENDATION_RELOAD_SECONDS.
+    """
+    global _neighbours, _loaded_at
+    ttl = getattr(settings, 'RECOMMENDATION_RELOAD_SECONDS', 300)
+    if _loaded_at is None or time.monotonic() - _loaded_at > ttl:
+        with _lock:
+            if _loaded_at is None or time.monotonic() - _loaded_at > ttl:
+                rows = ProductNeighbours.objects.values_list('product_id', 'neighbour_ids')
+                # Swap in a new dict so readers never see a half-loaded one
+                _neighbours = {product_id: bytes(data) for product_id, data in rows.iterator(chunk_size=5000)}
+                _loaded_at = time.monotonic()
+    return _neighbours
+
+
+def related_product_ids(product_id):
+    """
+    Ids of the products related to `product_id`, most related first, or None if its list
+    has not been computed yet.
+    """
+    data = neighbour_map().get(product_id)
+    return None if data is None else unpack_ids(data)
@@ -0,0 +1,324 @@
+import re
+from bisect import bisect_left
+from difflib import get_close_matches
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Case, Count, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from products.filters import filter_marketplace
+from products.models import Product
+
+User = get_user_model()
+
+'''
+search.py: Ranked full-text product search (ProductViewSet.search)
+search_products(): Filters a Product queryset by a text query and annotates `rank` (higher is better)
+correct_terms(): Adds the closest known words for misspelt query words (typo tolerance)
+get_facets(): Category and city counts for the matches
+ensure_sqlite_fts(): Creates the SQLite FTS5 table and triggers if they are missing
+
+Searched fields are productName, category, description and the farmer's city.
+PostgreSQL uses a weighted tsvector (productName A, category B, description C) backed by
+the GIN expression index from migration 0006; a query word also matches products of
+farmers whose city contains it. SQLite uses the FTS5 table products_product_fts, which
+holds the city as a fourth column and is kept in sync by triggers on both tables.
+Other databases fall back to a case-insensitive substring match.
+The triggers read the users table, which SQLite refuses to rebuild while they exist
+(migration 0009 drops them for users.0008); missing triggers are recreated, with a full
+reindex, after migrate (see ProductsConfig.ready).
+
+Every query word must match (the last one as a prefix, for search-as-you-type). A word
+that is not the start of any known word is widened with its closest matches from the
+vocabulary of product names, categories and cities, so "tomatos" also finds "tomatoes".
+The vocabulary is cached for PRODUCT_SEARCH_VOCABULARY_TTL seconds and dropped on
+product and city changes (see products/signals.py).
+'''
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'products_product_fts'
+VOCABULARY_CACHE_KEY = 'products:search:vocabulary'
+
+# Shortest word that is corrected; shorter ones are too ambiguous
+MIN_CORRECTION_LENGTH = 4
+
+FTS_ROW_SELECT = (
+    "SELECT p.id, p.productName, p.category, p.description, COALESCE(u.city, '') "
+    "FROM products_product p LEFT JOIN users u ON u.id = p.farmer_id"
+)
+
+SQLITE_FTS_TRIGGERS = {
+    f'{FTS_TABLE}_ai': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON products_product BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, productName, category, description, city) "
+        f"{FTS_ROW_SELECT} WHERE p.id = new.id; END"
+    ),
+    f'{FTS_TABLE}_ad': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON products_product BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END"
+    ),
+    f'{FTS_TABLE}_au': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF productName, category, description, farmer_id "
+        f"ON products_product BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"INSERT INTO {FTS_TABLE}(rowid, productName, category, description, city) "
+        f"{FTS_ROW_SELECT} WHERE p.id = new.id; END"
+    ),
+    # A farmer moving city re-indexes their products
+    f'{FTS_TABLE}_cu': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_cu AFTER UPDATE OF city ON users BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM products_product WHERE farmer_id = new.id); "
+        f"INSERT INTO {FTS_TABLE}(rowid, productName, category, description, city) "
+        f"{FTS_ROW_SELECT} WHERE p.farmer_id = new.id; END"
+    ),
+}
+
+# bm25() column weights: productName, category, description, city
+SQLITE_COLUMN_WEIGHTS = '10.0, 4.0, 1.0, 4.0'
+# Added to the PostgreSQL rank of products matched through the farmer's city
+CITY_MATCH_RANK = 0.4
+
+
+def search_vector():
+    """
+    The indexed PostgreSQL document. Must match migration 0006 exactly for the GIN index to be used.
+    """
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('productName', config=SEARCH_CONFIG, weight='A')
+        + SearchVector('category', config=SEARCH_CONFIG, weight='B')
+        + SearchVector('description', config=SEARCH_CONFIG, weight='C')
+    )
+
+
+def split_words(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def get_vocabulary():
+    """
+    Sorted list of the distinct words in product names, categories and farmer cities.
+    """
+    vocabulary = cache.get(VOCABULARY_CACHE_KEY)
+    if vocabulary is None:
+        words = set()
+        cities = User.objects.filter(products__isnull=False).values_list('city', flat=True).distinct()
+        for city in cities:
+            words.update(split_words(city))
+        products = Product.objects.values_list('productName', 'category').distinct()
+        for name, category in products.iterator(chunk_size=2000):
+            words.update(split_words(name))
+            words.update(split_words(category))
+        vocabulary = sorted(word for word in words if len(word) > 1)
+        cache.set(VOCABULARY_CACHE_KEY, vocabulary, getattr(settings, 'PRODUCT_SEARCH_VOCABULARY_TTL', 300))
+    return vocabulary
+
+
+def invalidate_vocabulary():
+    cache.delete(VOCABULARY_CACHE_KEY)
+
+
+def is_known_prefix(word, vocabulary):
+    index = bisect_left(vocabulary, word)
+    return index < len(vocabulary) and vocabulary[index].startswith(word)
+
+
+def correct_terms(terms):
+    """
+    Return a list of alternatives per query word: the word itself, followed by its
+    closest vocabulary words if it is not the start of any known word.
+    """
+    vocabulary = get_vocabulary()
+    cutoff = getattr(settings, 'PRODUCT_SEARCH_TYPO_CUTOFF', 0.75)
+    groups = []
+    for term in terms:
+        alternatives = [term]
+        if len(term) >= MIN_CORRECTION_LENGTH and not is_known_prefix(term, vocabulary):
+            alternatives += get_close_matches(term, vocabulary, n=3, cutoff=cutoff)
+        groups.append(alternatives)
+    return groups
+
+
+def search_products(queryset, query):
+    """
+    Restrict `queryset` to products matching `query`, annotated with rank and ordered by it.
+
+    Returns (queryset, corrections) where corrections maps misspelt words to the words
+    searched in their place. The queryset is empty if the query has no searchable words.
+    """
+    terms = split_words(query)
+    if not terms:
+        return queryset.none(), {}
+
+    groups = correct_terms(terms)
+    corrections = {group[0]: group[1:] for group in groups if len(group) > 1}
+
+    if connection.vendor == 'postgresql':
+        return search_postgres(queryset, groups), corrections
+    if connection.vendor == 'sqlite':
+        return search_sqlite(queryset, groups), corrections
+    return search_fallback(queryset, groups), corrections
+
+
+def city_farmer_ids(alternatives):
+    """
+    Ids of farmers whose city has a word starting with one of `alternatives`.
+    """
+    matches = Q()
+    for word in alternatives:
+        matches |= Q(city__istartswith=word) | Q(city__icontains=f' {word}')
+    return list(User.objects.filter(matches, user_type=User.UserType.FARMER).values_list('id', flat=True))
+
+
+def postgres_stopwords(words, using='default'):
+    """
+    The words the text search configuration drops entirely ("and", "the", "a").
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT word FROM unnest(%s::text[]) AS word "
+            "WHERE numnode(plainto_tsquery(%s::regconfig, word)) = 0",
+            [sorted(words), SEARCH_CONFIG]
+        )
+        return {word for word, in cursor.fetchall()}
+
+
+def search_postgres(queryset, groups):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    # A stopword makes an empty tsquery, which matches nothing. Stopword groups are left
+    # out, except the last word, which may be the start of a longer one ("red a" on the way
+    # to "red apples"): it is matched as a prefix without stemming or the stopword list
+    stopwords = postgres_stopwords({word for alternatives in groups for word in alternatives}, queryset.db)
+    last = len(groups) - 1
+
+    def group_query(position, alternatives):
+        # Words are plain (\w+), so a raw tsquery is safe; the last word is a prefix match
+        suffix = ':*' if position == last else ''
+        words = [word for word in alternatives if word not in stopwords]
+        query = None
+        if words:
+            query = SearchQuery(' | '.join(f'{word}{suffix}' for word in words), config=SEARCH_CONFIG, search_type='raw')
+        if position == last and len(words) < len(alternatives):
+            prefixes = ' | '.join(f'{word}:*' for word in alternatives if word in stopwords)
+            simple = SearchQuery(prefixes, config='simple', search_type='raw')
+            query = simple if query is None else query | simple
+        return query
+
+    queries = []
+    for position, alternatives in enumerate(groups):
+        query = group_query(position, alternatives)
+        if query is not None:
+            queries.append((alternatives, query))
+    if not queries:
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+
+    queryset = queryset.annotate(search=search_vector())
+    city_ids = set()
+    any_word = None
+    for alternatives, query in queries:
+        condition = Q(search=query)
+        farmer_ids = city_farmer_ids(alternatives)
+        if farmer_ids:
+            # The farmer id list keeps this an index lookup (BitmapOr with the GIN index)
+            condition |= Q(farmer_id__in=farmer_ids)
+            city_ids.update(farmer_ids)
+        queryset = queryset.filter(condition)
+        any_word = query if any_word is None else any_word | query
+
+    # Ranked on any of the words, so products matching more of them come first
+    rank = SearchRank(search_vector(), any_word)
+    if city_ids:
+        rank = rank + Case(
+            When(farmer_id__in=city_ids, then=Value(CITY_MATCH_RANK)),
+            default=Value(0.0),
+            output_field=FloatField()
+        )
+    return queryset.annotate(rank=rank).order_by('-rank', '-created_at', '-id')
+
+
+def search_sqlite(queryset, groups):
+    # Quote every word so user input cannot inject FTS5 syntax; the last word is a prefix match
+    clauses = []
+    for position, alternatives in enumerate(groups):
+        suffix = '*' if position == len(groups) - 1 else ''
+        clauses.append('(' + ' OR '.join(f'"{word}"{suffix}' for word in alternatives) + ')')
+    match = ' AND '.join(clauses)
+
+    table = queryset.model._meta.db_table
+    return queryset.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+    ).annotate(
+        # bm25() is lower for better matches, so negate it to rank like PostgreSQL
+        rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {SQLITE_COLUMN_WEIGHTS}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (match,),
+            output_field=FloatField(),
+        ),
+    ).order_by('-rank', '-created_at', '-id')
+
+
+def search_fallback(queryset, groups):
+    for alternatives in groups:
+        condition = Q()
+        for word in alternatives:
+            condition |= (
+                Q(productName__icontains=word) | Q(category__icontains=word)
+                | Q(description__icontains=word) | Q(farmer__city__icontains=word)
+            )
+        queryset = queryset.filter(condition)
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField())).order_by('-created_at', '-id')
+
+
+def facet_counts(queryset, field):
+    rows = queryset.order_by().values(field).annotate(count=Count('id', distinct=True)).order_by('-count', field)
+    return [{'value': row[field], 'count': row['count']} for row in rows]
+
+
+def get_facets(matches, params):
+    """
+    Category and city counts for the search matches.
+
+    Each facet applies every marketplace filter except its own, so the counts show how
+    many results picking another value would give.
+    """
+    facets = {}
+    for name, field in (('category', 'category'), ('city', 'farmer__city')):
+        others = params.copy()
+        others.pop(name, None)
+        facets[name] = facet_counts(filter_marketplace(matches, others), field)
+    return facets
+
+
+def ensure_sqlite_fts(using='default'):
+    """
+    Create the FTS5 table and its sync triggers on SQLite if they are missing.
+
+    If any trigger had to be (re)created the index may be stale, so it is rebuilt
+    from products_product. Does nothing on other databases.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            (f'{FTS_TABLE}_%',)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing == set(SQLITE_FTS_TRIGGERS):
+            return
+
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"productName, category, description, city, tokenize='porter unicode61')"
+        )
+        for statement in SQLITE_FTS_TRIGGERS.values():
+            cursor.execute(statement)
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, productName, category, description, city) {FTS_ROW_SELECT}")
+
@@ -1,11 +1,38 @@
 from rest_framework import serializers
 from .models import Product
+from .images import image_variants
 import re  # For regular expression validation of image URLs
 import logging
 
 # Configure module logger
 logger = logging.getLogger(__name__)
 
+# Compiled once at import; every product written through the API, singly or in bulk
+# (products/bulk.py), checks up to three image URLs against it
+IMAGE_URL_PATTERN = re.compile(
+    r'^(https?://)'  
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  
+    r'localhost|'  
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  
+    r'(?::\d+)?'  
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE
+)
+
+def check_image_url(value, description):
+    """
+    Validate an optional product image URL, warning about non-Cloudinary hosts.
+    """
+    if not value:
+        return value
+    
+    if not IMAGE_URL_PATTERN.match(value):
+        raise serializers.ValidationError(f"Please provide a valid URL for {description}.")
+    
+    if 'cloudinary.com' not in value:
+        logger.warning(f"Non-Cloudinary image URL provided for {description}: {value}")
+    
+    return value
+
 class ProductSerializer(serializers.ModelSerializer):
     """
     Serializer for the Product model.
@@ -18,6 +45,9 @@ class ProductSerializer(serializers.ModelSerializer):
     # These are computed using the get_* methods defined below
     farmer_name = serializers.SerializerMethodField()  # Farmer's full name
     farmer_city = serializers.SerializerMethodField()   # Farmer's city location
+    rating = serializers.SerializerMethodField()        # Product's rating summary
+    farmer_rating = serializers.SerializerMethodField() # Farmer's rating over all products
+    image_variants = serializers.SerializerMethodField() # Resized copies of the product images
     
     class Meta:
         """
@@ -30,6 +60,8 @@ class ProductSerializer(serializers.ModelSerializer):
             'farmer',       # Foreign key to the farmer user
             'farmer_name',  # Custom field - farmer's name
             'farmer_city',  # Custom field - farmer's city
+            'rating',        # Custom field - product's rating summary
+            'farmer_rating', # Custom field - farmer's rating summary
             
             # Product details
             'productName',   # Name of the product
@@ -43,13 +75,14 @@ class ProductSerializer(serializers.ModelSerializer):
             'imageUrl',      # Primary product image
             'imageUrl2',     # Secondary product image (optional)
             'imageUrl3',     # Tertiary product image (optional)
+            'image_variants', # Custom field - URLs of the images by size
             
             # Timestamps
             'created_at',    # When the product was created
             'updated_at'     # When the product was last updated
         ]
         # Fields that cannot be modified directly through the API
-        read_only_fields = ['id', 'farmer', 'farmer_name', 'farmer_city', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'farmer', 'farmer_name', 'farmer_city', 'rating', 'farmer_rating', 'image_variants', 'created_at', 'updated_at']
     
     def get_farmer_name(self, obj):
         """
@@ -80,68 +113,48 @@ class ProductSerializer(serializers.ModelSerializer):
             return obj.farmer.city
         return ""  # Return empty string if no farmer or no city
     
-    def validate_imageUrl(self, value):
-        if not value:
-            return value
-        
-        url_pattern = re.compile(
-            r'^(https?://)'  
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  
-            r'localhost|'  
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  
-            r'(?::\d+)?'  
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE
-        )
+    def get_rating(self, obj):
+        """
+        Get the product's rating from its denormalized summary (reviews.ProductRating).
         
-        if not url_pattern.match(value):
-            raise serializers.ValidationError("Please provide a valid URL for the product image.")
+        Returns:
+            dict: count, average (0 without ratings) and histogram of approved ratings by star.
+        """
+        summary = getattr(obj, 'rating_summary', None)
+        if summary is None:
+            return {'count': 0, 'average': 0, 'histogram': {str(star): 0 for star in range(1, 6)}}
+        return {'count': summary.count, 'average': round(summary.average, 2), 'histogram': summary.histogram()}
+    
+    def get_farmer_rating(self, obj):
+        """
+        Get the farmer's rating over all their products (reviews.FarmerRating).
         
-        if 'cloudinary.com' not in value:
-            logger.warning(f"Non-Cloudinary image URL provided: {value}")
+        Returns:
+            dict: count and average of the farmer's approved ratings.
+        """
+        summary = getattr(obj.farmer, 'rating_summary', None) if obj.farmer else None
+        if summary is None:
+            return {'count': 0, 'average': 0}
+        return {'count': summary.count, 'average': round(summary.average, 2)}
+    
+    def get_image_variants(self, obj):
+        """
+        Get URLs of resized copies of the product images (see products/images.py).
         
-        return value
+        Returns:
+            dict: {image field: {size name: URL}}, e.g. image_variants['imageUrl']['thumb'];
+                  images on hosts that are not proxied are left out, so use the original URL.
+        """
+        return image_variants(obj)
+    
+    def validate_imageUrl(self, value):
+        return check_image_url(value, "the product image")
     
     def validate_imageUrl2(self, value):
-        if not value:
-            return value
-        
-        url_pattern = re.compile(
-            r'^(https?://)'  
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  
-            r'localhost|'  
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  
-            r'(?::\d+)?'  
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE
-        )
-        
-        if not url_pattern.match(value):
-            raise serializers.ValidationError("Please provide a valid URL for the second product image.")
-        
-        if 'cloudinary.com' not in value:
-            logger.warning(f"Non-Cloudinary image URL provided for second image: {value}")
-        
-        return value
+        return check_image_url(value, "the second product image")
     
     def validate_imageUrl3(self, value):
-        if not value:
-            return value
-        
-        url_pattern = re.compile(
-            r'^(https?://)'  
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  
-            r'localhost|'  
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  
-            r'(?::\d+)?'  
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE
-        )
-        
-        if not url_pattern.match(value):
-            raise serializers.ValidationError("Please provide a valid URL for the third product image.")
-        
-        if 'cloudinary.com' not in value:
-            logger.warning(f"Non-Cloudinary image URL provided for third image: {value}")
-        
-        return value
+        return check_image_url(value, "the third product image")
     
     def create(self, validated_data):
         """
@@ -162,3 +175,16 @@ class ProductSerializer(serializers.ModelSerializer):
         
         # Call the parent class's create method with the updated validated_data
         return super().create(validated_data)
+
+class NearbyProductSerializer(ProductSerializer):
+    """
+    ProductSerializer for the nearby listing (ProductViewSet.nearby), adding the
+    distance to the farm in kilometres (annotated by products/nearby.py).
+    """
+    distance_km = serializers.SerializerMethodField()
+    
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['distance_km']
+    
+    def get_distance_km(self, obj):
+        return round(obj.distance_km, 2)
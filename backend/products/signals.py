@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Product
+from .cache import invalidate_catalogue
+from .search import invalidate_vocabulary
+
+User = get_user_model()
+
+'''
+signals.py: Keeps cached product data current
+New, edited and deleted products invalidate the marketplace response cache (products/cache.py)
+and the search vocabulary (products/search.py). So do farmers changing the name or city
+shown on their products.
+'''
+
+# Farmer fields shown in the catalogue (farmer_name, farmer_city)
+FARMER_CATALOGUE_FIELDS = {'full_name', 'city'}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    invalidate_catalogue()
+    invalidate_vocabulary()
+
+
+@receiver(post_save, sender=User)
+def farmer_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    # New farmers have no products yet; logins save last_login only
+    if created or instance.user_type != User.UserType.FARMER:
+        return
+    if update_fields is None or FARMER_CATALOGUE_FIELDS & set(update_fields):
+        invalidate_catalogue()
+        invalidate_vocabulary()
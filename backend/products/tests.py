@@ -0,0 +1,547 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from urllib.parse import urlparse
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from AgroConnect.conditional import ConditionalGetMixin
+from chat.models import ChatRoom
+from orders.models import Order, OrderItem
+from users.models import CustomUser
+from . import images, recommendations
+from .bulk import run_import
+from .cache import compute_etag
+from .images import DiskCache, image_variants, source_digest, variant_name
+from .recommendations import refresh_neighbours, related_product_ids
+from .models import Product, ProductImport, ProductNeighbours
+
+'''
+tests.py: Product API tests
+ProductDetailTests: Product details have one ETag, from the marketplace cache, even when it is down
+BulkImportTests: Bulk create/update of a farmer's products, all or nothing, from JSON or CSV
+RecoverImportTests: recover_product_imports runs or fails background imports left unfinished
+RecommendationTests: Related products by co-purchase and co-inquiry, refreshed incrementally
+ProductImageTests: Resized product images, fetched from a local HTTP server standing in for the CDN
+DiskCacheTests: The resized image cache stays under its size limit, least recently used first out
+'''
+
+
+def create_user(number, user_type):
+    return CustomUser.objects.create_user(
+        f'+92300{number:07d}', f'{user_type.lower()}{number}@example.com', f'User {number}',
+        user_type, 'Punjab', 'Lahore', password='password'
+    )
+
+
+def noise_jpeg(width, height):
+    # Noise does not compress away, so the resized copies have realistic sizes
+    output = BytesIO()
+    Image.effect_noise((width, height), 64).convert('RGB').save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def create_product(farmer, name='Mango', **fields):
+    defaults = {'category': 'Fruits', 'description': 'Fresh', 'price': 10, 'stockQuantity': 5}
+    return Product.objects.create(farmer=farmer, productName=name, **{**defaults, **fields})
+
+
+class ProductDetailTests(APITestCase):
+    """
+    GET /api/products/<id>/ (ProductViewSet.retrieve)
+    """
+    def setUp(self):
+        caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')].clear()
+        self.product = create_product(create_user(1, 'FARMER'))
+        self.url = f'/api/products/{self.product.pk}/'
+        self.client.force_authenticate(create_user(2, 'CUSTOMER'))
+
+    def test_one_etag_source(self):
+        # The mixin's per-user ETag query is not run on a cache miss
+        with mock.patch.object(ConditionalGetMixin, 'get_etag', side_effect=AssertionError('mixin ETag')):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertEqual(etag, compute_etag(response.data))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_same_etag_while_the_cache_is_down(self):
+        etag = self.client.get(self.url)['ETag']
+
+        cache_alias = getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')
+        with mock.patch.object(caches[cache_alias], 'get', side_effect=ConnectionError('cache down')), \
+                self.assertLogs('products.cache', 'ERROR'):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['ETag'], etag)
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+def product_row(name='Guava', **fields):
+    row = {
+        'productName': name, 'category': 'Fruits', 'description': 'Sweet', 'price': '5.00',
+        'stockQuantity': '10', 'imageUrl': 'https://res.cloudinary.com/demo/guava.jpg',
+    }
+    row.update(fields)
+    return row
+
+
+def product_csv(*rows):
+    columns = list(rows[0])
+    lines = [','.join(columns)] + [','.join(str(row.get(column, '')) for column in columns) for row in rows]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class BulkImportTests(APITestCase):
+    """
+    POST /api/products/bulk/ (ProductViewSet.bulk, products/bulk.py)
+    """
+    url = '/api/products/bulk/'
+
+    def setUp(self):
+        self.farmer = create_user(1, 'FARMER')
+        self.product = create_product(self.farmer)
+        self.foreign = create_product(create_user(2, 'FARMER'), 'Apple')
+        self.client.force_authenticate(self.farmer)
+
+    def assertNothingSaved(self):
+        self.assertEqual(Product.objects.count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, Decimal('10'))
+
+    def test_creates_and_updates(self):
+        response = self.client.post(self.url, [product_row(), {'id': self.product.pk, 'price': '12.50'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product['productName'] for product in response.data['created']], ['Guava'])
+        self.assertEqual([product['id'] for product in response.data['updated']], [self.product.pk])
+        self.assertTrue(Product.objects.filter(farmer=self.farmer, productName='Guava').exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, Decimal('12.50'))
+        # Only the fields in the row change
+        self.assertEqual(self.product.productName, 'Mango')
+
+    def test_reports_errors_by_row_and_saves_nothing(self):
+        rows = [
+            {'id': self.product.pk, 'price': '12.50'},
+            product_row(price='cheap'),
+            product_row('Plum'),
+            {'productName': 'Pear'},
+        ]
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 3])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertIn('category', response.data['errors'][1]['errors'])
+        self.assertNothingSaved()
+
+    def test_rejects_other_farmers_products(self):
+        response = self.client.post(self.url, [{'id': self.foreign.pk, 'price': '1.00'}, {'id': 'x'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'], [
+            {'row': 0, 'errors': {'id': ['Product not found.']}},
+            {'row': 1, 'errors': {'id': ['A valid product id is required.']}},
+        ])
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.price, Decimal('10'))
+
+    def test_rejects_duplicate_ids(self):
+        rows = [{'id': self.product.pk, 'price': '11.00'}, {'id': self.product.pk, 'price': '12.00'}]
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1])
+        self.assertNothingSaved()
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('products.csv', product_csv(product_row('Plum', id=self.product.pk), product_row(id='')))
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['created']), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.productName, 'Plum')
+
+    def test_csv_errors_use_line_numbers(self):
+        upload = SimpleUploadedFile('products.csv', product_csv(product_row(), product_row(category='Flowers')))
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3])
+        self.assertNothingSaved()
+
+    def test_large_csv_is_imported_in_the_background(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        upload = SimpleUploadedFile('products.csv', product_csv(product_row()))
+        with self.settings(PRODUCT_IMPORT_SYNC_MAX_BYTES=10, MEDIA_ROOT=media_root), \
+                mock.patch('products.views.schedule_import') as schedule_import:
+            response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], ProductImport.Status.PENDING)
+        job = ProductImport.objects.get(pk=response.data['id'])
+        schedule_import.assert_called_once_with(job)
+
+
+class RecoverImportTests(TestCase):
+    """
+    The recover_product_imports command (products/bulk.py stalled_imports).
+    """
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.farmer = create_user(1, 'FARMER')
+
+    def create_job(self, status, minutes_ago):
+        job = ProductImport.objects.create(
+            farmer=self.farmer, status=status,
+            file=ContentFile(product_csv(product_row(), product_row('Plum')), name='products.csv'),
+        )
+        ProductImport.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return job
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('recover_product_imports', *args, stdout=out)
+        return out.getvalue()
+
+    def test_runs_stalled_imports(self):
+        interrupted = self.create_job(ProductImport.Status.RUNNING, 120)
+        never_started = self.create_job(ProductImport.Status.PENDING, 90)
+        recent = self.create_job(ProductImport.Status.PENDING, 5)
+
+        self.assertIn('Ran 2 stalled product imports', self.run_command())
+        for job in (interrupted, never_started):
+            job.refresh_from_db()
+            self.assertEqual(job.status, ProductImport.Status.COMPLETED)
+            self.assertEqual(job.created_count, 2)
+            self.assertIsNotNone(job.finished_at)
+            self.assertFalse(job.file)
+        self.assertEqual(Product.objects.filter(farmer=self.farmer).count(), 4)
+        recent.refresh_from_db()
+        self.assertEqual(recent.status, ProductImport.Status.PENDING)
+
+    def test_fail_option(self):
+        job = self.create_job(ProductImport.Status.RUNNING, 120)
+        path = job.file.path
+
+        self.assertIn('failed 1', self.run_command('--fail'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ProductImport.Status.FAILED)
+        self.assertEqual(job.error_count, 1)
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Product.objects.exists())
+
+    def test_claimed_job_is_not_run_again(self):
+        job = self.create_job(ProductImport.Status.RUNNING, 0)
+        self.assertFalse(run_import(job))
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(RECOMMENDATION_NEIGHBOURS=4)
+class RecommendationTests(APITestCase):
+    """
+    products/recommendations.py and GET /api/products/<id>/related/
+    """
+    def setUp(self):
+        # Each test reads the lists it just computed, not the previous test's
+        recommendations._loaded_at = None
+        self.addCleanup(setattr, recommendations, '_loaded_at', None)
+        self.farmer = create_user(1, 'FARMER')
+        self.customers = [create_user(number, 'CUSTOMER') for number in range(2, 7)]
+        self.mango, self.guava, self.apple, self.banana = (
+            create_product(self.farmer, name) for name in ['Mango', 'Guava', 'Apple', 'Banana']
+        )
+        self.potato = create_product(self.farmer, 'Potato', category='Vegetables')
+        first, second, third, fourth = self.customers[:4]
+        # Mango's customers also chose Guava (2 purchases), Apple (1 inquiry) and Potato
+        # (1 purchase, by a customer who also bought Potato alone): cosine 0.82, 0.58, 0.41
+        self.buy(first, self.mango, self.guava)
+        self.buy(second, self.mango, self.guava)
+        self.ask(second, self.apple)
+        self.buy(third, self.mango, self.potato)
+        self.buy(fourth, self.potato)
+        self.client.force_authenticate(self.customers[-1])
+
+    def buy(self, customer, *products):
+        order = Order.objects.create(user=customer, total=10 * len(products))
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, price_at_order_time=10)
+
+    def ask(self, customer, product):
+        ChatRoom.objects.create(
+            room_id=f'{customer.id}_{product.id}', customer=customer, farmer=self.farmer, product=product
+        )
+
+    def related(self, product):
+        response = self.client.get(f'/api/products/{product.pk}/related/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['productName'] for item in response.data]
+
+    def computed_at(self):
+        return dict(ProductNeighbours.objects.values_list('product_id', 'computed_at'))
+
+    def test_neighbour_order(self):
+        self.assertEqual(refresh_neighbours(full=True), 5)
+        # Banana, with no customers, comes from the same-category fallback
+        self.assertEqual(related_product_ids(self.mango.pk), [self.guava.pk, self.apple.pk, self.potato.pk, self.banana.pk])
+        self.assertEqual(self.related(self.mango), ['Guava', 'Apple', 'Potato', 'Banana'])
+        self.assertEqual(related_product_ids(self.potato.pk)[0], self.mango.pk)
+
+    def test_incremental_refresh_rewrites_affected_products(self):
+        refresh_neighbours(full=True)
+        before = self.computed_at()
+        self.assertEqual(refresh_neighbours(), 0)
+
+        # A new customer buys Potato and Banana: their lists change, and so does Mango's,
+        # which shares customers with Potato
+        self.buy(self.customers[4], self.potato, self.banana)
+        self.assertEqual(refresh_neighbours(), 3)
+        after = self.computed_at()
+        rewritten = {product_id for product_id in before if after[product_id] != before[product_id]}
+        self.assertEqual(rewritten, {self.mango.pk, self.potato.pk, self.banana.pk})
+
+        # New products get a list on the next run
+        kiwi = create_product(self.farmer, 'Kiwi')
+        self.assertEqual(refresh_neighbours(), 1)
+        self.assertIn(kiwi.pk, self.computed_at())
+
+    def test_deleted_neighbours_are_skipped(self):
+        refresh_neighbours(full=True)
+        self.guava.delete()
+        # Loads the lists into memory; serving then reads only the products
+        recommendations.neighbour_map()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.related(self.mango), ['Apple', 'Potato', 'Banana'])
+        apple = self.apple.pk
+        self.apple.delete()
+        response = self.client.get(f'/api/products/{apple}/related/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_product_without_a_list(self):
+        kiwi = create_product(self.farmer, 'Kiwi')
+        refresh_neighbours(full=True)
+        ProductNeighbours.objects.filter(product=kiwi).delete()
+        recommendations._loaded_at = None
+        # Newest products of the same category
+        self.assertEqual(self.related(kiwi), ['Banana', 'Apple', 'Guava', 'Mango'])
+
+
+class ImageServer:
+    """
+    HTTP server on 127.0.0.1 serving `files` ({path: bytes}) and counting requests per path.
+    """
+    def __init__(self, files):
+        self.files = files
+        self.hits = Counter()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits[self.path] += 1
+                body = server.files.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ProductImageTests(APITestCase):
+    """
+    GET /api/products/<id>/image/<slot>/<size>/<digest>/ (ProductViewSet.image)
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        photo = noise_jpeg(1200, 900)
+        cls.server = ImageServer({'/mango.jpg': photo, '/guava.jpg': photo, '/other.jpg': noise_jpeg(300, 200)})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        overrides = override_settings(PRODUCT_IMAGE_HOSTS=['127.0.0.1'], PRODUCT_IMAGE_CACHE_DIR=self.cache_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        # Fresh disk cache and retry window for every test
+        images._disk_cache = None
+        self.addCleanup(setattr, images, '_disk_cache', None)
+        cache.clear()
+        self.server.hits.clear()
+        self.farmer = create_user(1, 'FARMER')
+
+    def create_product(self, path):
+        return create_product(self.farmer, imageUrl=self.server.url + path)
+
+    def variant_path(self, product, size):
+        return urlparse(image_variants(product)['imageUrl'][size]).path
+
+    def get(self, path, **headers):
+        response = self.client.get(path, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def cache_bytes(self):
+        return sum(size for _, size, _ in images.get_disk_cache().entries())
+
+    def test_serves_resized_webp_from_one_fetch(self):
+        product = self.create_product('/mango.jpg')
+
+        for size, pixels in [('thumb', 200), ('small', 400), ('medium', 800)]:
+            response, body = self.get(self.variant_path(product, size))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertIn('immutable', response['Cache-Control'])
+            with Image.open(BytesIO(body)) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertEqual(max(image.size), pixels)
+        # Every size was made from a single download
+        self.assertEqual(self.server.hits['/mango.jpg'], 1)
+
+        # Cached copies are served without the database or the source
+        with self.assertNumQueries(0):
+            response, _ = self.get(self.variant_path(product, 'small'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.server.hits['/mango.jpg'], 1)
+
+    def test_etag_not_modified(self):
+        path = self.variant_path(self.create_product('/mango.jpg'), 'thumb')
+        response, _ = self.get(path)
+        etag = response['ETag']
+
+        response, body = self.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertFalse(body)
+
+    def test_unavailable_source_redirects_until_the_retry_window_ends(self):
+        product = self.create_product('/missing.jpg')
+        path = self.variant_path(product, 'thumb')
+
+        with self.assertLogs('products.images', 'WARNING'):
+            for _ in range(3):
+                response, _ = self.get(path)
+                self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+                self.assertEqual(response['Location'], product.imageUrl)
+                self.assertNotIn('immutable', response['Cache-Control'])
+            self.assertEqual(self.server.hits['/missing.jpg'], 1)
+
+            # The failure is remembered in the cache for PRODUCT_IMAGE_RETRY_SECONDS
+            cache.clear()
+            self.get(path)
+            self.assertEqual(self.server.hits['/missing.jpg'], 2)
+
+    def test_changed_image_redirects_to_the_current_copy(self):
+        product = self.create_product('/mango.jpg')
+        old_path = self.variant_path(product, 'small')
+
+        product.imageUrl = self.server.url + '/other.jpg'
+        product.save()
+        response, _ = self.get(old_path)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(urlparse(response['Location']).path, self.variant_path(product, 'small'))
+        self.assertIn(source_digest(product.imageUrl), response['Location'])
+        self.assertEqual(self.server.hits['/mango.jpg'], 0)
+
+    def test_cache_evicts_beyond_max_bytes(self):
+        mango = self.create_product('/mango.jpg')
+        guava = self.create_product('/guava.jpg')
+        self.get(self.variant_path(mango, 'thumb'))
+        one_product = self.cache_bytes()
+
+        # Room for one and a half products' copies; the mango ones are the least recently used
+        limit = int(one_product * 1.5)
+        past = time.time() - 3600
+        for _, _, path in images.get_disk_cache().entries():
+            os.utime(path, (past, past))
+        with self.settings(PRODUCT_IMAGE_CACHE_MAX_BYTES=limit):
+            images._disk_cache = None
+            self.get(self.variant_path(guava, 'thumb'))
+            self.assertLessEqual(self.cache_bytes(), limit)
+
+            disk_cache = images.get_disk_cache()
+            digest = source_digest(guava.imageUrl)
+            for pixels in (200, 400, 800):
+                self.assertTrue(os.path.exists(disk_cache.path(variant_name(digest, pixels))))
+            digest = source_digest(mango.imageUrl)
+            evicted = [
+                name for name, pixels in images.get_sizes().items()
+                if not os.path.exists(disk_cache.path(variant_name(digest, pixels)))
+            ]
+            self.assertTrue(evicted)
+
+            # An evicted copy is made again from the source
+            response, _ = self.get(self.variant_path(mango, evicted[0]))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.server.hits['/mango.jpg'], 2)
+
+
+class DiskCacheTests(SimpleTestCase):
+    """
+    DiskCache on its own.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def age(self, disk_cache, name, seconds):
+        past = time.time() - seconds
+        os.utime(disk_cache.path(name), (past, past))
+
+    def test_evicts_least_recently_used(self):
+        disk_cache = DiskCache(self.directory, max_bytes=1000)
+        disk_cache.write('aa-1', b'a' * 400)
+        disk_cache.write('bb-1', b'b' * 400)
+        self.age(disk_cache, 'aa-1', 1000)
+        self.age(disk_cache, 'bb-1', 900)
+
+        # Reading the older file makes it the most recently used
+        disk_cache.open('aa-1').close()
+        disk_cache.write('cc-1', b'c' * 400)
+
+        self.assertIsNone(disk_cache.open('bb-1'))
+        for name in ('aa-1', 'cc-1'):
+            file = disk_cache.open(name)
+            self.assertIsNotNone(file)
+            file.close()
+        self.assertLessEqual(sum(size for _, size, _ in disk_cache.entries()), 900)
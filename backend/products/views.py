@@ -1,13 +1,30 @@
-from rest_framework import viewsets, permissions, status
+from rest_framework import mixins, viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.parsers import JSONParser
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from django.conf import settings
-from products.models import Product
-from products.serializers import ProductSerializer
+from django.urls import reverse
+from django.db.models import prefetch_related_objects
+from django.http import FileResponse, HttpResponseNotModified, HttpResponseRedirect
+from products.models import Product, ProductImport
+from products.serializers import ProductSerializer, NearbyProductSerializer
+from products.bulk import import_products, read_csv, schedule_import
+from products.filters import filter_marketplace, get_sort_ordering, get_top_rated_ordering
+from products.search import search_products, get_facets
+from products.nearby import parse_location, nearby_products
+from products.recommendations import related_product_ids
+from products.images import (
+    CONTENT_TYPE, IMAGE_FIELDS, ImageUnavailable, can_proxy, get_disk_cache, get_sizes,
+    image_variants, open_variant, source_digest, variant_name,
+)
+from products.cache import cached_response, catalogue_version
+from AgroConnect.conditional import ConditionalGetMixin, etag_matches
+from users.permissions import IsFarmer
+import csv
 import cloudinary
 import cloudinary.uploader
 import logging
@@ -15,7 +32,33 @@ import logging
 # Configure module logger
 logger = logging.getLogger(__name__)
 
-class ProductViewSet(viewsets.ModelViewSet):
+# Related rows ProductSerializer reads (farmer name and city, product and farmer ratings)
+SERIALIZER_RELATED = ('farmer', 'rating_summary', 'farmer__rating_summary')
+
+class MarketplacePagination(CursorPagination):
+    """
+    Cursor pagination for the marketplace listing.
+    
+    The ordering comes from the ?sort= option (see products/filters.py), so every
+    page is an index range scan instead of an OFFSET over the whole catalogue.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    
+    def get_ordering(self, request, queryset, view):
+        return get_sort_ordering(request.query_params)
+
+class ProductSearchPagination(PageNumberPagination):
+    """
+    Page size settings for product search and nearby results (ordered by rank or
+    distance, so paged by number)
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing products.
     
@@ -28,9 +71,15 @@ class ProductViewSet(viewsets.ModelViewSet):
     
     It also provides custom endpoints for:
     - Listing all products for customer browsing
-    - Finding related products in the same category
+    - Searching products with ranked, faceted results
+    - Finding products from farms near a location
+    - Listing the best rated products
+    - Creating and updating many products at once (JSON or CSV)
+    - Finding related products (bought or asked about by the same customers)
+    - Serving resized copies of product images
     
     Supports Cloudinary image URLs from the frontend for product images.
+    List and detail responses carry ETags and answer If-None-Match with 304.
     """
     serializer_class = ProductSerializer  # The serializer class to use for this viewset
     permission_classes = [IsAuthenticated]  # Require authentication for all endpoints
@@ -54,11 +103,28 @@ class ProductViewSet(viewsets.ModelViewSet):
         # If so, filter products to show only those created by the current user (for farmers)
         if self.request.path.endswith('/products/') or self.request.path.endswith('/products'):
             logger.info(f"Filtering products for user {user.email}")
-            return Product.objects.filter(farmer=user)
+            return Product.objects.filter(farmer=user).select_related(*SERIALIZER_RELATED)
             
         # For other endpoints (like /products/<id>/ for specific product details)
         # return all products to allow customers to view any product's details
-        return Product.objects.all()
+        return Product.objects.select_related(*SERIALIZER_RELATED)
+    
+    def get_conditional_extra(self, queryset):
+        # farmer_name and farmer_city change with the farmer, which bumps the catalogue version
+        return (catalogue_version(),)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Get a single product's details.
+        
+        Product details are the same for every user, so they are served from the
+        marketplace cache (with ETag/304 support) until the product or its farmer changes.
+        """
+        def build():
+            # Not ConditionalGetMixin.retrieve: cached_response is this endpoint's only ETag
+            return mixins.RetrieveModelMixin.retrieve(self, request, *args, **kwargs)
+        
+        return cached_response(request, 'product-detail', build)
     
     def perform_create(self, serializer):
         """
@@ -157,59 +223,317 @@ class ProductViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def all(self, request):
         """
-        Get all products for customer display, regardless of farmer.
+        Get products from all farmers for customer display.
         
         This custom endpoint allows customers to browse all available products from all
-        farmers, sorted by creation date (newest first). It's used on the marketplace/shop
-        page of the application.
+        farmers. It's used on the marketplace/shop page of the application. Results are
+        cursor-paginated ({"next", "previous", "results"}) and can be filtered and sorted
+        on the server; see products/filters.py for the query parameters.
         
         Args:
             request: The HTTP request
             
         Returns:
-            Response: JSON response containing all products
+            Response: JSON response containing one page of products (304 if the
+            If-None-Match ETag is still current)
         """
-        # Get all products, sorted by creation date (newest first)
-        products = Product.objects.all().order_by('-created_at')
-        
-        # Serialize the products, including farmer information
-        # The many=True parameter indicates we're serializing multiple objects
-        serializer = self.get_serializer(products, many=True)
+        def build():
+            try:
+                # Validate the sort option before the paginator uses it
+                get_sort_ordering(request.query_params)
+                products = filter_marketplace(Product.objects.all(), request.query_params)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # farmer_name, farmer_city and the ratings are read from related rows, so join them once
+            products = products.select_related(*SERIALIZER_RELATED)
+            
+            paginator = MarketplacePagination()
+            page = paginator.paginate_queryset(products, request, view=self)
+            serializer = self.get_serializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         
         # Log the request for monitoring
         logger.info(f"All products requested by user {request.user.email}")
         
-        # Return the serialized product data
-        return Response(serializer.data)
+        # Pages are cached per filter set and cursor until a product or farmer changes
+        return cached_response(request, 'product-list', build)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over product names, descriptions, categories and farmer cities.
+        
+        Query parameters: q (search text), page, page_size, and the marketplace filters
+        (category, min_price, max_price, min_discount, in_stock, city).
+        Results are ranked by relevance; misspelt words are also searched as their closest
+        known words. The response adds "facets" (category and city counts) and
+        "corrections" to the usual paginated fields.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"detail": "Search query 'q' is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            matches, corrections = search_products(Product.objects.all(), query)
+            results = filter_marketplace(matches, request.query_params)
+            facets = get_facets(matches, request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        paginator = ProductSearchPagination()
+        page = paginator.paginate_queryset(results.select_related(*SERIALIZER_RELATED), request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['facets'] = facets
+        response.data['corrections'] = corrections
+        return response
+    
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Products from farms within a radius of a location, nearest first.
+        
+        Query parameters: lat and lng (default: the user's saved location), radius_km
+        (default NEARBY_DEFAULT_RADIUS_KM), page, page_size, and the marketplace filters.
+        Each product includes distance_km; farms without a saved location are not listed.
+        """
+        try:
+            latitude, longitude, radius_km = parse_location(request.query_params, request.user)
+            products = filter_marketplace(Product.objects.all(), request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        products = nearby_products(products, latitude, longitude, radius_km).select_related(*SERIALIZER_RELATED)
+        
+        paginator = ProductSearchPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = NearbyProductSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
     
-    # @action(detail=True, methods=['get'])
-    # def related_products(self, request, pk=None):
-    #     """
-    #     Get related products with the same category as the current product.
-        
-    #     This endpoint finds up to 5 other products in the same category as the
-    #     specified product, which can be used for "You might also like" or
-    #     "Similar products" sections in the product detail page.
-        
-    #     Args:
-    #         request: The HTTP request
-    #         pk: The primary key (ID) of the product to find related items for
+    @action(detail=False, methods=['get'], url_path='top-rated')
+    def top_rated(self, request):
+        """
+        Products with the best customer ratings.
+        
+        Query parameters: sort (rating, the default, or reviews for the most reviewed),
+        min_reviews (default TOP_RATED_MIN_REVIEWS), page, page_size, and the marketplace
+        filters. Reads the denormalized rating summaries, so no feedback is aggregated.
+        """
+        def build():
+            try:
+                ordering = get_top_rated_ordering(request.query_params)
+                products = filter_marketplace(Product.objects.all(), request.query_params)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            try:
+                min_reviews = int(request.query_params.get('min_reviews') or getattr(settings, 'TOP_RATED_MIN_REVIEWS', 3))
+            except ValueError:
+                return Response({"detail": "min_reviews must be a whole number"}, status=status.HTTP_400_BAD_REQUEST)
             
-    #     Returns:
-    #         Response: JSON response containing related products
-    #     """
-    #     # Get the current product using the provided pk
-    #     product = self.get_object()
+            products = (
+                products.filter(rating_summary__count__gte=max(min_reviews, 1))
+                .order_by(*ordering)
+                .select_related(*SERIALIZER_RELATED)
+            )
+            
+            paginator = ProductSearchPagination()
+            page = paginator.paginate_queryset(products, request, view=self)
+            serializer = self.get_serializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        
+        return cached_response(request, 'product-top-rated', build)
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated, IsFarmer])
+    def bulk(self, request):
+        """
+        Create and update many of the farmer's products in one request.
+        
+        Accepts a JSON array of products (at most PRODUCT_BULK_MAX_ROWS) or a CSV file
+        upload ("file") with ProductSerializer fields as columns. Rows with an "id" update
+        that product; the others create products. Nothing is saved unless every row is
+        valid; otherwise the response lists the errors by row (array index, or CSV line).
         
-    #     # Find related products with the same category, excluding the current product
-    #     # Limit to 5 products to avoid overwhelming the UI
-    #     related = Product.objects.filter(category=product.category).exclude(id=product.id)[:5]
+        CSV files larger than PRODUCT_IMPORT_SYNC_MAX_BYTES are imported in the
+        background: the response is 202 with the import job, see import_status.
+        """
+        upload = request.FILES.get('file')
+        if upload is not None:
+            if upload.size > getattr(settings, 'PRODUCT_IMPORT_SYNC_MAX_BYTES', 256 * 1024):
+                job = ProductImport.objects.create(farmer=request.user, file=upload)
+                schedule_import(job)
+                logger.info(f"Product import {job.id} queued for user {request.user.email}")
+                return Response(
+                    self.import_job_data(request, job),
+                    status=status.HTTP_202_ACCEPTED
+                )
+            rows = read_csv(upload)
+        elif isinstance(request.data, list):
+            max_rows = getattr(settings, 'PRODUCT_BULK_MAX_ROWS', 500)
+            if len(request.data) > max_rows:
+                return Response(
+                    {"detail": f"At most {max_rows} products per request; upload a CSV file for larger imports"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            rows = enumerate(request.data)
+        else:
+            return Response(
+                {"detail": "Send a JSON array of products or a CSV file"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            result = import_products(request.user, rows, self.get_serializer_context())
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response(
+                {"detail": f"Could not read the CSV file: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-    #     # Serialize the related products
-    #     serializer = self.get_serializer(related, many=True)
+        if result.error_count:
+            return Response(
+                {
+                    "detail": f"{result.error_count} of {result.rows} rows are invalid; no products were saved",
+                    "errors": result.errors,
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        prefetch_related_objects(result.created + result.updated, 'rating_summary', 'farmer__rating_summary')
+        return Response({
+            "created": self.get_serializer(result.created, many=True).data,
+            "updated": self.get_serializer(result.updated, many=True).data,
+        })
+    
+    @action(detail=False, methods=['get'], url_path=r'imports/(?P<import_id>\d+)',
+            permission_classes=[IsAuthenticated, IsFarmer])
+    def import_status(self, request, import_id=None):
+        """
+        Status of one of the farmer's background CSV imports (see bulk).
+        """
+        job = ProductImport.objects.filter(id=import_id, farmer=request.user).first()
+        if job is None:
+            return Response({"detail": "Import not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.import_job_data(request, job))
+    
+    def import_job_data(self, request, job):
+        return {
+            "id": job.id,
+            "status": job.status,
+            "rows": job.rows,
+            "created": job.created_count,
+            "updated": job.updated_count,
+            "error_count": job.error_count,
+            "errors": job.errors,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "url": request.build_absolute_uri(reverse('product-import-status', args=[job.id])),
+        }
+    
+    @action(detail=True, methods=['get'], url_path='related')
+    def related_products(self, request, pk=None):
+        """
+        Get products related to the current product, most related first.
+        
+        Relations come from what the same customers bought or asked about, with similar
+        and same-category products as fallbacks (see products/recommendations.py). The
+        precomputed list is read from memory, so this costs one query for the products.
+        Products added since the last refresh get the newest products of their category.
+        
+        Args:
+            request: The HTTP request
+            pk: The primary key (ID) of the product to find related items for
+            
+        Returns:
+            Response: JSON response containing related products
+        """
+        try:
+            product_id = int(pk)
+        except ValueError:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
         
-    #     # Return the serialized related products
-    #     return Response(serializer.data)
+        neighbour_ids = related_product_ids(product_id)
+        if neighbour_ids is None:
+            product = self.get_object()
+            related = list(
+                Product.objects.filter(category=product.category).exclude(id=product.id)
+                .select_related(*SERIALIZER_RELATED)[:getattr(settings, 'RECOMMENDATION_NEIGHBOURS', 12)]
+            )
+        else:
+            # The product itself is fetched along to answer 404 once it is deleted
+            found = Product.objects.select_related(*SERIALIZER_RELATED).in_bulk([product_id] + neighbour_ids)
+            if product_id not in found:
+                return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+            related = [found[other] for other in neighbour_ids if other in found]
+
+        serializer = self.get_serializer(related, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'],
+            url_path=r'image/(?P<slot>[1-3])/(?P<size>\w+)/(?P<digest>[0-9a-f]{16})',
+            authentication_classes=[], permission_classes=[permissions.AllowAny])
+    def image(self, request, pk=None, slot=None, size=None, digest=None):
+        """
+        Serve a product image resized to one of PRODUCT_IMAGE_SIZES (see products/images.py).
+
+        These are the URLs in the serializer's image_variants. They are public, since
+        <img> tags send no token, and immutable, so browsers and CDNs may cache them for
+        PRODUCT_IMAGE_MAX_AGE. Cached copies are served without a database query; if the
+        source cannot be fetched or resized, or the product image has changed since the
+        URL was issued, the client is redirected to the current image instead.
+
+        Args:
+            request: The HTTP request
+            pk: The product ID
+            slot: 1, 2 or 3 for imageUrl, imageUrl2 or imageUrl3
+            size: A size name such as 'thumb'
+            digest: Identifies the source URL the resized image was made from
+
+        Returns:
+            HttpResponse: The WebP image, 304, or a redirect
+        """
+        pixels = get_sizes().get(size)
+        if pixels is None or not pk.isdigit():
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        name = variant_name(digest, pixels)
+        etag = f'"{name}"'
+        max_age = getattr(settings, 'PRODUCT_IMAGE_MAX_AGE', 365 * 24 * 60 * 60)
+
+        def immutable(response):
+            response['ETag'] = etag
+            response['Cache-Control'] = f'public, max-age={max_age}, immutable'
+            return response
+
+        if etag_matches(request, etag):
+            return immutable(HttpResponseNotModified())
+
+        file = get_disk_cache().open(name)
+        if file is None:
+            field = IMAGE_FIELDS[int(slot)]
+            url = Product.objects.filter(pk=pk).values_list(field, flat=True).first()
+            if not url:
+                return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+            if source_digest(url) != digest or not can_proxy(url):
+                redirect = image_variants(Product(pk=pk, **{field: url})).get(field, {}).get(size, url)
+                return self.temporary_redirect(redirect)
+            try:
+                file = open_variant(url, pixels)
+            except ImageUnavailable:
+                return self.temporary_redirect(url)
+
+        return immutable(FileResponse(file, content_type=CONTENT_TYPE))
+
+    def temporary_redirect(self, url):
+        response = HttpResponseRedirect(url)
+        response['Cache-Control'] = 'public, max-age=300'
+        return response
 
 class CloudinaryDeleteView(APIView):
     """
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Feedback, FeedbackResponse
+from .models import Feedback, FeedbackResponse, ProductRating, FarmerRating
+from .ratings import recompute_for_feedback
 
 @admin.register(Feedback)
 class FeedbackAdmin(admin.ModelAdmin):
@@ -10,6 +11,8 @@ class FeedbackAdmin(admin.ModelAdmin):
     
     def approve_feedback(self, request, queryset):
         queryset.update(is_approved=True)
+        # update() skips the signals that maintain the rating summaries
+        recompute_for_feedback(queryset)
         self.message_user(request, f"{queryset.count()} feedback entries approved.")
     approve_feedback.short_description = "Approve selected feedback"
 
@@ -17,3 +20,13 @@ class FeedbackAdmin(admin.ModelAdmin):
 class FeedbackResponseAdmin(admin.ModelAdmin):
     list_display = ['feedback', 'farmer', 'created_at']
     search_fields = ['response', 'farmer__email']
+
+@admin.register(ProductRating)
+class ProductRatingAdmin(admin.ModelAdmin):
+    list_display = ['product', 'average', 'count', 'updated_at']
+    readonly_fields = ['count', 'total', 'average', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5', 'updated_at']
+
+@admin.register(FarmerRating)
+class FarmerRatingAdmin(admin.ModelAdmin):
+    list_display = ['farmer', 'average', 'count', 'updated_at']
+    readonly_fields = ['count', 'total', 'average', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5', 'updated_at']
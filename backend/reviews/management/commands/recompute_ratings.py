@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product
+from reviews.models import ProductRating, FarmerRating
+from reviews.ratings import recompute_summaries
+
+User = get_user_model()
+
+
+'''
+recompute_ratings: Rebuilds the product and farmer rating summaries from approved feedback
+Summaries are maintained incrementally (reviews/ratings.py); this repairs any drift,
+e.g. after feedback was changed with queryset.update() or directly in the database.
+Products and farmers are processed in batches, each in its own short transaction that
+holds back incremental updates to the batch's summaries while it is recounted.
+
+Example:
+    python manage.py recompute_ratings --batch-size 1000
+'''
+
+
+class Command(BaseCommand):
+    help = 'Recompute product and farmer rating summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Products or farmers recomputed per transaction (default: 500)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        targets = (
+            ('products', ProductRating, Product.objects.all()),
+            ('farmers', FarmerRating, User.objects.filter(user_type=User.UserType.FARMER)),
+        )
+        for label, model, queryset in targets:
+            checked = fixed = 0
+            for batch in self.batches(queryset.order_by('pk').values_list('pk', flat=True), batch_size):
+                fixed += recompute_summaries(model, batch)
+                checked += len(batch)
+            self.stdout.write(self.style.SUCCESS(f'Checked {checked} {label}, corrected {fixed} rating summaries'))
+
+    def batches(self, ids, size):
+        batch = []
+        for pk in ids.iterator(chunk_size=size):
+            batch.append(pk)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
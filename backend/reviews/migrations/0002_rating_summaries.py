@@ -0,0 +1,69 @@
+# Generated by Django 5.1.3 on 2026-10-19 11:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def build_summaries(apps, schema_editor):
+    # Summaries for the feedback approved before they existed
+    Feedback = apps.get_model('reviews', 'Feedback')
+    approved = Feedback.objects.filter(is_approved=True, rating__gte=1, rating__lte=5)
+    stars = {f'stars_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)}
+    for model_name, group_field in (('ProductRating', 'product_id'), ('FarmerRating', 'farmer_id')):
+        model = apps.get_model('reviews', model_name)
+        rows = approved.values(group_field).annotate(count=Count('id'), total=Sum('rating'), **stars).order_by()
+        model.objects.bulk_create(
+            [model(pk=row.pop(group_field), average=row['total'] / row['count'], **row) for row in rows],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_import'),
+        ('reviews', '0001_initial'),
+        ('users', '0008_customuser_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FarmerRating',
+            fields=[
+                ('count', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('farmer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('count', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-average', '-count', '-product'], name='product_rating_average_idx'), models.Index(fields=['-count', '-average', '-product'], name='product_rating_count_idx')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
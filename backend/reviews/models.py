@@ -40,3 +40,50 @@ class FeedbackResponse(models.Model):
     
     def __str__(self):
         return f"Response to Feedback for Order {self.feedback.order.id}"
+
+class RatingSummary(models.Model):
+    """
+    Aggregate of approved feedback ratings, kept up to date incrementally as feedback
+    is approved, changed or deleted (see reviews/ratings.py).
+    """
+    count = models.IntegerField(default=0)    # Number of approved ratings
+    total = models.IntegerField(default=0)    # Sum of approved ratings
+    average = models.FloatField(default=0)    # total / count, stored so it can be indexed
+    # Histogram: number of approved ratings of each star
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        abstract = True
+    
+    def histogram(self):
+        return {str(star): getattr(self, f'stars_{star}') for star in range(1, 6)}
+
+class ProductRating(RatingSummary):
+    """
+    Rating summary of a product (Product.rating_summary).
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    
+    def __str__(self):
+        return f"Rating of product {self.product_id}: {self.average:.2f} ({self.count})"
+    
+    class Meta:
+        indexes = [
+            # Top rated listing (products/filters.py TOP_RATED_SORTS)
+            models.Index(fields=['-average', '-count', '-product'], name='product_rating_average_idx'),
+            models.Index(fields=['-count', '-average', '-product'], name='product_rating_count_idx'),
+        ]
+
+class FarmerRating(RatingSummary):
+    """
+    Rating summary over all of a farmer's products (CustomUser.rating_summary).
+    """
+    farmer = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    
+    def __str__(self):
+        return f"Rating of farmer {self.farmer_id}: {self.average:.2f} ({self.count})"
@@ -0,0 +1,151 @@
+import logging
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+from products.cache import invalidate_catalogue
+from .models import Feedback, ProductRating, FarmerRating
+
+logger = logging.getLogger(__name__)
+
+'''
+ratings.py: Per-product and per-farmer rating summaries (ProductRating, FarmerRating)
+rating_state(): The part of a Feedback that counts towards the summaries
+apply_change(): Moves the summaries from a feedback's old state to its new one
+recompute_summaries(): Rebuilds summaries from the approved feedback (repairs drift)
+
+Only approved feedback with a rating of 1 to 5 counts. Approving, editing or deleting a
+feedback (reviews/signals.py) changes its product's and farmer's summaries with a single
+UPDATE of relative F() expressions (count + 1, total + rating, one histogram bucket + 1,
+and the average recomputed from those in the same statement), so concurrent changes
+never overwrite each other and showing a rating never aggregates the feedback table.
+
+Queryset.update() and bulk operations on Feedback bypass the signals: callers must
+recompute the affected summaries (as the admin approve action does), or run the
+recompute_ratings command.
+'''
+
+SUMMARIES = (
+    # (summary model, its primary key field, the Feedback field it groups by)
+    (ProductRating, 'product', 'product_id'),
+    (FarmerRating, 'farmer', 'farmer_id'),
+)
+STAR_FIELDS = {star: f'stars_{star}' for star in range(1, 6)}
+SUMMARY_FIELDS = ['count', 'total', 'average'] + list(STAR_FIELDS.values())
+
+
+def rating_state(feedback):
+    """
+    (rating, product_id, farmer_id) if the feedback counts towards the summaries, else None.
+    """
+    if not feedback.is_approved:
+        return None
+    try:
+        # Feedback created from request data may still hold the rating as a string
+        rating = int(feedback.rating)
+    except (TypeError, ValueError):
+        return None
+    if rating not in STAR_FIELDS:
+        return None
+    return rating, feedback.product_id, feedback.farmer_id
+
+
+def add_rating(model, key, rating, sign):
+    count = F('count') + sign
+    total = F('total') + sign * rating
+    values = {
+        'count': count,
+        'total': total,
+        # Every expression reads the old row, so the average uses the new count and total
+        'average': Coalesce(Cast(total, FloatField()) / NullIf(count, Value(0)), Value(0.0)),
+        STAR_FIELDS[rating]: F(STAR_FIELDS[rating]) + sign,
+        'updated_at': timezone.now(),
+    }
+    if model.objects.filter(pk=key).update(**values):
+        return
+    if sign < 0:
+        # No summary to take the rating from: deleting a product or farmer cascades to
+        # its summary before (or after) its feedback, so the row may already be gone
+        return
+    # First rating: create the row (unless a concurrent request just did) and update it
+    model.objects.bulk_create([model(pk=key)], ignore_conflicts=True)
+    model.objects.filter(pk=key).update(**values)
+
+
+def apply_change(old_state, new_state):
+    """
+    Update the summaries for a feedback that went from old_state to new_state
+    (rating_state() values).
+    """
+    if old_state == new_state:
+        return
+    with transaction.atomic():
+        for state, sign in ((old_state, -1), (new_state, 1)):
+            if state is None:
+                continue
+            rating, product_id, farmer_id = state
+            add_rating(ProductRating, product_id, rating, sign)
+            add_rating(FarmerRating, farmer_id, rating, sign)
+        # Ratings are part of the catalogue's product representation
+        invalidate_catalogue()
+
+
+def recompute_summaries(model, keys):
+    """
+    Rebuild the summaries of `keys` (product or farmer ids) from approved feedback.
+    Returns how many summaries were wrong.
+    """
+    pk_field, group_field = next((pk, group) for m, pk, group in SUMMARIES if m is model)
+    keys = list(keys)
+    fixed = 0
+    with transaction.atomic():
+        # Incremental updates to these rows wait until the recount is written
+        existing = {summary.pk: summary for summary in model.objects.select_for_update().filter(pk__in=keys)}
+        rows = (
+            Feedback.objects
+            .filter(is_approved=True, rating__gte=1, rating__lte=5, **{f'{group_field}__in': keys})
+            .values(group_field)
+            .annotate(
+                count=Count('id'),
+                total=Sum('rating'),
+                **{field: Count('id', filter=Q(rating=star)) for star, field in STAR_FIELDS.items()}
+            )
+        )
+        expected = {}
+        for row in rows:
+            row['average'] = row['total'] / row['count']
+            expected[row.pop(group_field)] = row
+
+        to_write = []
+        for key, values in expected.items():
+            summary = existing.get(key)
+            if summary is not None and all(
+                getattr(summary, field) == values[field] for field in SUMMARY_FIELDS if field != 'average'
+            ):
+                continue
+            fixed += 1
+            to_write.append(model(pk=key, updated_at=timezone.now(), **values))
+        stale = [key for key in existing if key not in expected]
+        fixed += len(stale)
+
+        if to_write:
+            model.objects.bulk_create(
+                to_write,
+                update_conflicts=True,
+                unique_fields=[pk_field],
+                update_fields=SUMMARY_FIELDS + ['updated_at'],
+            )
+        if stale:
+            model.objects.filter(pk__in=stale).delete()
+        if fixed:
+            invalidate_catalogue()
+    return fixed
+
+
+def recompute_for_feedback(feedback_queryset):
+    """
+    Rebuild the summaries of the products and farmers of the given feedback.
+    """
+    pairs = list(feedback_queryset.values_list('product_id', 'farmer_id').distinct())
+    recompute_summaries(ProductRating, {product_id for product_id, _ in pairs})
+    recompute_summaries(FarmerRating, {farmer_id for _, farmer_id in pairs})
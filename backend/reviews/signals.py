@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from .models import Feedback
+from .ratings import apply_change, rating_state
+
+'''
+signals.py: Keeps the rating summaries (reviews/ratings.py) current
+Each Feedback remembers the state it was loaded or last saved with, so a save only
+changes the summaries when its approval or rating actually changed.
+'''
+
+
+@receiver(post_init, sender=Feedback)
+def remember_rating(sender, instance, **kwargs):
+    instance._rating_state = rating_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Feedback)
+def feedback_saved(sender, instance, **kwargs):
+    new_state = rating_state(instance)
+    apply_change(instance._rating_state, new_state)
+    instance._rating_state = new_state
+
+
+@receiver(post_delete, sender=Feedback)
+def feedback_deleted(sender, instance, **kwargs):
+    apply_change(instance._rating_state, None)
+    instance._rating_state = None
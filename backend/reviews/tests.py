@@ -0,0 +1,208 @@
+from io import StringIO
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+from orders.models import Order
+from products.models import Product
+from users.models import CustomUser
+from .models import Feedback, ProductRating, FarmerRating
+from .ratings import recompute_summaries
+
+'''
+tests.py: Rating summary tests
+RatingSummaryTests: Approving, editing, unapproving and deleting feedback keep the summaries current
+RecomputeTests: recompute_summaries and the recompute_ratings command repair drift
+TopRatedTests: The top-rated listing orders by the summaries and honours min_reviews
+'''
+
+
+def create_user(number, user_type):
+    return CustomUser.objects.create_user(
+        f'+92300{number:07d}', f'{user_type.lower()}{number}@example.com', f'User {number}',
+        user_type, 'Punjab', 'Lahore', password='password'
+    )
+
+
+def create_product(farmer, name='Mango'):
+    return Product.objects.create(
+        farmer=farmer, productName=name, category='Fruits', description='Fresh', price=10, stockQuantity=5,
+    )
+
+
+def rate(product, customer, rating, approved=True):
+    order = Order.objects.create(user=customer, total=10)
+    return Feedback.objects.create(
+        order=order, product=product, farmer=product.farmer, customer=customer,
+        rating=rating, is_approved=approved,
+    )
+
+
+class RatingTestCase(TestCase):
+    def setUp(self):
+        self.farmer = create_user(1, 'FARMER')
+        self.customer = create_user(2, 'CUSTOMER')
+        self.product = create_product(self.farmer)
+
+    def assertSummary(self, model, key, count, total, histogram):
+        summary = model.objects.get(pk=key)
+        self.assertEqual(summary.count, count)
+        self.assertEqual(summary.total, total)
+        self.assertAlmostEqual(summary.average, total / count if count else 0)
+        self.assertEqual(summary.histogram(), {str(star): histogram.get(star, 0) for star in range(1, 6)})
+
+    def assertRated(self, count, total, histogram):
+        self.assertSummary(ProductRating, self.product.pk, count, total, histogram)
+        self.assertSummary(FarmerRating, self.farmer.pk, count, total, histogram)
+
+
+class RatingSummaryTests(RatingTestCase):
+    """
+    Feedback signals (reviews/signals.py) moving the summaries incrementally.
+    """
+    def test_unapproved_feedback_does_not_count(self):
+        rate(self.product, self.customer, 4, approved=False)
+        self.assertFalse(ProductRating.objects.exists())
+        self.assertFalse(FarmerRating.objects.exists())
+
+    def test_approve(self):
+        feedback = rate(self.product, self.customer, 4, approved=False)
+        rate(self.product, self.customer, 2)
+
+        feedback.is_approved = True
+        feedback.save()
+        self.assertRated(2, 6, {4: 1, 2: 1})
+
+    def test_unapprove(self):
+        feedback = rate(self.product, self.customer, 4)
+        rate(self.product, self.customer, 5)
+
+        feedback.is_approved = False
+        feedback.save()
+        self.assertRated(1, 5, {5: 1})
+
+    def test_edit_rating(self):
+        feedback = rate(self.product, self.customer, 4)
+        rate(self.product, self.customer, 5)
+
+        feedback.rating = 1
+        feedback.save()
+        self.assertRated(2, 6, {1: 1, 5: 1})
+
+        # Saving without a rating change leaves the summaries alone
+        feedback.comment = 'Changed my mind'
+        feedback.save()
+        self.assertRated(2, 6, {1: 1, 5: 1})
+
+    def test_delete(self):
+        feedback = rate(self.product, self.customer, 4)
+        rate(self.product, self.customer, 3)
+
+        feedback.delete()
+        self.assertRated(1, 3, {3: 1})
+
+    def test_farmer_summary_spans_products(self):
+        other = create_product(self.farmer, 'Guava')
+        rate(self.product, self.customer, 5)
+        rate(other, self.customer, 2)
+
+        self.assertSummary(ProductRating, self.product.pk, 1, 5, {5: 1})
+        self.assertSummary(ProductRating, other.pk, 1, 2, {2: 1})
+        self.assertSummary(FarmerRating, self.farmer.pk, 2, 7, {5: 1, 2: 1})
+
+    def test_delete_product_with_rated_feedback(self):
+        other = create_product(self.farmer, 'Guava')
+        rate(self.product, self.customer, 4)
+        rate(other, self.customer, 2)
+
+        self.product.delete()
+        # Deferred foreign keys (PostgreSQL) are only checked here
+        connection.check_constraints()
+        self.assertFalse(ProductRating.objects.filter(pk=self.product.pk).exists())
+        self.assertSummary(FarmerRating, self.farmer.pk, 1, 2, {2: 1})
+
+    def test_delete_farmer_with_rated_feedback(self):
+        rate(self.product, self.customer, 4)
+        rate(create_product(self.farmer, 'Guava'), self.customer, 5)
+
+        self.farmer.delete()
+        connection.check_constraints()
+        self.assertFalse(ProductRating.objects.exists())
+        self.assertFalse(FarmerRating.objects.exists())
+
+
+class RecomputeTests(RatingTestCase):
+    """
+    Rebuilding summaries that drifted from the feedback.
+    """
+    def test_repairs_drift(self):
+        rate(self.product, self.customer, 4)
+        rate(self.product, self.customer, 4)
+        # Bypasses the signals
+        Feedback.objects.filter(product=self.product).update(rating=2)
+
+        self.assertEqual(recompute_summaries(ProductRating, [self.product.pk]), 1)
+        self.assertEqual(recompute_summaries(FarmerRating, [self.farmer.pk]), 1)
+        self.assertRated(2, 4, {2: 2})
+        self.assertEqual(recompute_summaries(ProductRating, [self.product.pk]), 0)
+
+    def test_creates_missing_and_deletes_stale_summaries(self):
+        rate(self.product, self.customer, 5)
+        ProductRating.objects.all().delete()
+        stale = create_product(self.farmer, 'Guava')
+        ProductRating.objects.create(product=stale, count=3, total=9, average=3, stars_3=3)
+
+        self.assertEqual(recompute_summaries(ProductRating, [self.product.pk, stale.pk]), 2)
+        self.assertSummary(ProductRating, self.product.pk, 1, 5, {5: 1})
+        self.assertFalse(ProductRating.objects.filter(pk=stale.pk).exists())
+
+    def test_command(self):
+        rate(self.product, self.customer, 3)
+        ProductRating.objects.update(count=7)
+        FarmerRating.objects.all().delete()
+
+        out = StringIO()
+        call_command('recompute_ratings', '--batch-size', '1', stdout=out)
+        self.assertIn('corrected 1 rating summaries', out.getvalue())
+        self.assertRated(1, 3, {3: 1})
+
+
+class TopRatedTests(APITestCase):
+    """
+    GET /api/products/top-rated/
+    """
+    url = '/api/products/top-rated/'
+
+    def setUp(self):
+        caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')].clear()
+        farmer = create_user(1, 'FARMER')
+        customer = create_user(2, 'CUSTOMER')
+        # (name, ratings): averages 5, 4.5 and 4 from 1, 2 and 3 reviews
+        for name, ratings in [('Best', [5]), ('Good', [5, 4]), ('Popular', [4, 4, 4])]:
+            product = create_product(farmer, name)
+            for rating in ratings:
+                rate(product, customer, rating)
+        create_product(farmer, 'Unrated')
+        self.client.force_authenticate(customer)
+
+    def names(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['productName'] for product in response.data['results']]
+
+    def test_orders_by_average(self):
+        self.assertEqual(self.names(min_reviews=1), ['Best', 'Good', 'Popular'])
+
+    def test_orders_by_review_count(self):
+        self.assertEqual(self.names(min_reviews=1, sort='reviews'), ['Popular', 'Good', 'Best'])
+
+    def test_min_reviews(self):
+        self.assertEqual(self.names(min_reviews=2), ['Good', 'Popular'])
+        self.assertEqual(self.names(min_reviews=3), ['Popular'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'min_reviews': 'many'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'sort': 'price'}).status_code, status.HTTP_400_BAD_REQUEST)
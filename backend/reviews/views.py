@@ -5,20 +5,29 @@ from .models import Feedback, FeedbackResponse
 from .serializers import FeedbackSerializer, FeedbackResponseSerializer
 from orders.models import Order
 from chat.models import ChatRoom, ChatMessage
+from products.cache import catalogue_version
+from AgroConnect.conditional import ConditionalGetMixin
 import logging
 
 logger = logging.getLogger(__name__)
 
-class FeedbackViewSet(viewsets.ModelViewSet):
+class FeedbackViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing customer feedback.
     
     Provides CRUD operations for feedback with additional endpoints for
-    farmer responses and filtering by product or farmer.
+    farmer responses and filtering by product or farmer. List and detail
+    responses carry ETags and answer If-None-Match with 304.
     """
     queryset = Feedback.objects.all()
     serializer_class = FeedbackSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # The nested farmer response is part of each feedback's representation
+    conditional_fields = ('updated_at', 'response__updated_at')
+    
+    def get_conditional_extra(self, queryset):
+        # farmer_name and product_name change with the catalogue
+        return (catalogue_version(),)
     
     def get_queryset(self):
         """
@@ -0,0 +1,88 @@
+import math
+
+'''
+geo.py: Geohash helpers for locating farmers (CustomUser.latitude / longitude)
+encode_geohash(): Geohash of a coordinate, stored in CustomUser.geohash
+covering_prefixes(): Geohash prefixes whose cells cover a circle, for indexed prefix lookups
+
+A geohash names a cell of a grid that is refined five bits per character, so points
+close together share a prefix and "every farmer in these cells" is a range scan on the
+geohash index. covering_prefixes() picks the finest precision whose cells are still at
+least as large as the radius; the cell containing the centre plus its eight neighbours
+then contain the whole circle, and only exact distances need checking afterwards.
+'''
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9  # cells of about 5 m
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # bits alternate longitude, latitude, starting with longitude
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lng_range[0] = mid
+            else:
+                value *= 2
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value *= 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size_degrees(precision):
+    """
+    (height, width) of a geohash cell in degrees.
+    """
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """
+    Geohash prefixes of the cell containing the point and its neighbours, at a precision
+    where a cell is at least radius_km across, so together they contain the whole circle.
+    """
+    # Longitude degrees shrink towards the poles; size cells for the most poleward edge
+    edge_latitude = min(90.0, abs(latitude) + radius_km / KM_PER_DEGREE)
+    lng_km_per_degree = KM_PER_DEGREE * max(math.cos(math.radians(edge_latitude)), 1e-6)
+
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size_degrees(candidate)
+        if height * KM_PER_DEGREE >= radius_km and width * lng_km_per_degree >= radius_km:
+            precision = candidate
+            break
+
+    height, width = cell_size_degrees(precision)
+    prefixes = set()
+    for d_lat in (-height, 0.0, height):
+        lat = max(-90.0, min(90.0, latitude + d_lat))
+        for d_lng in (-width, 0.0, width):
+            lng = (longitude + d_lng + 180.0) % 360.0 - 180.0
+            prefixes.add(encode_geohash(lat, lng, precision))
+    return sorted(prefixes)
+
@@ -1,10 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-from django.core.validators import RegexValidator
+from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 # from django.utils import timezone
 
 import shortuuid
 
+from .geo import encode_geohash
+
 
 # Function to generate short UUIDs
 def generate_short_uuid():
@@ -119,6 +121,20 @@ class CustomUser(AbstractBaseUser):
         }
     )
 
+    # Optional farm location, used to find produce near a customer (products/nearby.py)
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    # Derived from the coordinates on save; indexed for prefix (cell) lookups
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False)
+
     date_joined = models.DateTimeField(auto_now_add=True)
 
     is_active = models.BooleanField(default=True)
@@ -140,6 +156,17 @@ class CustomUser(AbstractBaseUser):
         """String representation of the user"""
         return f"{self.full_name} ({self.user_type})"
 
+    def save(self, *args, **kwargs):
+        """Keep the geohash in step with the coordinates"""
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
     def has_perm(self, perm, obj=None):
         return self.is_superuser
 
@@ -1,4 +1,4 @@
-from djoser.serializers import UserCreateSerializer
+from djoser.serializers import UserCreateSerializer, UserSerializer
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from .models import NewsArticle
@@ -53,6 +53,24 @@ class UserCreateSerializer(UserCreateSerializer):
 
         return user
 
+class CurrentUserSerializer(UserSerializer):
+    """
+    Djoser's serializer for the signed-in user (/auth/users/me/), plus the optional
+    farm location used by the nearby-products search
+    """
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ('latitude', 'longitude')
+
+    def validate(self, attrs):
+        """
+        Validate that latitude and longitude are set (or cleared) together
+        """
+        latitude = attrs.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = attrs.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError('Latitude and longitude must be provided together')
+        return super().validate(attrs)
+
 class UserDetailSerializer(serializers.ModelSerializer):
     """
     Serializer for retrieving user details
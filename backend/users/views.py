@@ -10,6 +10,7 @@ from rest_framework.response import Response
 from .serializers import NewsArticleSerializer
 from django.contrib.auth import get_user_model
 from rest_framework.generics import ListAPIView
+from AgroConnect.conditional import ConditionalGetMixin
 from djoser.utils import encode_uid, decode_uid
 from djoser import utils
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -454,7 +455,7 @@ class ResendActivationEmailView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class NewsArticleListView(ListAPIView):
+class NewsArticleListView(ConditionalGetMixin, ListAPIView):
     """
     API view to retrieve news articles.
     
@@ -465,6 +466,8 @@ class NewsArticleListView(ListAPIView):
     Endpoints:
         GET /api/news/: Returns a list of all active news articles.
         GET /api/news/?category=wheat: Returns articles in the 'wheat' category.
+    
+    Responses carry an ETag; polling with If-None-Match gets 304 until articles change.
     """
     serializer_class = NewsArticleSerializer  # Serializer for converting NewsArticle models to JSON
     permission_classes = [AllowAny]  # Allow anyone to view news articles (public content)
@@ -3,7 +3,7 @@ import { Link } from 'react-router-dom';
 import ProductList from './ProductList';
 import Cart from './Cart';
 import { FaShoppingCart, FaSearch, FaBoxOpen } from 'react-icons/fa';
-import { getAllProducts } from '../../../Services/apiCustomerProducts';
+import { getProductsPage, getProductCategories, searchProducts } from '../../../Services/apiCustomerProducts';
 import LoadingSpinner from '../../../Components/Common/LoadingSpinner';
 import authService from '../../../Services/autheServices';
 import { useCart } from '../../../contexts/CartContext';
@@ -17,8 +17,11 @@ function CustomerDashboard() {
   const [searchTerm, setSearchTerm] = useState('');
   const [categoryFilter, setCategoryFilter] = useState('all');
   const [products, setProducts] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
+  const [searchResults, setSearchResults] = useState(null);
   const [categories, setCategories] = useState(['all']);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [error, setError] = useState(null);
   const [userId, setUserId] = useState(null);
 
@@ -58,42 +61,81 @@ function CustomerDashboard() {
 
 
 
-  // Fetch products from the API
+  // Categories are fixed (Product.CATEGORY_CHOICES), so they need no product download
   useEffect(() => {
+    getProductCategories().then(list => setCategories(['all', ...list]));
+  }, []);
+
+  // Fetch the first page of products, filtered by category on the server
+  useEffect(() => {
+    let cancelled = false;
     const fetchProducts = async () => {
       try {
         setIsLoading(true);
-        const data = await getAllProducts();
-        setProducts(data);
-        
-        // Extract unique categories
-        const uniqueCategories = ['all', ...new Set(data.map(product => product.category))];
-        setCategories(uniqueCategories);
-        
+        const params = categoryFilter === 'all' ? {} : { category: categoryFilter };
+        const page = await getProductsPage(params);
+        if (cancelled) return;
+        setProducts(page.results);
+        setNextPage(page.next);
         setError(null);
       } catch (err) {
         console.error('Error fetching products:', err);
-        setError('Failed to load products. Please try again later.');
+        if (!cancelled) setError('Failed to load products. Please try again later.');
       } finally {
-        setIsLoading(false);
+        if (!cancelled) setIsLoading(false);
       }
     };
 
     fetchProducts();
-  }, []);
+    return () => {
+      cancelled = true;
+    };
+  }, [categoryFilter]);
 
-  // Filter products based on search term and category
-  const filteredProducts = products.filter(product => {
-    const matchesSearch = 
-      product.productName.toLowerCase().includes(searchTerm.toLowerCase()) || 
-      (product.farmer_name && product.farmer_name.toLowerCase().includes(searchTerm.toLowerCase())) ||
-      (product.farmer_city && product.farmer_city.toLowerCase().includes(searchTerm.toLowerCase())) ||
-      (product.description && product.description.toLowerCase().includes(searchTerm.toLowerCase()));
+  // Fetch the next page when the customer asks for more
+  const loadMore = async () => {
+    if (!nextPage || isLoadingMore) return;
+    try {
+      setIsLoadingMore(true);
+      const page = await getProductsPage({}, nextPage);
+      setProducts(current => [...current, ...page.results]);
+      setNextPage(page.next);
+    } catch (err) {
+      console.error('Error fetching more products:', err);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  // Search on the server while a search term is entered (debounced)
+  useEffect(() => {
+    const query = searchTerm.trim();
+    if (!query) {
+      setSearchResults(null);
+      return;
+    }
     
-    const matchesCategory = categoryFilter === 'all' || product.category === categoryFilter;
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const params = categoryFilter === 'all' ? {} : { category: categoryFilter };
+        const data = await searchProducts(query, params);
+        if (!cancelled) setSearchResults(data.results);
+      } catch (err) {
+        console.error('Error searching products:', err);
+        if (!cancelled) setSearchResults([]);
+      }
+    }, 300);
     
-    return matchesSearch && matchesCategory;
-  });
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchTerm, categoryFilter]);
+
+  // Search results and pages are already filtered by category on the server
+  const isSearching = Boolean(searchTerm.trim());
+  const filteredProducts = isSearching ? (searchResults ?? []) : products;
 
   return (
     <div className="w-full max-w-full overflow-x-hidden px-4">
@@ -105,7 +147,7 @@ function CustomerDashboard() {
               type="text"
               value={searchTerm}
               onChange={(e) => setSearchTerm(e.target.value)}
-              placeholder="Search products, farmers, or cities..."
+              placeholder="Search products, categories, or cities..."
               className="w-full p-3 pl-12 border-2 border-green-500 rounded-full focus:outline-none focus:ring-2 focus:ring-green-500 focus:border-transparent shadow-sm text-gray-700"
             />
             <div className="absolute inset-y-0 left-0 flex items-center pl-4 pointer-events-none">
@@ -177,9 +219,22 @@ function CustomerDashboard() {
             </button>
           </div>
         ) : (
-          <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
-            <ProductList products={filteredProducts} addToCart={addToCart} />
-          </div>
+          <>
+            <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
+              <ProductList products={filteredProducts} addToCart={addToCart} />
+            </div>
+            {!isSearching && nextPage && (
+              <div className="flex justify-center mt-8">
+                <button
+                  onClick={loadMore}
+                  disabled={isLoadingMore}
+                  className="px-6 py-2 bg-green-500 text-white rounded-full hover:bg-green-600 disabled:opacity-50"
+                >
+                  {isLoadingMore ? 'Loading...' : 'Load more products'}
+                </button>
+              </div>
+            )}
+          </>
         )}
       </div>
       
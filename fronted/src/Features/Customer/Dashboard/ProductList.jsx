@@ -33,7 +33,11 @@ function ProductList({ products }) {
           {/* Product Image with Link */}
           <Link to={`/products/${product.id}`} className="relative block">
             <img 
-              src={product.imageUrl || 'https://via.placeholder.com/300x200?text=No+Image'} 
+              src={product.image_variants?.imageUrl?.small || product.imageUrl || 'https://via.placeholder.com/300x200?text=No+Image'} 
+              srcSet={product.image_variants?.imageUrl
+                ? `${product.image_variants.imageUrl.small} 400w, ${product.image_variants.imageUrl.medium} 800w`
+                : undefined}
+              sizes="(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw"
               alt={product.productName} 
               className="w-full h-56 object-cover"
               loading="lazy"
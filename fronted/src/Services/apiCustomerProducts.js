@@ -4,21 +4,45 @@ import authService from './authService';
 // Base URL for API requests
 const API_URL = `${import.meta.env.VITE_BACKEND_DOMAIN}/api`;
 
+/**
+ * Fetches one page of the marketplace listing
+ * @param {Object} params - Filters and sort (category, min_price, max_price, min_discount,
+ *                          in_stock, city, sort, page_size)
+ * @param {string|null} cursorUrl - "next" link of the previous page, if any
+ * @returns {Promise<Object>} { next, previous, results }
+ */
+export async function getProductsPage(params = {}, cursorUrl = null) {
+    // Get authentication token if available (for authenticated users)
+    const token = authService.getToken();
+    const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
+    
+    // The "next" link already carries the filters and the cursor
+    const response = cursorUrl
+        ? await axios.get(cursorUrl, { headers })
+        : await axios.get(`${API_URL}/products/all/`, { headers, params });
+    
+    return response.data;
+}
+
 /**
  * Fetches all available products for customers
- * Unlike the farmer's getProduct function, this doesn't filter by farmer
+ * Unlike the farmer's getProduct function, this doesn't filter by farmer.
+ * This downloads the whole (filtered) catalogue; listings should page with getProductsPage
+ * @param {Object} params - Optional server-side filters (see getProductsPage)
  * @returns {Promise<Array>} Array of product objects
  */
-export async function getAllProducts() {
+export async function getAllProducts(params = {}) {
     try {
-        // Get authentication token if available (for authenticated users)
-        const token = authService.getToken();
-        const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
-        
-        // Fetch all products from the API
-        const response = await axios.get(`${API_URL}/products/all/`, { headers });
+        // Follow the paginated listing until the last page
+        const products = [];
+        let page = await getProductsPage({ page_size: 100, ...params });
+        products.push(...page.results);
+        while (page.next) {
+            page = await getProductsPage({}, page.next);
+            products.push(...page.results);
+        }
         
-        return response.data;
+        return products;
     } catch (error) {
         console.error('Error fetching all products:', error);
         
@@ -32,19 +56,80 @@ export async function getAllProducts() {
 }
 
 /**
- * Fetches unique categories from the products
+ * Searches products on the server (ranked by relevance, typo tolerant)
+ * @param {string} query - Search text, matched against name, description, category and farmer city
+ * @param {Object} params - Optional marketplace filters (category, city, in_stock, page, page_size, ...)
+ * @returns {Promise<Object>} { count, next, previous, results, facets, corrections }
+ */
+export async function searchProducts(query, params = {}) {
+    // Get authentication token if available (for authenticated users)
+    const token = authService.getToken();
+    const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
+    
+    const response = await axios.get(`${API_URL}/products/search/`, {
+        headers,
+        params: { q: query, page_size: 100, ...params }
+    });
+    
+    return response.data;
+}
+
+/**
+ * Fetches products from farms near a location, nearest first
+ * @param {Object} params - lat, lng (default: the saved profile location), radius_km,
+ *                          page, page_size and the marketplace filters
+ * @returns {Promise<Object>} { count, next, previous, results } with distance_km on each product
+ */
+export async function getNearbyProducts(params = {}) {
+    // Get authentication token if available (for authenticated users)
+    const token = authService.getToken();
+    const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
+    
+    const response = await axios.get(`${API_URL}/products/nearby/`, { headers, params });
+    
+    return response.data;
+}
+
+/**
+ * Fetches the best rated products
+ * @param {Object} params - sort ('rating' or 'reviews'), min_reviews, page, page_size
+ *                          and the marketplace filters
+ * @returns {Promise<Object>} { count, next, previous, results }; each product has
+ *                            rating { count, average, histogram } and farmer_rating
+ */
+export async function getTopRatedProducts(params = {}) {
+    // Get authentication token if available (for authenticated users)
+    const token = authService.getToken();
+    const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
+    
+    const response = await axios.get(`${API_URL}/products/top-rated/`, { headers, params });
+
+    return response.data;
+}
+
+/**
+ * Fetches products related to a product (bought or asked about by the same customers)
+ * @param {number} productId - ID of the product
+ * @returns {Promise<Array>} Related products, most related first
+ */
+export async function getRelatedProducts(productId) {
+    const token = authService.getToken();
+    const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
+
+    const response = await axios.get(`${API_URL}/products/${productId}/related/`, { headers });
+
+    return response.data;
+}
+
+// Product categories; keep in sync with Product.CATEGORY_CHOICES in backend/products/models.py
+export const PRODUCT_CATEGORIES = ['Vegetables', 'Fruits', 'Crops'];
+
+/**
+ * Returns the product categories
  * @returns {Promise<Array>} Array of category strings
  */
 export async function getProductCategories() {
-    try {
-        const products = await getAllProducts();
-        // Extract unique categories
-        const categories = [...new Set(products.map(product => product.category))];
-        return categories;
-    } catch (error) {
-        console.error('Error fetching product categories:', error);
-        return []; // Return empty array on error
-    }
+    return PRODUCT_CATEGORIES;
 }
 
 /**
@@ -54,11 +139,8 @@ export async function getProductCategories() {
  */
 export async function getProductsByCategory(category) {
     try {
-        const products = await getAllProducts();
-        // Filter products by category if a category is specified
-        return category === 'all' 
-            ? products 
-            : products.filter(product => product.category === category);
+        // Filter products by category on the server if a category is specified
+        return await getAllProducts(category === 'all' ? {} : { category });
     } catch (error) {
         console.error(`Error fetching products by category ${category}:`, error);
         return []; // Return empty array on error
@@ -102,4 +102,39 @@ export async function deleteProduct(productId) {
     console.error("Error deleting product:", error);
     throw new Error(error.response?.data?.message || "Product could not be deleted");
   }
-}
\ No newline at end of file
+}
+/**
+ * Creates and updates many products at once.
+ * @param {Array<Object>|File} products - Array of products (those with an id are updated) or a CSV file
+ * @returns {Promise<Object>} { created, updated } for imports done immediately, or the
+ * background import job (status 202) for large CSV files; poll it with getProductImport
+ * A 400 response carries { detail, errors: [{ row, errors }] } and nothing is saved
+ */
+export async function bulkImportProducts(products) {
+  const token = authService.getToken();
+  const headers = { 'Authorization': `Bearer ${token}` };
+
+  let body = products;
+  if (products instanceof File) {
+    body = new FormData();
+    body.append('file', products);
+  }
+
+  const response = await axios.post(`${API_URL}/products/bulk/`, body, { headers });
+  return response.data;
+}
+
+/**
+ * Fetches the status of a background product import.
+ * @param {number} importId - ID returned by bulkImportProducts
+ * @returns {Promise<Object>} { id, status, rows, created, updated, error_count, errors, ... }
+ */
+export async function getProductImport(importId) {
+  const token = authService.getToken();
+  const response = await axios.get(`${API_URL}/products/imports/${importId}/`, {
+    headers: {
+      'Authorization': `Bearer ${token}`
+    }
+  });
+  return response.data;
+}